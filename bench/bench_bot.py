@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_bot.py
+# ============
+# Offline benchmark of the bot: SplatBot.on_message is driven with
+# synthetic updates, without Telegram and without the real rfprobe.
+#   - the Telegram API is replaced by an in-process fake bot, that answers
+#     after a configurable latency (default 0)
+#   - rfprobe is replaced by a shell script that waits DELAY seconds and
+#     writes the outputs (graph, report, reduced report)
+# Each chat sends, for each round: a location and the site name (setpos), site (2),
+# list, cnv, ant, calc, rep, pow, del. The chats run at the same time.
+# The bot modules are copied in a temporary directory, so the databases,
+# the cache and the user files of the benchmark are removed at the end.
+# The result cache is disabled (BOTRF_CACHE_MB=0), so each analysis runs rfprobe,
+# and the outbound messages are not rate limited (BOTRF_SEND_RATE=0).
+#
+# Report: messages/s, latency percentiles of each command, peak RSS.
+#
+# Use:
+#   python3 bench/bench_bot.py [n. of chats] [rounds] [rfprobe delay (s)] [api latency (s)]
+#
+import sys
+import io
+import os
+import os.path
+import time
+import glob
+import shutil
+import asyncio
+import tempfile
+import logging
+import resource
+import contextlib
+import collections
+
+FAKE_RFPROBE = '''#!/bin/sh
+# fake rfprobe: wait, then write the outputs of -H <out>.png or -pw <out>.txt
+while [ $# -gt 0 ]; do
+    case "$1" in -H|-pw) out="$2"; shift;; esac
+    shift
+done
+sleep %s
+base="${out%%.*}"
+# different images, so they are uploaded and not sent by file_id
+echo "png $base $$" > "$base.png"
+printf 'Path profile report\\n\\nObstructions:\\nNo obstructions to LOS path\\n' > "$base.txt"
+printf 'No obstructions to LOS path\\n60%%%% of the first Fresnel zone is clear\\n' > "${base}_red.txt"
+'''
+
+# -----------------------------------------------------
+# listener of a chat handler: the messages are passed directly to on_message,
+# the options set by telepot.helper.ChatHandler are ignored
+class FakeListener(object):
+    def set_options(self, **options):
+        pass
+
+    def capture(self, **criteria):
+        pass
+
+# Telegram API in process: each call waits latency s and returns a plausible reply
+class FakeBot(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.nfile = 0
+
+    def create_listener(self):
+        return FakeListener()
+
+    @asyncio.coroutine
+    def _call(self, method):
+        self.calls[method] = self.calls[method] + 1
+        if self.latency > 0:
+            yield from asyncio.sleep(self.latency)
+
+    @asyncio.coroutine
+    def sendMessage(self, chat_id, text, **kwargs):
+        yield from self._call('sendMessage')
+        return {'message_id': self.calls['sendMessage'], 'chat': {'id': chat_id}, 'text': text}
+
+    @asyncio.coroutine
+    def sendPhoto(self, chat_id, photo, **kwargs):
+        yield from self._call('sendPhoto')
+        self.nfile = self.nfile + 1
+        return {'message_id': self.nfile, 'chat': {'id': chat_id},
+                'photo': [{'file_id': 'photo%d' % self.nfile}]}
+
+    @asyncio.coroutine
+    def sendDocument(self, chat_id, document, **kwargs):
+        yield from self._call('sendDocument')
+        self.nfile = self.nfile + 1
+        return {'message_id': self.nfile, 'chat': {'id': chat_id},
+                'document': {'file_id': 'doc%d' % self.nfile}}
+
+    # the other methods of telepot.helper.Sender
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        @asyncio.coroutine
+        def call(chat_id, *args, **kwargs):
+            yield from self._call(method)
+            return {'chat': {'id': chat_id}}
+        return call
+
+# -----------------------------------------------------
+def text_msg(chat_id, n, text):
+    return {'message_id': n, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'bench'},
+            'from': {'id': chat_id, 'first_name': 'bench'}}
+
+def location_msg(chat_id, n, lat, lon):
+    return {'message_id': n, 'date': int(time.time()),
+            'location': {'latitude': lat, 'longitude': lon},
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'bench'},
+            'from': {'id': chat_id, 'first_name': 'bench'}}
+
+# messages of a round: (label, message).
+# The sites are a few km apart, so the quick check does not stop the analyses
+def round_messages(chat_id, n):
+    texts = [
+        ('site', 'site tx 45.5000 11.2000 20'),
+        ('site', 'site rx 45.5200 11.2400 15'),
+        ('list', 'list'),
+        ('cnv', 'cnv 30 dbm mw'),
+        ('ant', 'ant rx 18'),
+        ('calc', 'calc tx rx'),
+        ('rep', 'rep tx rx'),
+        ('pow', 'pow tx rx 18.0 -2.0 14.0 11.0 -1.0 -90.0'),
+        ('del', 'del home'),
+        ]
+    msgs = [('location', location_msg(chat_id, n, 45.51, 11.22)),
+            ('setpos', text_msg(chat_id, n + 1, 'home 10'))]
+    for i, (label, text) in enumerate(texts):
+        msgs.append((label, text_msg(chat_id, n + 2 + i, text)))
+    return msgs
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+# -----------------------------------------------------
+# the messages of a chat are handled in order, as by the telepot delegator
+@asyncio.coroutine
+def run_chat(splatbot, fakebot, chat_id, rounds, latencies):
+    handler = None
+    n = 1
+    for r in range(rounds):
+        for label, msg in round_messages(chat_id, n):
+            n = n + 1
+            if handler is None:
+                handler = splatbot.SplatBot((fakebot, msg, chat_id), 60)
+            t = time.perf_counter()
+            yield from handler.on_message(msg)
+            latencies[label].append(time.perf_counter() - t)
+    # handler closed as by the timeout of the delegator
+    handler.on_close(splatbot.telepot.exception.WaitTooLong())
+
+def bench(splatbot, fakebot, nchats, rounds):
+    latencies = collections.defaultdict(list)
+    loop = asyncio.get_event_loop()
+    t = time.perf_counter()
+    # the output of the bot (reports printed, handlers closed) is discarded
+    with contextlib.redirect_stdout(io.StringIO()):
+        loop.run_until_complete(asyncio.gather(
+            *[run_chat(splatbot, fakebot, 1000 + i, rounds, latencies) for i in range(nchats)]))
+        loop.run_until_complete(splatbot.outbox.join())
+    elapsed = time.perf_counter() - t
+    nmsgs = sum(len(v) for v in latencies.values())
+    print('%d chats x %d rounds: %d messages in %.2f s, %.1f msgs/s' % (
+        nchats, rounds, nmsgs, elapsed, nmsgs / elapsed))
+    print('%-10s %6s %10s %10s %10s %10s' % ('command', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for label in sorted(latencies):
+        values = latencies[label]
+        print('%-10s %6d %10.2f %10.2f %10.2f %10.2f' % (label, len(values),
+              percentile(values, 50) * 1e3, percentile(values, 90) * 1e3,
+              percentile(values, 99) * 1e3, max(values) * 1e3))
+    print('Telegram API calls: ' + ', '.join('%s %d' % kv for kv in sorted(fakebot.calls.items())))
+    # ru_maxrss: KB on Linux
+    print('peak RSS: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+# ===========================================================
+if __name__ == '__main__':
+    nchats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    dir = tempfile.mkdtemp(prefix='bench_bot_')
+    try:
+        for filename in glob.glob(os.path.join(src, '*.py')):
+            shutil.copy(filename, dir)
+        with open(os.path.join(dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE % delay)
+        os.chmod(os.path.join(dir, 'rfprobe'), 0o755)
+        os.environ.setdefault('BOTRF_CACHE_MB', '0')
+        # no rate limit of the outbound messages
+        os.environ.setdefault('BOTRF_SEND_RATE', '0')
+        os.environ.setdefault('BOTRF_CHAT_SEND_RATE', '0')
+        sys.path.insert(0, dir)
+        logging.disable(logging.ERROR)
+        import splatbot
+        fakebot = FakeBot(latency)
+        splatbot.bot = fakebot
+        print('rfprobe delay %.3f s, API latency %.3f s, %d rfprobe workers' % (
+            delay, latency, splatbot.nRfProbeWorkers))
+        bench(splatbot, fakebot, nchats, rounds)
+    finally:
+        shutil.rmtree(dir)
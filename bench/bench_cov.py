@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_cov.py
+# ============
+# Benchmark of the coverage of a site (covmap.py, cov command) on the
+# synthetic terrain tile of bench_engine.py (plain with a ridge).
+# The radials of the grid are evaluated in chunks by process pools of
+# 1, 2, 4 ... workers, as by the bot; for each pool: time, speedup and
+# efficiency (speedup / workers) against the pool of 1 worker.
+# A short run before the timed one starts the processes of the pool
+# and maps the tile in the workers.
+#
+# Use (needs numpy):
+#   python3 bench/bench_cov.py [radius (km), default 30] [step (km), default 0.5]
+#                              [max workers, default n. of cpu cores]
+#
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import terrain
+import covmap
+
+from bench_engine import write_tile
+
+LAT, LON, HTX, HRX = 45.50, 11.40, 20.0, 3.0
+EARTH, FREQ = 1.3333, 5800.0
+
+def run(pool, workers, mapdir, bearings, distances):
+    futures = [pool.submit(covmap.evaluate, mapdir, LAT, LON, HTX, [bearings[i] for i in idx],
+                           distances, HRX, EARTH, FREQ)
+               for idx in covmap.chunks(len(bearings), workers)]
+    return [row for f in futures for row in f.result()]
+
+# ===========================================================
+if __name__ == '__main__':
+    radius = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    step = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    maxworkers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+    bearings, distances = covmap.grid(radius * 1000.0, step * 1000.0)
+
+    dir = tempfile.mkdtemp(prefix='bench_cov_')
+    try:
+        mapdir = os.path.join(dir, 'maps')
+        os.makedirs(mapdir)
+        write_tile(mapdir)
+        # sdf -> npy conversion, not timed
+        terrain.TerrainTiles(mapdir).tile(45, 348)
+        print('%d radials x %d points, %d cpu cores' % (len(bearings), len(distances), os.cpu_count() or 1))
+        print('%8s %10s %8s %10s' % ('workers', 'time s', 'speedup', 'efficiency'))
+        workers = 1
+        t1 = None
+        while workers <= maxworkers:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                # start the workers
+                run(pool, workers, mapdir, bearings[:workers], distances)
+                t = time.perf_counter()
+                values = run(pool, workers, mapdir, bearings, distances)
+                elapsed = time.perf_counter() - t
+            t1 = t1 or elapsed
+            print('%8d %10.2f %8.2f %9.0f%%' % (workers, elapsed, t1 / elapsed, 100.0 * t1 / elapsed / workers))
+            workers = workers * 2 if workers * 2 <= maxworkers or workers == maxworkers else maxworkers
+        png = covmap.render(values, bearings, distances, 'bench')
+        print('heatmap: %d bytes' % len(png))
+    finally:
+        shutil.rmtree(dir)
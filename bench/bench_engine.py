@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_engine.py
+# ===============
+# Benchmark of the native path profile engine (terrain.py) on synthetic
+# terrain tiles: a 1 degree tile (1200x1200 samples) with a ridge
+# across the path.
+#   - conversion of the sdf tile to npy (only the first time)
+#   - path profile + clearance of a link of about 50 km
+#
+# With the option --rfprobe <dir>, where <dir> contains rfprobe and the maps
+# directory, the same link is analysed with rfprobe on the real terrain
+# and the times and the results are compared.
+#
+# Use (needs numpy):
+#   python3 bench/bench_engine.py [--rfprobe <dir>]
+#
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import terrain
+import fresnel
+import siteregistry
+
+import numpy as np
+
+IPPD = 1200
+
+# -----------------------------------------------------
+# synthetic tile 45:46:348:349 (45-46 N, 11-12 E):
+# plain at 200 m with a 600 m ridge along the meridian 11.5 E
+def write_tile(mapdir):
+    x = np.arange(IPPD)[:, None]            # latitude index
+    y = np.arange(IPPD)[None, :]            # longitude index (y = IPPD-1 at max_west, 11 E)
+    lon = 11.0 + (IPPD - 1 - y) / IPPD
+    ridge = 600.0 * np.exp(-((lon - 11.5) / 0.01) ** 2)
+    data = (200.0 + ridge + 0.0 * x).astype(np.int32)
+    filename = os.path.join(mapdir, '45:46:348:349.sdf')
+    with open(filename, 'wt') as f:
+        f.write('349\n45\n348\n46\n')
+        f.write('\n'.join(str(v) for v in data.ravel()))
+        f.write('\n')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def native(tiles, tx, rx, params):
+    earth, freq, perc = params
+    profile = terrain.path_profile(tiles, tx.lat, tx.lon, rx.lat, rx.lon)
+    return profile, fresnel.Clearance(profile.dist, profile.elev, tx.height(), rx.height(), earth, freq, perc)
+
+# ===========================================================
+if __name__ == '__main__':
+    params = (1.3333, 5800.0, 60.0)
+    tx = siteregistry.Site('tx', 'tx', 45.50, 11.20, '20m')
+    rx = siteregistry.Site('rx', 'rx', 45.55, 11.85, '20m')
+
+    dir = tempfile.mkdtemp(prefix='bench_engine_')
+    try:
+        mapdir = os.path.join(dir, 'maps')
+        os.makedirs(mapdir)
+        write_tile(mapdir)
+        tiles = terrain.TerrainTiles(mapdir)
+        t = time.perf_counter()
+        tiles.tile(45, 348)
+        print('tile conversion sdf -> npy: %.1f ms' % ((time.perf_counter() - t) * 1e3))
+        # new instance: tiles memory-mapped from the npy files
+        tiles = terrain.TerrainTiles(mapdir)
+        t = time.perf_counter()
+        native(tiles, tx, rx, params)
+        print('first analysis (tile mapped): %.2f ms' % ((time.perf_counter() - t) * 1e3))
+
+        times = []
+        for i in range(200):
+            t = time.perf_counter()
+            profile, clr = native(tiles, tx, rx, params)
+            times.append(time.perf_counter() - t)
+        print('native: %d samples, %.1f km, p50 %.3f ms, p99 %.3f ms' % (
+            len(profile.dist), profile.dist[-1] / 1000.0,
+            percentile(times, 50) * 1e3, percentile(times, 99) * 1e3))
+        print('native: LOS %s, first Fresnel zone %s, %.0f%% zone %s, min clearance %.1f m' % (
+            'clear' if clr.los_clear else 'obstructed',
+            'clear' if clr.fresnel_clear else 'obstructed', params[2],
+            'clear' if clr.perc_clear else 'obstructed', float(clr.clear[1:-1].min())))
+    finally:
+        shutil.rmtree(dir)
+
+    # comparison with rfprobe, on the real terrain of the rfprobe maps
+    if len(sys.argv) == 3 and sys.argv[1] == '--rfprobe':
+        dirProbe = os.path.abspath(sys.argv[2])
+        tiles = terrain.TerrainTiles(os.path.join(dirProbe, 'maps'))
+        profile, clr = native(tiles, tx, rx, params)
+        dirUser = os.path.join(dirProbe, 'user', 'bench')
+        if not os.path.exists(dirUser):
+            os.makedirs(dirUser)
+        for site in (tx, rx):
+            with open(os.path.join(dirUser, site.name + '.qth'), 'wt') as f:
+                f.write(site.qth())
+        cmd = [os.path.join(dirProbe, 'rfprobe'), '-t', 'user/bench/tx.qth', '-r', 'user/bench/rx.qth',
+               '-m', str(params[0]), '-d', 'maps', '-metric', '-gpsav', '-p', '-e',
+               '-f', str(params[1]), '-fz', str(params[2]), '-H', 'user/bench/tx_rx.png']
+        t = time.perf_counter()
+        subprocess.call(cmd, cwd=dirProbe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        print('rfprobe: %.1f ms' % ((time.perf_counter() - t) * 1e3))
+        with open(os.path.join(dirUser, 'tx_rx_red.txt')) as f:
+            report = f.read()
+        print('rfprobe: LOS %s, %.0f%% zone %s' % (
+            'clear' if 'No obstructions to LOS path' in report else 'obstructed', params[2],
+            'clear' if '% of the first Fresnel zone is clear' in report else 'obstructed'))
+        print('native:  LOS %s, %.0f%% zone %s' % (
+            'clear' if clr.los_clear else 'obstructed', params[2],
+            'clear' if clr.perc_clear else 'obstructed'))
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_fresnel.py
+# ================
+# Benchmark of the Fresnel zone clearance and of the obstruction report
+# (fresnel.py) on synthetic profiles of 1000, 10000 and 100000 samples:
+# 50 km of hills with two ridges across the path.
+#
+# Use (needs numpy):
+#   python3 bench/bench_fresnel.py
+#
+import sys
+import os
+import os.path
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import fresnel
+
+import numpy as np
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def profile(n):
+    dist = np.linspace(0.0, 50000.0, n)
+    elev = 200.0 + 30.0 * np.sin(dist / 700.0)
+    elev = elev + 450.0 * np.exp(-((dist - 18000.0) / 300.0) ** 2)
+    elev = elev + 380.0 * np.exp(-((dist - 36000.0) / 500.0) ** 2)
+    lat = np.linspace(45.50, 45.55, n)
+    lon = np.linspace(11.20, 11.85, n)
+    return dist, elev, lat, lon
+
+# ===========================================================
+if __name__ == '__main__':
+    params = (1.3333, 5800.0, 60.0)
+    for n in (1000, 10000, 100000):
+        dist, elev, lat, lon = profile(n)
+        tclr = []
+        trep = []
+        for i in range(200):
+            t = time.perf_counter()
+            clr = fresnel.Clearance(dist, elev, 30.0, 20.0, *params)
+            t1 = time.perf_counter()
+            txt = fresnel.report(clr, 'tx', 'rx', lat, lon)
+            tclr.append(t1 - t)
+            trep.append(time.perf_counter() - t1)
+        print('%6d samples: clearance p50 %.3f ms p99 %.3f ms, report p50 %.3f ms p99 %.3f ms' % (
+            n, percentile(tclr, 50) * 1e3, percentile(tclr, 99) * 1e3,
+            percentile(trep, 50) * 1e3, percentile(trep, 99) * 1e3))
+    print()
+    print(txt)
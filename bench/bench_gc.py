@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_gc.py
+# ===========
+# Benchmark of the collector of the analysis outputs (workspace.py).
+# A synthetic tree user/<chat_id>/ with N users, each with 2 sites (.qth)
+# and M analyses (.png, .txt, _red.txt, of different ages) is swept with
+# a per-user and a global quota, while a timer measures the max delay of
+# the event loop. Reported: sweep time, outputs removed, bytes left, and
+# the check that the .qth files are all still there.
+#
+# Use:
+#   python3 bench/bench_gc.py [users, default 1000] [analyses per user, default 30]
+#                             [budget of a step (ms), default 5]
+#
+import sys
+import os
+import os.path
+import time
+import glob
+import shutil
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import workspace
+
+# -----------------------------------------------------
+# tree of nusers users with nlinks analyses each.
+# return the bytes of the outputs
+def make_tree(dir, nusers, nlinks):
+    total = 0
+    now = time.time()
+    for u in range(nusers):
+        dirUser = os.path.join(dir, str(1000 + u))
+        os.makedirs(dirUser)
+        for name in ('tx', 'rx'):
+            with open(os.path.join(dirUser, name + '.qth'), 'wt') as f:
+                f.write(name + '\n45.5\n348.8\n20m\n')
+        for i in range(nlinks):
+            for suffix, size in (('.png', 20000), ('.txt', 3000), ('_red.txt', 200)):
+                filename = os.path.join(dirUser, 'link%d%s' % (i, suffix))
+                with open(filename, 'wb') as f:
+                    f.write(b'x' * size)
+                # one analysis every hour
+                t = now - 3600.0 * (nlinks - i)
+                os.utime(filename, (t, t))
+                total = total + size
+    return total
+
+@asyncio.coroutine
+def ticker(stop, lag):
+    while not stop.done():
+        t = time.perf_counter()
+        yield from asyncio.sleep(0.001)
+        lag[0] = max(lag[0], time.perf_counter() - t - 0.001)
+
+@asyncio.coroutine
+def run(collector):
+    lag = [0.0]
+    stop = asyncio.Future()
+    tick = asyncio.ensure_future(ticker(stop, lag))
+    t = time.perf_counter()
+    yield from collector.sweep()
+    elapsed = time.perf_counter() - t
+    stop.set_result(None)
+    yield from tick
+    return elapsed, lag[0]
+
+# ===========================================================
+if __name__ == '__main__':
+    nusers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nlinks = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    budget = float(sys.argv[3]) / 1e3 if len(sys.argv) > 3 else 0.005
+
+    dir = tempfile.mkdtemp(prefix='bench_gc_')
+    try:
+        total = make_tree(dir, nusers, nlinks)
+        # per user: half of the outputs; global: a quarter of the tree
+        userbytes = total // nusers // 2
+        totalbytes = total // 4
+        print('%d users x %d analyses: %d files, %.1f MB; quota %.0f KB per user, %.1f MB in all, step %.1f ms' % (
+            nusers, nlinks, nusers * (nlinks * 3 + 2), total / 1048576.0, userbytes / 1024.0,
+            totalbytes / 1048576.0, budget * 1e3))
+        loop = asyncio.get_event_loop()
+        for label in ('first sweep', 'second sweep'):
+            collector = workspace.WorkspaceCollector(dir, userbytes, totalbytes, budget=budget)
+            elapsed, lag = loop.run_until_complete(run(collector))
+            print('%-12s %8.1f ms, max event loop delay %6.2f ms, removed %d files (%.1f MB), left %.1f MB' % (
+                label, elapsed * 1e3, lag * 1e3, collector.removed, collector.removed_bytes / 1048576.0,
+                collector.bytes / 1048576.0))
+        nqth = len(glob.glob(os.path.join(dir, '*', '*.qth')))
+        print('qth files: %d of %d' % (nqth, 2 * nusers))
+    finally:
+        shutil.rmtree(dir)
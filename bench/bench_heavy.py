@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_heavy.py
+# ==============
+# Latency of the cheap commands (list, cnv) while N heavy jobs run.
+# As bench_bot.py, SplatBot runs with a fake Telegram API and a fake
+# rfprobe, in a temporary copy of src, with the result cache disabled.
+# The fake rfprobe keeps a cpu core busy for DELAY seconds, as the real
+# one does with a long path profile.
+#
+# For each level N: N chats send calc without pause, so N rfprobe jobs
+# run (at most BOTRF_WORKERS at the same time, the others wait in the
+# scheduler); one more chat sends list and cnv in turn for the duration.
+# Report: p50, p99 and max latency of list and cnv, jobs completed.
+# With rfprobe run by os.system (before the asyncio subprocesses) each
+# cheap command waited for the rfprobe running: p99 about DELAY.
+#
+# Use:
+#   python3 bench/bench_heavy.py [heavy jobs,jobs,... default 0,1,4,16]
+#                                [duration (s), default 10] [rfprobe time (s), default 2]
+#
+import sys
+import io
+import os
+import os.path
+import time
+import glob
+import shutil
+import asyncio
+import tempfile
+import logging
+import contextlib
+import collections
+
+from bench_bot import FakeBot, text_msg, percentile
+
+FAKE_RFPROBE = '''#!/bin/sh
+# fake rfprobe: busy for %s s, then write the outputs of -H <out>.png or -pw <out>.txt
+while [ $# -gt 0 ]; do
+    case "$1" in -H|-pw) out="$2"; shift;; esac
+    shift
+done
+%s -c 'import time
+t = time.time() + %s
+while time.time() < t: pass'
+base="${out%%.*}"
+echo "png $base $$" > "$base.png"
+printf 'Path profile report\\n\\nObstructions:\\nNo obstructions to LOS path\\n' > "$base.txt"
+printf 'No obstructions to LOS path\\n60%%%% of the first Fresnel zone is clear\\n' > "${base}_red.txt"
+'''
+
+SITES = ['site tx 45.5000 11.2000 20', 'site rx 45.5200 11.2400 15']
+
+# -----------------------------------------------------
+class Chat(object):
+    def __init__(self, splatbot, fakebot, chat_id):
+        self.n = 0
+        self.chat_id = chat_id
+        self.handler = splatbot.SplatBot((fakebot, text_msg(chat_id, 0, 'start'), chat_id), 60)
+
+    # return the latency (s) of a command
+    @asyncio.coroutine
+    def send(self, text):
+        self.n = self.n + 1
+        t = time.perf_counter()
+        yield from self.handler.on_message(text_msg(self.chat_id, self.n, text))
+        return time.perf_counter() - t
+
+@asyncio.coroutine
+def run_heavy(chat, stop, done):
+    while not stop.is_set():
+        yield from chat.send('calc tx rx')
+        done.append(1)
+
+@asyncio.coroutine
+def run_cheap(chat, duration, latencies):
+    tend = time.perf_counter() + duration
+    while time.perf_counter() < tend:
+        for cmd in ('list', 'cnv 30 dbm mw'):
+            latencies[cmd.split()[0]].append((yield from chat.send(cmd)))
+        yield from asyncio.sleep(0.01)
+
+@asyncio.coroutine
+def level(splatbot, fakebot, nheavy, duration, base_id):
+    chats = [Chat(splatbot, fakebot, base_id + i) for i in range(nheavy + 1)]
+    for chat in chats:
+        for text in SITES:
+            yield from chat.send(text)
+    stop = asyncio.Event()
+    done = []
+    latencies = collections.defaultdict(list)
+    heavy = [asyncio.ensure_future(run_heavy(chat, stop, done)) for chat in chats[1:]]
+    # the jobs start before the timed commands
+    yield from asyncio.sleep(0.5 if nheavy else 0)
+    yield from run_cheap(chats[0], duration, latencies)
+    stop.set()
+    ncompleted = len(done)
+    yield from asyncio.gather(*heavy)
+    return latencies, ncompleted
+
+# ===========================================================
+if __name__ == '__main__':
+    levels = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [0, 1, 4, 16]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    dir = tempfile.mkdtemp(prefix='bench_heavy_')
+    try:
+        for filename in glob.glob(os.path.join(src, '*.py')):
+            shutil.copy(filename, dir)
+        with open(os.path.join(dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE % (delay, sys.executable, delay))
+        os.chmod(os.path.join(dir, 'rfprobe'), 0o755)
+        os.environ.setdefault('BOTRF_CACHE_MB', '0')
+        os.environ.setdefault('BOTRF_SEND_RATE', '0')
+        os.environ.setdefault('BOTRF_CHAT_SEND_RATE', '0')
+        sys.path.insert(0, dir)
+        logging.disable(logging.ERROR)
+        import splatbot
+        fakebot = FakeBot(0.0)
+        splatbot.bot = fakebot
+        print('rfprobe time %.1f s (cpu busy), %d rfprobe workers, %d cpu cores, %.0f s for each level' % (
+            delay, splatbot.nRfProbeWorkers, os.cpu_count() or 1, duration))
+        print('%6s %6s %6s %10s %10s %10s' % ('heavy', 'cmd', 'n', 'p50 ms', 'p99 ms', 'max ms'))
+        loop = asyncio.get_event_loop()
+        for i, nheavy in enumerate(levels):
+            # the output of the bot (reports printed) is discarded
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, ncompleted = loop.run_until_complete(
+                    level(splatbot, fakebot, nheavy, duration, 1000 * (i + 1)))
+            for cmd in sorted(latencies):
+                values = latencies[cmd]
+                print('%6d %6s %6d %10.2f %10.2f %10.2f' % (nheavy, cmd, len(values),
+                      percentile(values, 50) * 1e3, percentile(values, 99) * 1e3, max(values) * 1e3))
+            print('%6d   jobs completed in %.0f s: %d' % (nheavy, duration, ncompleted))
+        loop.run_until_complete(splatbot.outbox.join())
+    finally:
+        shutil.rmtree(dir)
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_list.py
+# =============
+# Benchmark of the list command: time to build the list of the sites
+# of a user with 10, 1000 and 100000 sites.
+#   - files:    old layout, glob of user/<chat_id>/*.qth and parse of each file
+#   - registry: sqlite site registry (siteregistry.py)
+#
+# Use:
+#   python3 bench/bench_list.py [n. sites ...]
+#
+import sys
+import os
+import os.path
+import glob
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import siteregistry
+
+CHAT_ID = 12345
+
+# -----------------------------------------------------
+# create n sites, as qth files and in the registry
+def create_sites(dir, n):
+    dirUser = dir + '/user/' + str(CHAT_ID)
+    os.makedirs(dirUser)
+    registry = siteregistry.SiteRegistry(dir + '/sites.db')
+    for i in range(n):
+        site = siteregistry.Site('site%06d' % i, 'site%06d' % i,
+                                 -60.0 + (i % 1200) * 0.1, -170.0 + (i % 3400) * 0.1, '12m')
+        with open(dirUser + '/' + site.name + '.qth', 'wt') as f:
+            f.write(site.qth())
+        registry._db.execute(
+            'INSERT INTO sites (chat_id, name, info, lat, lon, antenna) VALUES (?, ?, ?, ?, ?, ?)',
+            (CHAT_ID, site.name, site.info, site.lat, site.lon, site.antenna))
+    registry._db.commit()
+    return registry
+
+# split the rows in messages of about 2048 chars, as the list command
+def messages(rows):
+    msgs = []
+    txt = ''
+    for row in rows:
+        txt = txt + row + '\n'
+        if (len(txt)>2048):
+            msgs.append(txt)
+            txt = ''
+    msgs.append(txt)
+    return msgs
+
+# list built as the list command did before the registry
+def list_files(dir):
+    names = glob.glob(dir + '/user/' + str(CHAT_ID) + '/*.qth')
+    return messages(siteregistry.parse_qth(x).row() for x in names)
+
+def list_registry(registry):
+    return messages(x.row() for x in registry.list(CHAT_ID))
+
+# best time of repeat runs (s)
+def timeit(fn, *args, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn(*args)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+# ===========================================================
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [10, 1000, 100000]
+    print('%10s %14s %14s %14s' % ('sites', 'files (ms)', 'registry (ms)', 'lookup (us)'))
+    for n in sizes:
+        dir = tempfile.mkdtemp(prefix='bench_list_')
+        try:
+            registry = create_sites(dir, n)
+            repeat = 3 if n > 10000 else 5
+            t_files = timeit(list_files, dir, repeat=repeat)
+            t_reg = timeit(list_registry, registry, repeat=repeat)
+            # single site lookup (site, ant, del, calc)
+            t_get = timeit(registry.get, CHAT_ID, 'site%06d' % (n // 2), repeat=100)
+            print('%10d %14.2f %14.2f %14.1f' % (n, t_files * 1e3, t_reg * 1e3, t_get * 1e6))
+            registry.close()
+        finally:
+            shutil.rmtree(dir)
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_load.py
+# =============
+# Load test of the whole bot process (DelegatorBot, one SplatBot handler
+# per chat) with N chats, against a local stand-in of the Telegram Bot API.
+#
+# The stand-in (FakeApi, aiohttp) serves getUpdates (long polling),
+# sendMessage, sendPhoto and sendDocument; the other methods answer ok.
+# splatbot.py runs as a subprocess, with a dummy token (BOTRF_TOKEN),
+# BOTRF_API_URL pointing to the stand-in and a fake rfprobe (see
+# bench_bot.py), in a temporary copy of src.
+#
+# Each chat creates two sites, then sends commands drawn from MIX, with
+# an exponential think time between them. After each command the chat
+# sends a marker (cnv <seq> db pwrr): the messages of a chat are handled
+# in order, so the echo of the marker arrives after the last reply of the
+# command. Latency = from the update put in getUpdates to the marker echo.
+#
+# The latency is split in cold (no handler for the chat: first message, or
+# idle for more than the handler timeout BOTRF_CHAT_TIMEOUT, so the handler
+# is created again) and warm. With many chats the cost of the handlers
+# shows in the warm latency too: each update is broadcast to the listeners
+# of all the active handlers. For each level the bot CPU time per message
+# and the peak of active handlers (botrf_handlers_active) are reported.
+#
+# Use:
+#   python3 bench/bench_load.py [chats,chats,...] [duration (s)] [think time (s)]
+#                               [handler timeout (s)] [rfprobe delay (s)]
+# es. python3 bench/bench_load.py 10,100,1000,3000 60 5 10 0.2
+#
+import sys
+import os
+import os.path
+import json
+import time
+import glob
+import random
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import collections
+import urllib.request
+
+from aiohttp import web
+
+from bench_bot import FAKE_RFPROBE, percentile
+
+TOKEN = '123456:bench-load'          # dummy token, the stand-in accepts any
+API_PORT = 8081
+METRICS_PORT = 8082
+MAX_WAIT = 600.0            # s, max wait of the replies of a command
+
+# command mix of the chats: (weight, command)
+MIX = [
+    (30, 'list'),
+    (20, 'cnv 30 dbm mw'),
+    (15, 'site rx 45.5200 11.2400 15'),
+    (5,  'ant rx 18'),
+    (20, 'calc tx rx'),
+    (5,  'rep tx rx'),
+    (5,  'pow tx rx 18.0 -2.0 14.0 11.0 -1.0 -90.0'),
+    ]
+
+# -----------------------------------------------------
+# stand-in of the Telegram Bot API.
+# on_reply(chat_id, text): called for each message sent by the bot
+# (text: caption or '' for the photos and documents)
+class FakeApi(object):
+    def __init__(self, loop):
+        self._loop = loop
+        self.on_reply = None
+        self._updates = collections.deque()
+        self._event = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self.calls = collections.Counter()
+
+    # remove the updates not read (bot stopped)
+    def reset(self):
+        self._updates.clear()
+
+    # put an update in the queue of getUpdates
+    def push(self, message):
+        self._update_id = self._update_id + 1
+        self._updates.append({'update_id': self._update_id, 'message': message})
+        self._event.set()
+
+    @asyncio.coroutine
+    def start(self, host, port):
+        app = web.Application(loop=self._loop)
+        app.router.add_route('POST', '/bot{token}/{method}', self._handle)
+        app.router.add_route('GET', '/bot{token}/{method}', self._handle)
+        return (yield from self._loop.create_server(app.make_handler(), host, port))
+
+    def _reply(self, result):
+        body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        return web.Response(body=body, content_type='application/json')
+
+    def _message(self, chat_id, **fields):
+        self._message_id = self._message_id + 1
+        msg = {'message_id': self._message_id, 'date': int(time.time()),
+               'chat': {'id': chat_id, 'type': 'private'}}
+        msg.update(fields)
+        return msg
+
+    @asyncio.coroutine
+    def _handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls[method] + 1
+        params = yield from request.post()
+        if method == 'getUpdates':
+            result = yield from self._get_updates(int(params.get('offset', 0)),
+                                                  float(params.get('timeout', 0)))
+            return self._reply(result)
+        chat_id = int(params.get('chat_id', 0))
+        if method == 'sendMessage':
+            text = params.get('text', '')
+            self.on_reply(chat_id, text)
+            return self._reply(self._message(chat_id, text=text))
+        if method in ('sendPhoto', 'sendDocument'):
+            self.on_reply(chat_id, params.get('caption', ''))
+            file_id = 'file%d' % (self._message_id + 1)
+            if method == 'sendPhoto':
+                return self._reply(self._message(chat_id, photo=[{'file_id': file_id}]))
+            return self._reply(self._message(chat_id, document={'file_id': file_id}))
+        return self._reply(True)
+
+    # long polling: wait for updates at most timeout s
+    @asyncio.coroutine
+    def _get_updates(self, offset, timeout):
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            self._event.clear()
+            try:
+                yield from asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)[:100]
+
+# -----------------------------------------------------
+# synthetic user: a chat with its commands and think times
+class Chat(object):
+    def __init__(self, api, chat_id, think, timeout, results):
+        self.api = api
+        self.chat_id = chat_id
+        self.think = think
+        self.timeout = timeout          # s, handler timeout of the bot
+        self.results = results          # (cold, command) -> list of latencies
+        self.n = 0
+        self.last = None                # time of the last reply
+        self.waiting = None             # (marker echo, future)
+
+    def text(self, text):
+        self.n = self.n + 1
+        return {'message_id': self.n, 'date': int(time.time()), 'text': text,
+                'chat': {'id': self.chat_id, 'type': 'private', 'first_name': 'load'},
+                'from': {'id': self.chat_id, 'first_name': 'load'}}
+
+    def on_reply(self, text):
+        self.last = time.perf_counter()
+        # the texts of a chat can be merged in one message (sendqueue.py)
+        if self.waiting is not None and self.waiting[0] in text.split('\n'):
+            self.waiting[1].set_result(self.last)
+            self.waiting = None
+
+    # send a command and wait for the echo of its marker
+    @asyncio.coroutine
+    def command(self, text):
+        cold = self.last is None or time.perf_counter() - self.last > self.timeout
+        marker = 'cnv %d db pwrr' % self.n
+        future = asyncio.Future()
+        self.waiting = (marker, future)
+        t = time.perf_counter()
+        self.api.push(self.text(text))
+        self.api.push(self.text(marker))
+        try:
+            tdone = yield from asyncio.wait_for(future, MAX_WAIT)
+        except asyncio.TimeoutError:
+            # reply lost (bot stopped or overloaded)
+            self.waiting = None
+            self.results[(cold, 'lost')].append(MAX_WAIT)
+            return
+        self.results[(cold, text.split()[0])].append(tdone - t)
+
+    @asyncio.coroutine
+    def run(self, tend):
+        # start at a random time, so the chats are not in step
+        yield from asyncio.sleep(random.uniform(0, self.think))
+        yield from self.command('site tx 45.5000 11.2000 20')
+        yield from self.command('site rx 45.5200 11.2400 15')
+        weights = [w for w, cmd in MIX]
+        while time.time() < tend:
+            yield from asyncio.sleep(random.expovariate(1.0 / self.think))
+            x = random.uniform(0, sum(weights))
+            for w, cmd in MIX:
+                x = x - w
+                if x <= 0:
+                    break
+            yield from self.command(cmd)
+
+# -----------------------------------------------------
+# cpu time (s) of a process, from /proc (Linux)
+def cpu_time(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+# active handlers of the bot, None if the metrics server does not answer
+def scrape_handlers():
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % METRICS_PORT, timeout=5) as resp:
+            text = resp.read().decode('utf-8')
+    except OSError:
+        return None
+    for line in text.splitlines():
+        if line.startswith('botrf_handlers_active'):
+            return int(float(line.split()[1]))
+    return 0
+
+@asyncio.coroutine
+def load(loop, api, proc, chats, duration, think, timeout):
+    results = collections.defaultdict(list)
+    byid = {}
+    for i in range(chats):
+        byid[1000 + i] = Chat(api, 1000 + i, think, timeout, results)
+
+    def on_reply(chat_id, text):
+        if chat_id in byid:
+            byid[chat_id].on_reply(text)
+    api.on_reply = on_reply
+    cpu0 = cpu_time(proc.pid)
+    tend = time.time() + duration
+    tasks = [loop.create_task(chat.run(tend)) for chat in byid.values()]
+    peak = 0
+    while not all(task.done() for task in tasks):
+        yield from asyncio.sleep(1.0)
+        peak = max(peak, (yield from loop.run_in_executor(None, scrape_handlers)) or 0)
+    cpu = cpu_time(proc.pid) - cpu0
+    nmsgs = 2 * sum(len(v) for v in results.values())
+    print('%d chats: %d messages, bot cpu %.2f s (%.3f ms/message), peak %d handlers' % (
+        chats, nmsgs, cpu, cpu * 1e3 / max(nmsgs, 1), peak))
+    for cold in (True, False):
+        for cmd in sorted(set(c for k, c in results if k == cold)):
+            values = results[(cold, cmd)]
+            print('  %-5s %-5s %6d  p50 %8.1f ms  p90 %8.1f ms  p99 %8.1f ms' % (
+                'cold' if cold else 'warm', cmd, len(values), percentile(values, 50) * 1e3,
+                percentile(values, 90) * 1e3, percentile(values, 99) * 1e3))
+
+# start the bot in a copy of src, with the fake rfprobe
+def start_bot(dir, timeout, delay):
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    for filename in glob.glob(os.path.join(src, '*.py')):
+        shutil.copy(filename, dir)
+    with open(os.path.join(dir, 'rfprobe'), 'wt') as f:
+        f.write(FAKE_RFPROBE % delay)
+    os.chmod(os.path.join(dir, 'rfprobe'), 0o755)
+    env = dict(os.environ)
+    env.update({'BOTRF_TOKEN': TOKEN,
+                'BOTRF_API_URL': 'http://127.0.0.1:%d' % API_PORT,
+                'BOTRF_METRICS_PORT': str(METRICS_PORT),
+                'BOTRF_CHAT_TIMEOUT': str(timeout)})
+    env.setdefault('BOTRF_CACHE_MB', '0')
+    return subprocess.Popen([sys.executable, os.path.join(dir, 'splatbot.py')], cwd=dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# ===========================================================
+if __name__ == '__main__':
+    levels = [int(x) for x in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10, 100, 1000]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+    think = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    timeout = float(sys.argv[4]) if len(sys.argv) > 4 else 10.0
+    delay = float(sys.argv[5]) if len(sys.argv) > 5 else 0.2
+
+    loop = asyncio.get_event_loop()
+    api = FakeApi(loop)
+    loop.run_until_complete(api.start('127.0.0.1', API_PORT))
+    print('think time %.1f s, handler timeout %.0f s, rfprobe delay %.2f s' % (think, timeout, delay))
+    for chats in levels:
+        dir = tempfile.mkdtemp(prefix='bench_load_')
+        proc = start_bot(dir, timeout, delay)
+        try:
+            # the bot is ready when its metrics server answers
+            while scrape_handlers() is None:
+                if proc.poll() is not None:
+                    raise RuntimeError('bot exited with code %d' % proc.returncode)
+                time.sleep(0.2)
+            loop.run_until_complete(load(loop, api, proc, chats, duration, think, timeout))
+        finally:
+            proc.terminate()
+            proc.wait()
+            api.reset()
+            shutil.rmtree(dir)
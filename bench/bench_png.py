@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_png.py
+# ============
+# Benchmark of the optimization of the images before the upload (pngopt.py).
+# For each image: bytes before and after, time of the optimization, upload
+# time before and after (estimated from the uplink bandwidth), and the
+# change of the latency of the commands that send the image (calc, rep,
+# pow send one image, mesh one for each link):
+#   change = optimization time + (optimized bytes - original bytes) / bandwidth
+# Then the images are optimized in the thread and in the process pool,
+# 4 at a time, while a timer measures the max delay of the event loop.
+#
+# Without arguments the images are synthetic: a graph like the rfprobe ones
+# (RGB, antialiased lines, text metadata) and the profile graph of the
+# native engine (needs numpy). With --dir <dir>, the PNG files of the
+# directory are used (es. the graphs in user/<chat_id>/ of the bot).
+#
+# Use (needs PIL):
+#   python3 bench/bench_png.py [--dir <dir>] [--kbps <uplink kbit/s, default 1000>]
+#                              [--max-kb <byte budget, KB>]
+#
+import sys
+import os
+import os.path
+import io
+import glob
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import pngopt
+
+from PIL import Image, ImageDraw, PngImagePlugin
+
+# -----------------------------------------------------
+# graph like the ones of rfprobe (gnuplot): drawn at 4x and reduced,
+# so the lines are antialiased, saved with metadata and without optimization
+def rfprobe_like():
+    width, height, k = 1000, 600, 4
+    img = Image.new('RGB', (width * k, height * k), 'white')
+    draw = ImageDraw.Draw(img)
+    for x in range(0, width * k, 100 * k):
+        draw.line([(x, 0), (x, height * k)], fill=(200, 200, 200), width=k)
+    for y in range(0, height * k, 100 * k):
+        draw.line([(0, y), (width * k, y)], fill=(200, 200, 200), width=k)
+    pts = [(x * k, int((300 + 150 * ((x * 37) % 101) / 101.0 - x * 0.1) * k)) for x in range(0, width, 4)]
+    draw.polygon(pts + [(width * k, height * k), (0, height * k)], fill=(120, 170, 90))
+    draw.line(pts, fill=(0, 90, 0), width=2 * k)
+    draw.line([(0, 150 * k), (width * k, 120 * k)], fill=(0, 0, 200), width=2 * k)
+    draw.line([(0, 250 * k), (width * k, 220 * k)], fill=(200, 0, 0), width=2 * k)
+    img = img.resize((width, height), Image.LANCZOS)
+    info = PngImagePlugin.PngInfo()
+    info.add_text('Software', 'gnuplot')
+    info.add_text('Comment', 'path profile ' * 20)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', pnginfo=info, compress_level=6)
+    return buf.getvalue()
+
+# profile graph of the native engine (terrain.render_profile)
+def native_profile():
+    import tempfile
+    import numpy as np
+    import terrain
+    import fresnel
+    n = 600
+    dist = np.linspace(0.0, 50000.0, n)
+    elev = 200.0 + 400.0 * np.exp(-((dist - 25000.0) / 3000.0) ** 2) + 30.0 * np.sin(dist / 700.0)
+    profile = terrain.Profile(np.zeros(n), np.zeros(n), dist, elev)
+    clr = fresnel.Clearance(dist, elev, 20.0, 20.0, 1.3333, 5800.0, 60.0)
+    with tempfile.NamedTemporaryFile(suffix='.png') as f:
+        terrain.render_profile(profile, clr, f.name, 'tx - rx')
+        with open(f.name, 'rb') as g:
+            return g.read()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+# -----------------------------------------------------
+# max delay (s) of the event loop while n images are optimized in the pool
+def loop_lag(pool, data, maxbytes, n):
+    loop = asyncio.new_event_loop()
+    lag = [0.0]
+
+    @asyncio.coroutine
+    def ticker(stop):
+        while not stop.done():
+            t = time.perf_counter()
+            yield from asyncio.sleep(0.001)
+            lag[0] = max(lag[0], time.perf_counter() - t - 0.001)
+
+    @asyncio.coroutine
+    def run():
+        stop = asyncio.Future()
+        tick = asyncio.ensure_future(ticker(stop))
+        t = time.perf_counter()
+        yield from asyncio.gather(*[loop.run_in_executor(pool, pngopt.optimize, data, maxbytes)
+                                    for i in range(n)])
+        elapsed = time.perf_counter() - t
+        stop.set_result(None)
+        yield from tick
+        return elapsed
+
+    asyncio.set_event_loop(loop)
+    try:
+        elapsed = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    return elapsed, lag[0]
+
+# ===========================================================
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kbps = 1000.0
+    maxbytes = None
+    images = []
+    while args:
+        if args[0] == '--dir' and len(args) > 1:
+            for filename in sorted(glob.glob(os.path.join(args[1], '*.png'))):
+                with open(filename, 'rb') as f:
+                    images.append((os.path.basename(filename), f.read()))
+            args = args[2:]
+        elif args[0] == '--kbps' and len(args) > 1:
+            kbps = float(args[1])
+            args = args[2:]
+        elif args[0] == '--max-kb' and len(args) > 1:
+            maxbytes = int(float(args[1]) * 1024)
+            args = args[2:]
+        else:
+            print('Use: ' + sys.argv[0] + ' [--dir <dir>] [--kbps <kbit/s>] [--max-kb <KB>]')
+            sys.exit(1)
+    if not images:
+        images.append(('rfprobe-like', rfprobe_like()))
+        try:
+            images.append(('native profile', native_profile()))
+        except ImportError:
+            pass
+
+    print('uplink %.0f kbit/s, byte budget %s' % (kbps, '%d KB' % (maxbytes // 1024) if maxbytes else 'none'))
+    print('%-20s %9s %9s %7s %8s %10s %10s %10s' % ('image', 'bytes', 'optimized', 'saved', 'opt ms',
+                                                  'upload ms', 'after ms', 'change ms'))
+    total, saved = 0, 0
+    for name, data in images:
+        times = []
+        for i in range(5):
+            t = time.perf_counter()
+            out = pngopt.optimize(data, maxbytes)
+            times.append(time.perf_counter() - t)
+        topt = percentile(times, 50)
+        upload = len(data) * 8.0 / (kbps * 1000.0)
+        after = len(out) * 8.0 / (kbps * 1000.0)
+        total, saved = total + len(data), saved + len(data) - len(out)
+        print('%-20s %9d %9d %6.1f%% %8.1f %10.1f %10.1f %+10.1f' % (name[:20], len(data), len(out),
+              100.0 * (len(data) - len(out)) / len(data), topt * 1e3, upload * 1e3, after * 1e3,
+              (topt + after - upload) * 1e3))
+    print('total: %d bytes, %d saved (%.1f%%)' % (total, saved, 100.0 * saved / max(total, 1)))
+
+    # event loop delay with the thread and the process pool
+    data = images[0][1]
+    for kind in ('thread', 'process'):
+        pool = pngopt.make_pool(kind, 2)
+        pool.submit(pngopt.optimize, data).result()         # start the workers
+        elapsed, lag = loop_lag(pool, data, maxbytes, 4)
+        pool.shutdown()
+        print('%-7s pool: 4 images in %.1f ms, max event loop delay %.1f ms' % (kind, elapsed * 1e3, lag * 1e3))
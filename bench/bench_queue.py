@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_queue.py
+# ==============
+# Throughput of the job queue (jobqueue.py) with 1, 2, 4 and 8 workers
+# (rfworker.py) on one host.
+# rfprobe is replaced by a shell script that waits DELAY seconds and
+# writes the outputs, so the test measures the queue and the workers.
+# A front end thread puts the jobs in the queue and collects the results.
+#
+# Use:
+#   python3 bench/bench_queue.py [n. of jobs] [delay (s)]
+#
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import jobqueue
+import rfworker
+import siteregistry
+
+FAKE_RFPROBE = '''#!/bin/sh
+# fake rfprobe: wait, then write the outputs of -H <out>.png or -pw <out>.txt
+while [ $# -gt 0 ]; do
+    case "$1" in -H|-pw) out="$2"; shift;; esac
+    shift
+done
+sleep %s
+base="${out%%.*}"
+echo png > "$base.png"
+echo report > "$base.txt"
+echo reduced > "${base}_red.txt"
+'''
+
+def bench(dir, nworkers, njobs, delay):
+    spec = 'sqlite:' + os.path.join(dir, 'jobs%d.db' % nworkers)
+    queue = jobqueue.open_queue(spec)
+    tx = siteregistry.Site('tx', 'tx', 45.50, 11.20, '20m')
+    rx = siteregistry.Site('rx', 'rx', 45.55, 11.85, '20m')
+    stop = threading.Event()
+    workers = rfworker.start(spec, dir, nworkers, stop)
+    t = time.perf_counter()
+    ids = [queue.put(jobqueue.make_job(1, 'calc', tx, rx, (1.3333, 5800.0, 60.0), 'tx_rx_%d' % i))
+           for i in range(njobs)]
+    pending = set(ids)
+    nok = 0
+    while pending:
+        for job_id in list(pending):
+            result = queue.result(job_id)
+            if result is not None:
+                pending.discard(job_id)
+                queue.delete(job_id)
+                nok = nok + (1 if result[0] == 0 and len(result[1]) == 3 else 0)
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - t
+    stop.set()
+    for thread, worker in workers:
+        thread.join()
+    queue.close()
+    print('%d workers: %d jobs in %.2f s, %.1f jobs/s (ideal %.1f), %d ok' % (
+        nworkers, njobs, elapsed, njobs / elapsed, nworkers / delay, nok))
+
+# ===========================================================
+if __name__ == '__main__':
+    njobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    dir = tempfile.mkdtemp(prefix='bench_queue_')
+    try:
+        with open(os.path.join(dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE % delay)
+        os.chmod(os.path.join(dir, 'rfprobe'), 0o755)
+        for nworkers in (1, 2, 4, 8):
+            bench(dir, nworkers, njobs, delay)
+    finally:
+        shutil.rmtree(dir)
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_soak.py
+# =============
+# Soak test of the rfprobe jobs: open file descriptors, scratch directories
+# left and RSS of the bot along N jobs (default 100000).
+# As bench_bot.py, SplatBot runs with a fake Telegram API and a fake
+# rfprobe, in a temporary copy of src, with the result cache disabled so
+# each command runs rfprobe. The scratch directories of the jobs are
+# created in a private directory (BOTRF_SCRATCH), so the ones not removed
+# can be counted.
+#
+# Each chat has two handlers, as two bot instances behind a load balancer,
+# that run calc and rep of the same link at the same time: the outputs have
+# the same name, each job must receive its own graph and report.
+#
+# Use:
+#   python3 bench/bench_soak.py [jobs, default 100000] [chats, default 20]
+#                               [report every n. jobs, default 5000]
+#
+import sys
+import os
+import os.path
+import time
+import glob
+import shutil
+import asyncio
+import tempfile
+import logging
+import resource
+import contextlib
+
+from bench_bot import FAKE_RFPROBE, FakeBot, text_msg
+
+# -----------------------------------------------------
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1048576.0
+
+# fake bot that checks the images: the fake rfprobe writes
+# "png <outbase> <pid>", the outbase must be in a scratch directory
+class CheckingBot(FakeBot):
+    def __init__(self, scratch):
+        super(CheckingBot, self).__init__(0.0)
+        self.scratch = scratch
+        self.bad = 0
+        self.failed = 0
+
+    @asyncio.coroutine
+    def sendMessage(self, chat_id, text, **kwargs):
+        if 'failed' in text:
+            self.failed = self.failed + 1
+        return (yield from super(CheckingBot, self).sendMessage(chat_id, text, **kwargs))
+
+    @asyncio.coroutine
+    def sendPhoto(self, chat_id, photo, **kwargs):
+        fields = photo[1].getvalue().split()
+        if len(fields) != 3 or not fields[1].decode().startswith(self.scratch):
+            self.bad = self.bad + 1
+        return (yield from super(CheckingBot, self).sendPhoto(chat_id, photo, **kwargs))
+
+class Soak(object):
+    def __init__(self, splatbot, fakebot, scratch, total, every):
+        self.splatbot = splatbot
+        self.fakebot = fakebot
+        self.scratch = scratch
+        self.total = total
+        self.every = every
+        self.jobs = 0
+        self.t0 = time.perf_counter()
+        self.fds0 = open_fds()
+        self.out = sys.stdout           # the output of the bot is discarded
+
+    def report(self):
+        fds = open_fds()
+        print('%8d %8d %+6d %8d %9.1f %8.1f' % (self.jobs, fds, fds - self.fds0, len(os.listdir(self.scratch)),
+              rss_mb(), self.jobs / (time.perf_counter() - self.t0)), file=self.out)
+        self.out.flush()
+
+    @asyncio.coroutine
+    def chat(self, chat_id):
+        n = 1
+        handlers = []
+        for text in ('site tx 45.5000 11.2000 20', 'site rx 45.5200 11.2400 15'):
+            msg = text_msg(chat_id, n, text)
+            n = n + 1
+            if not handlers:
+                handlers = [self.splatbot.SplatBot((self.fakebot, msg, chat_id), 60) for i in range(2)]
+            yield from handlers[0].on_message(msg)
+        while self.jobs < self.total:
+            yield from asyncio.gather(handlers[0].on_message(text_msg(chat_id, n, 'calc tx rx')),
+                                      handlers[1].on_message(text_msg(chat_id, n + 1, 'rep tx rx')))
+            n = n + 2
+            for i in range(2):
+                self.jobs = self.jobs + 1
+                if self.jobs % self.every == 0:
+                    self.report()
+        for handler in handlers:
+            handler.on_close(self.splatbot.telepot.exception.WaitTooLong())
+
+# ===========================================================
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nchats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    every = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    dir = tempfile.mkdtemp(prefix='bench_soak_')
+    root = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+    scratch = tempfile.mkdtemp(prefix='bench_soak_', dir=root)
+    try:
+        for filename in glob.glob(os.path.join(src, '*.py')):
+            shutil.copy(filename, dir)
+        with open(os.path.join(dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE % 0)
+        os.chmod(os.path.join(dir, 'rfprobe'), 0o755)
+        os.environ['BOTRF_CACHE_MB'] = '0'
+        os.environ['BOTRF_SCRATCH'] = scratch
+        os.environ.setdefault('BOTRF_SEND_RATE', '0')
+        os.environ.setdefault('BOTRF_CHAT_SEND_RATE', '0')
+        sys.path.insert(0, dir)
+        logging.disable(logging.ERROR)
+        import splatbot
+        fakebot = CheckingBot(scratch)
+        splatbot.bot = fakebot
+        soak = Soak(splatbot, fakebot, scratch, total, every)
+        print('%d jobs, %d chats, scratch %s' % (total, nchats, scratch))
+        print('%8s %8s %6s %8s %9s %8s' % ('jobs', 'fds', 'delta', 'scratch', 'RSS MB', 'jobs/s'))
+        loop = asyncio.get_event_loop()
+        with open(os.devnull, 'wt') as null, contextlib.redirect_stdout(null):
+            loop.run_until_complete(asyncio.gather(*[soak.chat(1000 + i) for i in range(nchats)]))
+            loop.run_until_complete(splatbot.outbox.join())
+        soak.report()
+        print('images not from their own job: %d, failed analyses: %d' % (fakebot.bad, fakebot.failed))
+    finally:
+        shutil.rmtree(dir)
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# bench_startup.py
+# ================
+# Start time of the bot with and without OCR of the photos (ocr.py).
+#   - import time of splatbot.py in a new interpreter (median of RUNS runs):
+#     OCR enabled (the OCR stack is loaded at the first photo), OCR disabled
+#     (BOTRF_OCR=0) and with PIL and pytesseract imported at the start, as
+#     the bot did before
+#   - time of the OCR of a synthetic table of sites: the first photo
+#     (start of the worker process and import of the OCR stack) and the next
+#     ones, and the sites read from the text
+# The bot modules are copied in a temporary directory, as in bench_bot.py.
+#
+# Use (the OCR part needs PIL, pytesseract and tesseract):
+#   python3 bench/bench_startup.py [runs, default 5]
+#
+import sys
+import os
+import os.path
+import io
+import glob
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+
+RUNS = 5
+
+IMPORT = 'import time; t = time.perf_counter(); %s; print(time.perf_counter() - t)'
+
+ROWS = [
+    'Name       Lat        Lon        Height',
+    'tx         45.5000    11.2000    20',
+    'rx         45.5200    11.2400    15',
+    'relay      45:31:12n  11:14:24e  30m',
+    ]
+
+# -----------------------------------------------------
+# median import time (s) of the statement in a new interpreter
+def import_time(dir, statement, env, runs):
+    times = []
+    for i in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT % statement], cwd=dir, env=env,
+                                      stderr=subprocess.DEVNULL)
+        times.append(float(out.decode().split()[-1]))
+    return sorted(times)[len(times) // 2]
+
+# png of a table of sites, black text on white
+def table_image():
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.truetype('DejaVuSansMono.ttf', 28)
+    except OSError:
+        font = ImageFont.load_default()
+    img = Image.new('RGB', (900, 60 * len(ROWS) + 40), 'white')
+    draw = ImageDraw.Draw(img)
+    for i, row in enumerate(ROWS):
+        draw.text((30, 30 + 60 * i), row, fill='black', font=font)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+@asyncio.coroutine
+def ocr_times(ocr, data, n):
+    pool = ocr.OcrPool(1, 1)
+    times = []
+    try:
+        for i in range(n):
+            t = time.perf_counter()
+            text = yield from pool.image_to_text(data, 'eng')
+            times.append(time.perf_counter() - t)
+    finally:
+        pool.shutdown()
+    return times, text
+
+# ===========================================================
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    dir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        for filename in glob.glob(os.path.join(src, '*.py')):
+            shutil.copy(filename, dir)
+        env = dict(os.environ)
+        env['BOTRF_CACHE_MB'] = '0'
+        print('import of splatbot.py, median of %d runs' % runs)
+        print('  OCR enabled (loaded at the first photo): %8.1f ms' % (
+            import_time(dir, 'import splatbot', env, runs) * 1e3))
+        env['BOTRF_OCR'] = '0'
+        print('  OCR disabled (BOTRF_OCR=0):              %8.1f ms' % (
+            import_time(dir, 'import splatbot', env, runs) * 1e3))
+        try:
+            print('  OCR stack imported at the start:         %8.1f ms' % (
+                import_time(dir, 'from PIL import Image; import pytesseract; import splatbot', env, runs) * 1e3))
+        except subprocess.CalledProcessError:
+            print('  OCR stack imported at the start:         (PIL or pytesseract missing)')
+
+        sys.path.insert(0, dir)
+        import ocr
+        if not ocr.available():
+            print('OCR not available (PIL or pytesseract missing)')
+            sys.exit(0)
+        loop = asyncio.get_event_loop()
+        times, text = loop.run_until_complete(ocr_times(ocr, table_image(), 4))
+        print('OCR of a table of %d sites: first photo %.1f ms, next %s ms' % (
+            len(ROWS) - 1, times[0] * 1e3, ', '.join('%.1f' % (t * 1e3) for t in times[1:])))
+        for site in ocr.parse_sites(text):
+            print('  ' + site.row())
+    finally:
+        shutil.rmtree(dir)
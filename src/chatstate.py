@@ -0,0 +1,132 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# chatstate.py
+# ============
+# Conversation state of the chats (es. location sent, waiting for
+# "<name> <antenna height>").
+#
+# The state of a chat is a small dict, removed TTL seconds after the last
+# change, so the stores stay small also with many chats:
+#   MemoryStore: in the bot process, at most maxentries chats (the oldest
+#                are removed first)
+#   SqliteStore: in a sqlite database, shared by more bot processes
+#
+import json
+import time
+import sqlite3
+import collections
+
+# -----------------------------------------------------
+class MemoryStore(object):
+    def __init__(self, ttl, maxentries):
+        self._ttl = ttl
+        self._maxentries = maxentries
+        self._data = collections.OrderedDict()     # chat_id -> (expires, state), oldest first
+
+    # remove the expired states (the oldest are at the beginning)
+    def _expire(self, now):
+        while self._data:
+            chat_id, (expires, state) = next(iter(self._data.items()))
+            if expires > now:
+                break
+            del self._data[chat_id]
+
+    # return the state of the chat, None if not set or expired
+    def get(self, chat_id):
+        entry = self._data.get(chat_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._data[chat_id]
+            return None
+        return entry[1]
+
+    def set(self, chat_id, state):
+        now = time.time()
+        self._data.pop(chat_id, None)
+        self._data[chat_id] = (now + self._ttl, state)
+        self._expire(now)
+        while len(self._data) > self._maxentries:
+            self._data.popitem(last=False)
+
+    def clear(self, chat_id):
+        self._data.pop(chat_id, None)
+
+    def __len__(self):
+        self._expire(time.time())
+        return len(self._data)
+
+# -----------------------------------------------------
+class SqliteStore(object):
+    def __init__(self, filename, ttl, purge_every=1000):
+        self._ttl = ttl
+        self._purge_every = purge_every     # n. of set between two purges
+        self._nset = 0
+        self._db = sqlite3.connect(filename, timeout=10.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS chatstate ('
+            ' chat_id INTEGER PRIMARY KEY,'
+            ' state TEXT NOT NULL,'
+            ' expires REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS chatstate_expires ON chatstate (expires)')
+        self._db.commit()
+
+    def get(self, chat_id):
+        row = self._db.execute('SELECT state FROM chatstate WHERE chat_id=? AND expires>?',
+                               (chat_id, time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, chat_id, state):
+        now = time.time()
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO chatstate (chat_id, state, expires) VALUES (?, ?, ?)',
+                             (chat_id, json.dumps(state), now + self._ttl))
+            # the expired states are removed incrementally
+            self._nset = self._nset + 1
+            if self._nset % self._purge_every == 0:
+                self._db.execute('DELETE FROM chatstate WHERE expires<=?', (now,))
+
+    def clear(self, chat_id):
+        with self._db:
+            self._db.execute('DELETE FROM chatstate WHERE chat_id=?', (chat_id,))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM chatstate WHERE expires>?', (time.time(),)).fetchone()[0]
+
+# -----------------------------------------------------
+# store backends: <backend>:<address>; a plain file name is a sqlite store
+backends = {
+    'sqlite': SqliteStore,
+    }
+
+# open the store: spec None or '' for the memory store,
+# sqlite:<filename> or <filename> for the shared store
+def open_store(spec, ttl=600.0, maxentries=100000):
+    if not spec:
+        return MemoryStore(ttl, maxentries)
+    backend, sep, address = spec.partition(':')
+    if sep and backend in backends:
+        return backends[backend](address, ttl)
+    return SqliteStore(spec, ttl)
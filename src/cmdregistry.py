@@ -0,0 +1,133 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# cmdregistry.py
+# ==============
+# Registry of the bot commands.
+#
+# Each command has a full name and an abbreviation; the aliases
+# (calc, c, /calc, /c) are resolved with one dictionary lookup.
+# The handlers are coroutine functions; the registry measures the
+# latency of each call and counts the errors, so the commands can also
+# be run and measured without Telegram (dispatch with a fake handler).
+#
+import time
+import asyncio
+import collections
+
+# -----------------------------------------------------
+# statistics of a command
+class CommandStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0             # calls ended by an exception
+        self.time_total = 0.0       # s
+        self.time_max = 0.0         # s
+
+    def add(self, elapsed, error):
+        self.calls = self.calls + 1
+        if error:
+            self.errors = self.errors + 1
+        self.time_total = self.time_total + elapsed
+        self.time_max = max(self.time_max, elapsed)
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'time_avg': self.time_total / max(self.calls, 1),
+            'time_max': self.time_max,
+            }
+
+# -----------------------------------------------------
+# on_call: function on_call(name, elapsed, error) called after each call (es. metrics)
+class Command(object):
+    def __init__(self, name, abbr, func, on_call=None):
+        self.name = name
+        self.abbr = abbr
+        self.func = func
+        self.on_call = on_call
+        self.stats = CommandStats()
+
+    def aliases(self):
+        lst = [self.name, '/' + self.name]
+        if self.abbr:
+            lst = lst + [self.abbr, '/' + self.abbr]
+        return lst
+
+    # run the handler, measuring its latency
+    @asyncio.coroutine
+    def __call__(self, *args):
+        t = time.perf_counter()
+        error = True
+        try:
+            yield from self.func(*args)
+            error = False
+        finally:
+            elapsed = time.perf_counter() - t
+            self.stats.add(elapsed, error)
+            if self.on_call is not None:
+                self.on_call(self.name, elapsed, error)
+
+# -----------------------------------------------------
+# on_call: see Command
+class CommandRegistry(object):
+    def __init__(self, on_call=None):
+        self._on_call = on_call
+        self._aliases = {}                              # alias -> Command
+        self._commands = collections.OrderedDict()      # name -> Command
+
+    def register(self, name, abbr, func):
+        cmd = Command(name, abbr, func, self._on_call)
+        for alias in cmd.aliases():
+            if alias in self._aliases:
+                raise ValueError('command alias already registered: ' + alias)
+        for alias in cmd.aliases():
+            self._aliases[alias] = cmd
+        self._commands[name] = cmd
+        return cmd
+
+    # decorator: register the coroutine function as the command name (abbr)
+    def command(self, name, abbr=None):
+        def decorator(func):
+            self.register(name, abbr, func)
+            return func
+        return decorator
+
+    # return the Command of an alias, None if unknown
+    def lookup(self, word):
+        return self._aliases.get(word)
+
+    def commands(self):
+        return list(self._commands.values())
+
+    # run the command of the alias word with the arguments args.
+    # return False if the command is unknown
+    @asyncio.coroutine
+    def dispatch(self, word, *args):
+        cmd = self._aliases.get(word)
+        if cmd is None:
+            return False
+        yield from cmd(*args)
+        return True
+
+    # ==========================================================
+    def stats(self):
+        return {name: cmd.stats.as_dict() for name, cmd in self._commands.items()}
@@ -0,0 +1,203 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# covmap.py
+# =========
+# Area coverage of a site: path loss from the site to the points of a
+# polar grid around it, and the heatmap of the result (needs PIL).
+#
+# The grid has nradials radials (bearings from north, clockwise) and
+# nrings points along each radial, spaced step m up to radius m; the
+# radials are about step m apart at the radius (grid).
+#
+# Native evaluation (needs numpy and the terrain tiles): one path profile
+# for each radial, then for each point of the radial, in one vectorized
+# pass, the free space loss plus the diffraction loss of the worst edge
+# (knife edge, ITU-R P.526), with the earth radius multiplier:
+#   J(v) = 6.9 + 20 log10(sqrt((v - 0.1)^2 + 1) + v - 0.1)   v > -0.78
+# The radials are independent: they are evaluated in chunks by a pool of
+# processes (make_pool, evaluate), so the time scales with the cores.
+# Without numpy or terrain, the bot evaluates the points with rfprobe
+# jobs (LOS and Fresnel verdict of each point).
+#
+import io
+import math
+import concurrent.futures
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import terrain
+import fresnel
+
+MAX_RINGS = 200                 # points along a radial
+MIN_RADIALS = 8
+MAX_RADIALS = 360
+MAX_SAMPLES = 2000              # terrain samples of a radial profile
+
+# -----------------------------------------------------
+# point at distance dist (m) from lat, lon along the bearing (degrees)
+def destination(lat, lon, bearing, dist):
+    p1 = math.radians(lat)
+    l1 = math.radians(lon)
+    b = math.radians(bearing)
+    a = dist / terrain.EARTH_RADIUS
+    p2 = math.asin(math.sin(p1) * math.cos(a) + math.cos(p1) * math.sin(a) * math.cos(b))
+    l2 = l1 + math.atan2(math.sin(b) * math.sin(a) * math.cos(p1), math.cos(a) - math.sin(p1) * math.sin(p2))
+    lon2 = (math.degrees(l2) + 540.0) % 360.0 - 180.0
+    return math.degrees(p2), lon2
+
+# polar grid of radius and step (m): return (bearings, distances)
+def grid(radius, step):
+    nrings = max(1, min(MAX_RINGS, int(round(radius / step))))
+    nradials = int(math.ceil(2.0 * math.pi * radius / step))
+    nradials = max(MIN_RADIALS, min(MAX_RADIALS, nradials))
+    bearings = [360.0 * i / nradials for i in range(nradials)]
+    distances = [radius * (k + 1) / nrings for k in range(nrings)]
+    return bearings, distances
+
+# free space loss (dB) at dist (m, array), freq (MHz)
+def free_space_loss(dist, freq):
+    return 20.0 * np.log10(np.maximum(dist, 1.0) / 1000.0) + 20.0 * math.log10(freq) + 32.44
+
+# -----------------------------------------------------
+# path loss (dB) from the site (lat, lon, antenna htx m) to the points of
+# the radial at distances (m), receiver antenna hrx m.
+# return the list of the losses, nan where the terrain is not available
+def radial_loss(tiles, lat, lon, htx, bearing, distances, hrx, earth, freq):
+    lat2, lon2 = destination(lat, lon, bearing, distances[-1])
+    spacing = max(terrain.EARTH_RADIUS * math.radians(1.0 / 1200), distances[-1] / MAX_SAMPLES)
+    try:
+        profile = terrain.path_profile(tiles, lat, lon, lat2, lon2, spacing)
+    except ValueError:
+        return [float('nan')] * len(distances)
+    d = profile.dist
+    z = profile.elev
+    ztx = z[0] + htx
+    wavelen = fresnel.SPEED_LIGHT / (freq * 1.0e6)
+    # receivers: the nearest sample of each distance (rows), obstacles: the samples (columns)
+    rx = np.clip(np.searchsorted(d, distances), 1, len(d) - 1)
+    D = d[rx][:, None]
+    x = d[None, :]
+    inside = (x > 0.0) & (x < D)
+    xx = np.where(inside, x, 0.5 * D)
+    los = ztx + (z[rx][:, None] + hrx - ztx) * xx / D
+    ground = z[None, :] + xx * (D - xx) / (2.0 * earth * terrain.EARTH_RADIUS)
+    v = (ground - los) * np.sqrt(2.0 * D / (wavelen * xx * (D - xx)))
+    v = np.where(inside, v, -np.inf).max(axis=1)
+    vv = np.maximum(v, -0.78)
+    diffraction = np.where(v > -0.78, 6.9 + 20.0 * np.log10(np.sqrt((vv - 0.1) ** 2 + 1.0) + vv - 0.1), 0.0)
+    loss = free_space_loss(D[:, 0], freq) + diffraction
+    return [float(x) for x in loss]
+
+# run in the workers: losses of the radials (list of lists)
+_tiles = {}
+def evaluate(mapdir, lat, lon, htx, bearings, distances, hrx, earth, freq):
+    if mapdir not in _tiles:
+        _tiles[mapdir] = terrain.TerrainTiles(mapdir)
+    return [radial_loss(_tiles[mapdir], lat, lon, htx, b, distances, hrx, earth, freq) for b in bearings]
+
+# indexes of the radials in chunks: about 4 chunks for each worker, so the
+# workers stay busy until the end and the progress can be reported
+def chunks(n, workers):
+    size = max(1, int(math.ceil(n / (4.0 * workers))))
+    return [list(range(i, min(i + size, n))) for i in range(0, n, size)]
+
+# pool of the native evaluation, None without numpy
+def make_pool(workers):
+    if not terrain.available():
+        return None
+    return concurrent.futures.ProcessPoolExecutor(workers)
+
+# -----------------------------------------------------
+# colors of the heatmap
+NO_DATA = (190, 190, 190)
+VERDICT_COLORS = [(200, 40, 40), (240, 200, 40), (40, 160, 60)]
+VERDICT_LABELS = ['obstructed', 'LOS', 'LOS + Fresnel']
+
+# color of the loss x between lo (green) and hi (red)
+def loss_color(x, lo, hi):
+    if x != x:
+        return NO_DATA
+    t = min(1.0, max(0.0, (x - lo) / max(hi - lo, 1e-9)))
+    if t < 0.5:
+        return (int(40 + 400 * t), 170, 50)
+    return (240, int(170 - 300 * (t - 0.5)), 50)
+
+# -----------------------------------------------------
+# draw the heatmap of values (one list for each radial) in a png,
+# return the bytes.
+# values: losses (dB), or verdicts (0, 1, 2) if verdicts is True
+def render(values, bearings, distances, title, verdicts=False):
+    from PIL import Image, ImageDraw
+    size, margin, legend = 600, 30, 60
+    cx = cy = margin + size // 2
+    scale = (size / 2.0) / distances[-1]
+    img = Image.new('RGB', (size + 2 * margin, size + 2 * margin + legend), 'white')
+    draw = ImageDraw.Draw(img)
+    finite = [x for row in values for x in row if x == x]
+    lo = math.floor(min(finite) / 10.0) * 10.0 if finite else 0.0
+    hi = math.ceil(max(finite) / 10.0) * 10.0 if finite else 1.0
+    half = 180.0 / len(bearings)
+
+    def xy(bearing, r):
+        b = math.radians(bearing)
+        return (cx + r * scale * math.sin(b), cy - r * scale * math.cos(b))
+
+    for bearing, row in zip(bearings, values):
+        r0 = 0.0
+        for r, x in zip(distances, row):
+            if verdicts:
+                color = NO_DATA if x is None else VERDICT_COLORS[x]
+            else:
+                color = loss_color(x, lo, hi)
+            arc = [bearing - half + 2.0 * half * i / 4 for i in range(5)]
+            pts = [xy(b, r) for b in arc] + [xy(b, r0) for b in reversed(arc)]
+            draw.polygon(pts, fill=color, outline=color)
+            r0 = r
+    # rings every quarter of the radius, north
+    for i in range(1, 5):
+        r = distances[-1] * i / 4.0
+        draw.ellipse([cx - r * scale, cy - r * scale, cx + r * scale, cy + r * scale], outline=(80, 80, 80))
+        draw.text((cx + 3, cy - r * scale + 2), '{0:.1f} km'.format(r / 1000.0), fill='black')
+    draw.line([xy(0.0, 0.0), xy(0.0, distances[-1])], fill=(80, 80, 80))
+    draw.text((cx - 3, margin - 14), 'N', fill='black')
+    draw.ellipse([cx - 4, cy - 4, cx + 4, cy + 4], fill='black')
+    draw.text((margin, 8), title, fill='black')
+    # legend
+    y = size + 2 * margin + 10
+    if verdicts:
+        x = margin
+        for color, label in zip(VERDICT_COLORS + [NO_DATA], VERDICT_LABELS + ['no result']):
+            draw.rectangle([x, y, x + 16, y + 16], fill=color)
+            draw.text((x + 22, y + 2), label, fill='black')
+            x = x + 150
+    else:
+        width = size
+        for i in range(width):
+            draw.line([(margin + i, y), (margin + i, y + 16)], fill=loss_color(lo + (hi - lo) * i / width, lo, hi))
+        draw.text((margin, y + 22), '{0:.0f} dB'.format(lo), fill='black')
+        draw.text((margin + width // 2 - 40, y + 22), 'path loss', fill='black')
+        draw.text((margin + width - 50, y + 22), '{0:.0f} dB'.format(hi), fill='black')
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
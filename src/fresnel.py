@@ -0,0 +1,154 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# fresnel.py
+# ==========
+# Fresnel zone clearance and obstruction report of a path profile
+# (needs numpy).
+#
+# The input is the elevation profile between the two antennas: the
+# distances from the transmitter (m) and the terrain elevations (m AMSL).
+# All the values along the path (earth curvature, line of sight, first
+# Fresnel zone radius, clearance) are computed in one vectorized pass,
+# so a change of freq or perc needs only a new Clearance, in process.
+#
+# The report has the same shape of the rfprobe report: a header, then
+# the obstructions after the line "Obstructions:", with the same
+# sentences used by LinkVerdict to read the result.
+#
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371000.0            # m
+SPEED_LIGHT = 299792458.0           # m/s
+
+# -----------------------------------------------------
+# clearance of the path, with the earth curvature.
+# dist: distances from the transmitter (m); elev: terrain elevations (m)
+# htx, hrx: antenna heights (m above ground)
+# earth: earth radius multiplier; freq: MHz; perc: Fresnel zone clearance percentage
+class Clearance(object):
+    def __init__(self, dist, elev, htx, hrx, earth, freq, perc):
+        d = np.asarray(dist, dtype=np.float64)
+        z = np.asarray(elev, dtype=np.float64)
+        D = max(float(d[-1]), 1e-9)
+        self.dist = d
+        self.elev = z
+        self.earth = earth
+        self.freq = freq
+        self.perc = perc
+        self.ztx = float(z[0]) + htx
+        self.zrx = float(z[-1]) + hrx
+        # d * (D - d) is used by the earth bulge and by the Fresnel radius
+        dd = d * (D - d)
+        # line of sight and terrain raised by the earth curvature
+        self.los = self.ztx + ((self.zrx - self.ztx) / D) * d
+        self.terrain = z + dd * (1.0 / (2.0 * earth * EARTH_RADIUS))
+        # first Fresnel zone radius
+        wavelen = SPEED_LIGHT / (freq * 1.0e6)
+        self.fresnel = np.sqrt(dd * (wavelen / D))
+        # clearance (m) and clearance ratio (clearance / first Fresnel zone radius)
+        # of the inner points: the end points (the antennas) are excluded
+        self.clear = self.los - self.terrain
+        self.ratio = self.clear[1:-1] / self.fresnel[1:-1]
+        # the Fresnel radius is > 0 inside the path: the verdicts
+        # depend only on the minimum clearance ratio
+        self.min_ratio = float(self.ratio.min()) if len(self.ratio) else math.inf
+        self.los_clear = self.min_ratio >= 0.0
+        self.fresnel_clear = self.min_ratio >= 1.0
+        self.perc_clear = self.min_ratio >= perc / 100.0
+        self._need = None
+
+    # index of the point with the worst clearance ratio (None: no inner points)
+    def worst(self):
+        if len(self.ratio) == 0:
+            return None
+        return 1 + int(np.argmin(self.ratio))
+
+    # obstructions of the line of sight: for each blocked stretch of the path,
+    # the index of the point with the worst clearance
+    def obstructions(self):
+        if self.los_clear:
+            return []
+        blocked = np.zeros(len(self.clear) + 1, dtype=np.int8)
+        blocked[1:-2] = self.clear[1:-1] < 0.0
+        edges = np.flatnonzero(np.diff(blocked)) + 1
+        # the stretches start and end on the edges, [start, end)
+        return [int(s + np.argmin(self.clear[s:e])) for s, e in zip(edges[0::2], edges[1::2])]
+
+    # height (m above ground) of the receiver antenna needed to have the
+    # terrain below the line of sight by at least fraction * Fresnel radius.
+    # The transmitter antenna is unchanged
+    def required_height(self, fraction):
+        if len(self.ratio) == 0:
+            return 0.0
+        if self._need is None:
+            # receiver antenna elevation = a + b * fraction, maximum along the path
+            k = self.dist[-1] / self.dist[1:-1]
+            a = self.ztx + (self.terrain[1:-1] - self.ztx) * k
+            self._need = (a, self.fresnel[1:-1] * k)
+        a, b = self._need
+        return max(float((a + b * fraction).max()) - float(self.elev[-1]), 0.0)
+
+# -----------------------------------------------------
+# text of the report.
+# lat, lon (optional): coordinates of the profile points, degrees east positive;
+# without them the obstructions are given only by distance
+def report(clr, name1, name2, lat=None, lon=None):
+    txt = 'Path profile between ' + name1 + ' and ' + name2 + '\n'
+    txt = txt + 'Distance: ' + "{0:.2f}".format(clr.dist[-1] / 1000.0) + ' km\n'
+    txt = txt + 'Frequency: ' + "{0:.1f}".format(clr.freq) + ' MHz, earth radius multiplier ' + "{0:.4f}".format(clr.earth) + '\n'
+    k = clr.worst()
+    if k is not None:
+        txt = txt + 'Worst clearance: ' + "{0:.2f}".format(clr.clear[k]) + ' m at '
+        txt = txt + "{0:.2f}".format(clr.dist[k] / 1000.0) + ' km, clearance ratio '
+        txt = txt + "{0:.2f}".format(clr.min_ratio) + ' (clearance / first Fresnel zone radius)\n'
+
+    txt = txt + '\nObstructions:\n'
+    lst = clr.obstructions()
+    if lst:
+        txt = txt + 'Between ' + name1 + ' and ' + name2 + ' detected obstructions at:\n\n'
+        for k in lst:
+            txt = txt + '  '
+            if lat is not None and lon is not None:
+                # longitude in degrees west (0-360), as in the qth files
+                txt = txt + "{0:9.4f}".format(lat[k]) + ' N, ' + "{0:9.4f}".format((-lon[k]) % 360.0) + ' W, '
+            txt = txt + "{0:7.2f}".format(clr.dist[k] / 1000.0) + ' kilometers, '
+            txt = txt + "{0:8.2f}".format(clr.elev[k]) + ' meters AMSL\n'
+        txt = txt + '\nAntenna at ' + name2 + ' must be raised to at least '
+        txt = txt + "{0:.2f}".format(clr.required_height(0.0)) + ' meters AGL\nto clear all obstructions.\n'
+    else:
+        txt = txt + '\nNo obstructions to LOS path due to terrain were detected\n'
+    if clr.fresnel_clear:
+        txt = txt + '\nThe first Fresnel zone is clear.\n'
+    else:
+        txt = txt + '\nAntenna at ' + name2 + ' must be raised to at least '
+        txt = txt + "{0:.2f}".format(clr.required_height(1.0)) + ' meters AGL\nto clear the first Fresnel zone.\n'
+    if clr.perc_clear:
+        txt = txt + '\n' + "{0:.0f}".format(clr.perc) + '% of the first Fresnel zone is clear.\n'
+    else:
+        txt = txt + '\nAntenna at ' + name2 + ' must be raised to at least '
+        txt = txt + "{0:.2f}".format(clr.required_height(clr.perc / 100.0)) + ' meters AGL\nto clear '
+        txt = txt + "{0:.0f}".format(clr.perc) + '% of the first Fresnel zone.\n'
+    return txt
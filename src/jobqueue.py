@@ -0,0 +1,362 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# jobqueue.py
+# ===========
+# Job protocol between the bot (front end) and the rfprobe workers,
+# and the queue of the jobs.
+#
+# A job is a dict, serialized as json:
+#   { "chat_id": <id>, "kind": "calc" | "rep" | "pow",
+#     "tx": {"name": <site>, "qth": <qth file contents>},
+#     "rx": {"name": <site>, "qth": <qth file contents>},
+#     "params": [earth, freq, perc],
+#     "power": [TxPw, TxCl, TxAg, RxAg, RxCl, RxSe],      (pow only)
+#     "out": <base name of the outputs> }
+# The job carries all its inputs, so it can be executed in any rfprobe
+# directory (prepare), on this or on another host. The result is the
+# rfprobe exit code and the output files (artifacts), as {suffix: bytes}.
+# Each execution has its own scratch directory (scratch_dir), on tmpfs
+# if available: the inputs are written there, the outputs are read once
+# (collect) and the directory is removed, so two jobs of the same chat
+# with the same output name do not overwrite each other's files.
+#
+# Queue interface (open_queue returns one of the backends):
+#   put(job) -> job_id                  front end: enqueue a job
+#   result(job_id) -> None | (retcode, artifacts)
+#   delete(job_id)                      front end: result received
+#   lease(worker_id, seconds) -> None | (job_id, job)
+#   heartbeat(worker_id, job_id, seconds) worker alive, lease of job_id extended
+#   complete(job_id, worker_id, retcode, artifacts)
+#   workers(alive) -> list of (worker_id, last_seen, jobs)
+#   stats() -> dict
+# Delivery is at-least-once: a job whose worker stops sending heartbeats
+# goes back to the queue when its lease expires; if two workers complete
+# the same job, the first result is kept.
+#
+import os
+import os.path
+import json
+import time
+import sqlite3
+import tempfile
+
+import rfcache
+
+MAX_ATTEMPTS = 3            # leases of a job before it fails
+DONE_KEEP = 3600.0          # s, results not collected are removed after this time
+
+# -----------------------------------------------------
+# return the job of an analysis between site1 and site2 (siteregistry.Site)
+def make_job(chat_id, kind, site1, site2, params, out, power=None):
+    job = {
+        'chat_id': chat_id,
+        'kind': kind,
+        'tx': {'name': site1.name, 'qth': site1.qth()},
+        'rx': {'name': site2.name, 'qth': site2.qth()},
+        'params': list(params),
+        'out': out,
+        }
+    if power is not None:
+        job['power'] = list(power)
+    return job
+
+# suffixes of the outputs of a job
+def outputs(job):
+    return rfcache.suffix_dict['pow' if job['kind'] == 'pow' else 'probe']
+
+# -----------------------------------------------------
+# directory of the scratch directories: BOTRF_SCRATCH, default /dev/shm
+# (tmpfs, the outputs never reach the disk) if it can be written,
+# else the temporary directory of the system
+def scratch_root():
+    root = os.environ.get('BOTRF_SCRATCH')
+    if root:
+        return root
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+# new scratch directory of a job, removed by the caller (shutil.rmtree)
+def scratch_dir(root):
+    return tempfile.mkdtemp(prefix='botrf_', dir=root)
+
+# -----------------------------------------------------
+def setTxRwPowFile(dirJob, outPow, TxPw, TxCl, TxAg, RxAg, RxCl, RxSe):
+    outfile = dirJob + '/' + outPow + '.txt'
+    # Write a file
+    out_file = open(outfile, 'wt')
+    print(str(TxPw), file=out_file)
+    print(str(TxCl), file=out_file)
+    print(str(TxAg), file=out_file) 
+    print(str(RxAg), file=out_file) 
+    print(str(RxCl), file=out_file) 
+    print(str(RxSe), file=out_file)
+    out_file.flush()
+    out_file.close()
+        
+# -----------------------------------------------------
+# params: (earth, freq, perc) of the user settings
+def cmdRfProbe(dir, dirJob, txqth, rxqth, outimg, params):
+    earth, freq, perc = params
+
+    # paths in the job directory
+    rp_qthtr_qth=dirJob + '/' + txqth + '.qth'      # qth transmitter
+    rp_qthrx_qth=dirJob + '/' + rxqth + '.qth'      # qth receiver
+    rp_out_png=dirJob + '/' + outimg + '.png'       # output png
+    
+    # set command (argv list, no shell):
+    # fullpath_rfprobe -t rp_qthtr_qth -r rp_qthrx_qth -m earth -d maps -metric -gpsav -p -e -f $8 -fz $9 -h $rp_out_png
+
+    # fullpath_rfprobe
+    cmd = [dir + '/' + 'rfprobe']
+    # -t $rp_qthtr_qth
+    cmd = cmd + ['-t', rp_qthtr_qth]
+    # -r $rp_qthrx_qth
+    cmd = cmd + ['-r', rp_qthrx_qth]
+    # -m earth -d maps -metric -gpsav -p -e 
+    cmd = cmd + ['-m', str(earth), '-d', 'maps', '-metric', '-gpsav', '-p', '-e']
+    # -f freq
+    cmd = cmd + ['-f', str(freq)]
+    # -fz perc
+    cmd = cmd + ['-fz', str(perc)]
+    # -h $rp_out_png
+    cmd = cmd + ['-H', rp_out_png]
+    
+    return cmd
+    
+# -----------------------------------------------------
+# params: (earth, freq, perc) of the user settings
+def cmdRfPower(dir, dirJob, txqth, rxqth, outimg, params):
+    earth, freq, perc = params
+
+    # paths in the job directory
+    rp_qthtr_qth=dirJob + '/' + txqth + '.qth'      # qth transmitter
+    rp_qthrx_qth=dirJob + '/' + rxqth + '.qth'      # qth receiver
+    rp_out =dirJob + '/' + outimg + '.txt'          # output
+    
+    # set command (argv list, no shell):
+    # fullpath_rfprobe -t rp_qthtr_qth -r rp_qthrx_qth -m earth -d maps -metric -gpsav -p -e -f $8 -fz $9 -pw $rp_out
+
+    # fullpath_rfprobe
+    cmd = [dir + '/' + 'rfprobe']
+    # -t $rp_qthtr_qth
+    cmd = cmd + ['-t', rp_qthtr_qth]
+    # -r $rp_qthrx_qth
+    cmd = cmd + ['-r', rp_qthrx_qth]
+    # -m earth -d maps -metric -gpsav -p -e 
+    cmd = cmd + ['-m', str(earth), '-d', 'maps', '-metric', '-gpsav', '-p', '-e']
+    # -f freq
+    cmd = cmd + ['-f', str(freq)]
+    # -fz perc
+    cmd = cmd + ['-fz', str(perc)]
+    # -pw $rp_out
+    cmd = cmd + ['-pw', rp_out]
+    
+    return cmd
+    
+# -----------------------------------------------------
+# write the input files of a job in the directory dirJob and return
+# the rfprobe command (argv list, executed with cwd dir: maps is
+# relative to the rfprobe directory)
+def prepare(dir, dirJob, job):
+    for site in (job['tx'], job['rx']):
+        with open(dirJob + '/' + site['name'] + '.qth', 'wt') as f:
+            f.write(site['qth'])
+    if job['kind'] == 'pow':
+        setTxRwPowFile(dirJob, job['out'], *job['power'])
+        return cmdRfPower(dir, dirJob, job['tx']['name'], job['rx']['name'], job['out'], job['params'])
+    return cmdRfProbe(dir, dirJob, job['tx']['name'], job['rx']['name'], job['out'], job['params'])
+
+# read the outputs of a job prepared in dirJob: {suffix: bytes}
+def collect(dirJob, job):
+    artifacts = {}
+    outbase = dirJob + '/' + job['out']
+    for suffix in outputs(job):
+        if os.path.isfile(outbase + suffix):
+            with open(outbase + suffix, 'rb') as f:
+                artifacts[suffix] = f.read()
+    return artifacts
+
+# ===========================================================
+# SQLite queue: one database file shared by the front ends and the workers
+# of a host (or of hosts that share a local-disk database through a
+# network file system with working locks)
+class SqliteQueue(object):
+    def __init__(self, filename):
+        # isolation_level None: the transactions are explicit (BEGIN IMMEDIATE)
+        self._db = sqlite3.connect(filename, timeout=30.0, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' job TEXT NOT NULL,'
+            ' state TEXT NOT NULL,'             # pending, leased, done
+            ' worker TEXT,'
+            ' lease_until REAL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' retcode INTEGER,'
+            ' tqueued REAL NOT NULL,'
+            ' tdone REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS artifacts ('
+            ' job_id INTEGER NOT NULL,'
+            ' suffix TEXT NOT NULL,'
+            ' data BLOB NOT NULL,'
+            ' PRIMARY KEY (job_id, suffix))')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS workers ('
+            ' worker TEXT PRIMARY KEY,'
+            ' last_seen REAL NOT NULL,'
+            ' jobs INTEGER NOT NULL DEFAULT 0)')
+
+    def close(self):
+        self._db.close()
+
+    # ==========================================================
+    # front end
+    def put(self, job):
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            cur = self._db.execute('INSERT INTO jobs (job, state, tqueued) VALUES (?, ?, ?)',
+                                   (json.dumps(job), 'pending', now))
+            # results never collected (front end stopped)
+            old = 'SELECT id FROM jobs WHERE state=\'done\' AND tdone<?'
+            self._db.execute('DELETE FROM artifacts WHERE job_id IN (' + old + ')', (now - DONE_KEEP,))
+            self._db.execute('DELETE FROM jobs WHERE id IN (' + old + ')', (now - DONE_KEEP,))
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        return cur.lastrowid
+
+    def result(self, job_id):
+        row = self._db.execute('SELECT state, retcode FROM jobs WHERE id=?', (job_id,)).fetchone()
+        if row is None or row[0] != 'done':
+            return None
+        rows = self._db.execute('SELECT suffix, data FROM artifacts WHERE job_id=?', (job_id,))
+        return (row[1], {suffix: bytes(data) for suffix, data in rows})
+
+    def delete(self, job_id):
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute('DELETE FROM artifacts WHERE job_id=?', (job_id,))
+            self._db.execute('DELETE FROM jobs WHERE id=?', (job_id,))
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+
+    # ==========================================================
+    # workers
+    #
+    # take the oldest job waiting, or leased by a worker that has stopped
+    def lease(self, worker_id, seconds):
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            while True:
+                row = self._db.execute(
+                    'SELECT id, job, attempts FROM jobs WHERE state=\'pending\''
+                    ' OR (state=\'leased\' AND lease_until<?) ORDER BY id LIMIT 1', (now,)).fetchone()
+                if row is None or row[2] < MAX_ATTEMPTS:
+                    break
+                # the job has stopped MAX_ATTEMPTS workers: failed
+                self._db.execute('UPDATE jobs SET state=\'done\', retcode=-1, tdone=? WHERE id=?', (now, row[0]))
+            if row is not None:
+                self._db.execute(
+                    'UPDATE jobs SET state=\'leased\', worker=?, lease_until=?, attempts=attempts+1 WHERE id=?',
+                    (worker_id, now + seconds, row[0]))
+            self._touch(worker_id, now, 0)
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return (row[0], json.loads(row[1]))
+
+    def _touch(self, worker_id, now, njobs):
+        self._db.execute('INSERT OR IGNORE INTO workers (worker, last_seen) VALUES (?, ?)', (worker_id, now))
+        self._db.execute('UPDATE workers SET last_seen=?, jobs=jobs+? WHERE worker=?', (now, njobs, worker_id))
+
+    # worker alive; the lease of job_id is extended by seconds
+    def heartbeat(self, worker_id, job_id=None, seconds=None):
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._touch(worker_id, now, 0)
+            if job_id is not None:
+                self._db.execute('UPDATE jobs SET lease_until=? WHERE id=? AND worker=? AND state=\'leased\'',
+                                 (now + seconds, job_id, worker_id))
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+
+    # store the result of a job; return False if the job was already completed
+    def complete(self, job_id, worker_id, retcode, artifacts):
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            cur = self._db.execute(
+                'UPDATE jobs SET state=\'done\', retcode=?, tdone=?, worker=? WHERE id=? AND state!=\'done\'',
+                (retcode, now, worker_id, job_id))
+            done = cur.rowcount > 0
+            if done:
+                self._db.executemany('INSERT OR REPLACE INTO artifacts (job_id, suffix, data) VALUES (?, ?, ?)',
+                                     [(job_id, suffix, data) for suffix, data in artifacts.items()])
+            self._touch(worker_id, now, 1 if done else 0)
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        return done
+
+    # ==========================================================
+    # workers seen in the last alive seconds
+    def workers(self, alive=60.0):
+        rows = self._db.execute('SELECT worker, last_seen, jobs FROM workers WHERE last_seen>=? ORDER BY worker',
+                                (time.time() - alive,))
+        return list(rows)
+
+    def stats(self):
+        counts = dict(self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+        return {
+            'pending': counts.get('pending', 0),
+            'leased': counts.get('leased', 0),
+            'done': counts.get('done', 0),
+            'workers': len(self.workers()),
+            }
+
+# -----------------------------------------------------
+# queue backends: <backend>:<address>; a plain file name is a sqlite queue
+backends = {
+    'sqlite': SqliteQueue,
+    }
+
+def open_queue(spec):
+    backend, sep, address = spec.partition(':')
+    if sep and backend in backends:
+        return backends[backend](address)
+    return SqliteQueue(spec)
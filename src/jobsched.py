@@ -0,0 +1,273 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+# jobsched.py
+# ===========
+# Fair-share scheduler for the rfprobe jobs (calc, rep, pow).
+#
+# - the jobs are divided in two classes: light (calc) and heavy (rep, pow).
+#   Light jobs are served first, but after light_burst consecutive light
+#   jobs a waiting heavy job is served, so heavy jobs never starve.
+# - inside a class, the chats are served round-robin: one job for each chat
+#   with jobs waiting, so a user that sends dozens of requests does not
+#   delay the other users.
+# - at most nworkers jobs run at the same time.
+# - the statistics are kept for the max_chats chats used last; the chats
+#   with jobs waiting or running are never dropped.
+#
+import time
+import asyncio
+import collections
+
+# -----------------------------------------------------
+# job classes: lower value is served first
+JOB_LIGHT = 0
+JOB_HEAVY = 1
+
+job_class = {
+    'calc': JOB_LIGHT,
+    'rep':  JOB_HEAVY,
+    'pow':  JOB_HEAVY,
+    }
+
+# -----------------------------------------------------
+# job waiting in queue
+class Job(object):
+    def __init__(self, chat_id, kind):
+        self.chat_id = chat_id
+        self.kind = kind
+        self.jclass = job_class.get(kind, JOB_HEAVY)
+        self.tqueued = time.time()
+        self.grant = asyncio.Future()      # set when the job can run
+
+# -----------------------------------------------------
+# statistics of a chat
+class ChatStats(object):
+    def __init__(self):
+        self.queued = 0             # jobs waiting now
+        self.running = 0            # jobs running now
+        self.jobs = 0               # jobs completed
+        self.wait_time = 0.0        # sum of the wait times (s)
+        self.wait_max = 0.0         # max wait time (s)
+        self.service_time = 0.0     # sum of the service times (s)
+
+    def as_dict(self):
+        n = max(self.jobs, 1)
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'jobs': self.jobs,
+            'wait_avg': self.wait_time / n,
+            'wait_max': self.wait_max,
+            'service_avg': self.service_time / n,
+            }
+
+# -----------------------------------------------------
+class JobScheduler(object):
+    def __init__(self, nworkers, light_burst=3, max_chats=10000):
+        self._nworkers = max(1, nworkers)
+        self._light_burst = light_burst
+        self._max_chats = max_chats
+        self._running = 0
+        self._nlight = 0            # n. of consecutive light jobs started
+        # for each job class:
+        #   _ring:  chats with jobs waiting, in round-robin order
+        #   _queue: chat_id -> deque of jobs waiting
+        self._ring = {JOB_LIGHT: collections.deque(), JOB_HEAVY: collections.deque()}
+        self._queue = {JOB_LIGHT: {}, JOB_HEAVY: {}}
+        self._stats = collections.OrderedDict()     # chat_id -> ChatStats, last used at the end
+
+    @property
+    def nworkers(self):
+        return self._nworkers
+
+    @property
+    def running(self):
+        return self._running
+
+    def queued(self):
+        return sum(len(q) for c in self._queue.values() for q in c.values())
+
+    # n. of chats with statistics
+    @property
+    def nchats(self):
+        return len(self._stats)
+
+    def chat_stats(self, chat_id):
+        stats = self._stats.pop(chat_id, None)
+        if stats is None:
+            stats = ChatStats()
+            self._evict()
+        self._stats[chat_id] = stats
+        return stats
+
+    # drop the statistics of the idle chats used least recently,
+    # to make room for a new chat
+    def _evict(self):
+        if len(self._stats) < self._max_chats:
+            return
+        for chat_id in list(self._stats):
+            stats = self._stats[chat_id]
+            if stats.queued == 0 and stats.running == 0:
+                del self._stats[chat_id]
+                if len(self._stats) < self._max_chats:
+                    return
+
+    # ==========================================================
+    # return the class of the next job to start, None if no job waits
+    def _next_class(self, nlight):
+        if self._ring[JOB_LIGHT] and self._ring[JOB_HEAVY]:
+            if nlight >= self._light_burst:
+                return JOB_HEAVY
+            return JOB_LIGHT
+        if self._ring[JOB_LIGHT]:
+            return JOB_LIGHT
+        if self._ring[JOB_HEAVY]:
+            return JOB_HEAVY
+        return None
+
+    # remove from queue the next job to start
+    def _pop(self):
+        jclass = self._next_class(self._nlight)
+        if jclass is None:
+            return None
+        if jclass == JOB_LIGHT:
+            self._nlight = self._nlight + 1
+        else:
+            self._nlight = 0
+        ring = self._ring[jclass]
+        queue = self._queue[jclass]
+        chat_id = ring.popleft()
+        job = queue[chat_id].popleft()
+        if queue[chat_id]:
+            ring.append(chat_id)    # other jobs of this chat: back of the ring
+        else:
+            del queue[chat_id]
+        return job
+
+    # start the waiting jobs while there are free workers
+    def _dispatch(self):
+        while self._running < self._nworkers:
+            job = self._pop()
+            if job is None:
+                return
+            if job.grant.cancelled():
+                continue
+            self._running = self._running + 1
+            job.grant.set_result(True)
+
+    def _remove(self, job):
+        queue = self._queue[job.jclass]
+        if job.chat_id in queue and job in queue[job.chat_id]:
+            queue[job.chat_id].remove(job)
+            if not queue[job.chat_id]:
+                del queue[job.chat_id]
+                self._ring[job.jclass].remove(job.chat_id)
+
+    # ==========================================================
+    # return the n. of jobs that will start before job.
+    # The scheduling is simulated on the number of jobs waiting
+    # in each chat, without copying the jobs.
+    def position(self, job):
+        queue = self._queue[job.jclass]
+        if job.chat_id not in queue:
+            return 0
+        index = list(queue[job.chat_id]).index(job)
+        ring = {c: collections.deque(self._ring[c]) for c in self._ring}
+        count = {c: {k: len(q) for k, q in self._queue[c].items()} for c in self._queue}
+        nlight = self._nlight
+        pos = 0
+        while True:
+            if ring[JOB_LIGHT] and ring[JOB_HEAVY]:
+                jclass = JOB_HEAVY if nlight >= self._light_burst else JOB_LIGHT
+            else:
+                jclass = JOB_LIGHT if ring[JOB_LIGHT] else JOB_HEAVY
+            nlight = nlight + 1 if jclass == JOB_LIGHT else 0
+            chat_id = ring[jclass].popleft()
+            count[jclass][chat_id] = count[jclass][chat_id] - 1
+            if jclass == job.jclass and chat_id == job.chat_id:
+                if index == 0:
+                    return pos
+                index = index - 1
+            if count[jclass][chat_id] > 0:
+                ring[jclass].append(chat_id)
+            pos = pos + 1
+
+    # ==========================================================
+    # run the coroutine function corofunc(*args) as a job of chat_id.
+    # kind is the command (calc, rep, pow).
+    # If the job must wait, the coroutine function notify(position)
+    # is called with the position in queue (0 = next job to start).
+    # return the result of corofunc
+    @asyncio.coroutine
+    def run(self, chat_id, kind, corofunc, *args, notify=None):
+        job = Job(chat_id, kind)
+        stats = self.chat_stats(chat_id)
+        queue = self._queue[job.jclass]
+        if chat_id not in queue:
+            queue[chat_id] = collections.deque()
+            self._ring[job.jclass].append(chat_id)
+        queue[chat_id].append(job)
+        stats.queued = stats.queued + 1
+        self._dispatch()
+
+        try:
+            if not job.grant.done() and notify is not None:
+                yield from notify(self.position(job))
+            yield from job.grant
+        except:
+            # cancelled while waiting
+            stats.queued = stats.queued - 1
+            if job.grant.done() and not job.grant.cancelled():
+                self._running = self._running - 1
+            else:
+                job.grant.cancel()
+                self._remove(job)
+            self._dispatch()
+            raise
+
+        tstart = time.time()
+        wait = tstart - job.tqueued
+        stats.queued = stats.queued - 1
+        stats.running = stats.running + 1
+        try:
+            result = yield from corofunc(*args)
+        finally:
+            stats.running = stats.running - 1
+            stats.jobs = stats.jobs + 1
+            stats.wait_time = stats.wait_time + wait
+            stats.wait_max = max(stats.wait_max, wait)
+            stats.service_time = stats.service_time + (time.time() - tstart)
+            self._running = self._running - 1
+            self._dispatch()
+        return result
+
+    # ==========================================================
+    # text report of the statistics of a chat
+    def stats_text(self, chat_id):
+        s = self._stats.get(chat_id, ChatStats()).as_dict()
+        txt = 'Workers busy: ' + str(self._running) + '/' + str(self._nworkers) + '\n'
+        txt = txt + 'Jobs in queue (all users): ' + str(self.queued()) + '\n'
+        txt = txt + 'Your jobs in queue: ' + str(s['queued']) + '\n'
+        txt = txt + 'Your jobs running: ' + str(s['running']) + '\n'
+        txt = txt + 'Your jobs completed: ' + str(s['jobs']) + '\n'
+        txt = txt + 'Average wait: ' + "{0:.1f}".format(s['wait_avg']) + ' s'
+        txt = txt + ' (max ' + "{0:.1f}".format(s['wait_max']) + ' s)\n'
+        txt = txt + 'Average service time: ' + "{0:.1f}".format(s['service_avg']) + ' s\n'
+        return txt
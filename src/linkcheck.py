@@ -0,0 +1,98 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# linkcheck.py
+# ============
+# Quick line of sight check of a link, done before the full analysis.
+#
+# Only the links that are clearly not feasible are detected:
+#   - distance beyond the radio horizon: the great-circle distance is longer
+#     than the sum of the radio horizons of the two antennas, with the
+#     earth radius multiplier. Without terrain the antennas are placed on
+#     the highest ground of the earth (MAX_ELEVATION), so only the links
+#     that cannot work anywhere (es. wrong coordinates) are rejected.
+#   - terrain: with the terrain tiles (numpy), a coarse profile of
+#     nSamples points is taken; the samples are real terrain points, so a
+#     sample above the line of sight by more than ELEV_MARGIN is an obstruction.
+# The other links (maybe feasible) go to the full analysis.
+#
+import math
+
+import terrain
+
+MAX_ELEVATION = 8850.0          # m, highest ground on the earth
+ELEV_MARGIN = 20.0              # m, tolerance of the interpolated elevations
+nSamples = 64                   # samples of the coarse profile
+
+# -----------------------------------------------------
+# radio horizon (m) of an antenna at h meters above the ground level
+def radio_horizon(h, earth):
+    return math.sqrt(2.0 * earth * terrain.EARTH_RADIUS * max(h, 0.0))
+
+# -----------------------------------------------------
+# check the link site1 -> site2 (siteregistry.Site).
+# tiles: terrain.TerrainTiles, None if not available; earth: earth radius multiplier.
+# return the text of the verdict if the link is clearly not feasible, else None
+# (also if the inputs are not valid: no verdict, the full analysis decides)
+def precheck(tiles, site1, site2, earth):
+    try:
+        h1 = site1.height()
+        h2 = site2.height()
+    except ValueError:
+        # antenna height not a number
+        return None
+    if not (earth > 0.0 and math.isfinite(earth)):
+        return None
+    d = terrain.distance(site1.lat, site1.lon, site2.lat, site2.lon)
+    z1 = z2 = MAX_ELEVATION
+    elev = None
+    if tiles is not None and d > 0.0:
+        n = max(2, min(nSamples, int(d / 90.0) + 1))
+        lat, lon, dist = terrain.great_circle(site1.lat, site1.lon, site2.lat, site2.lon, n)
+        elev = tiles.elevation(lat, lon)
+        if elev[0] == elev[0]:                  # not nan
+            z1 = float(elev[0])
+        if elev[-1] == elev[-1]:
+            z2 = float(elev[-1])
+
+    txt = None
+    horizon = radio_horizon(z1 + h1, earth) + radio_horizon(z2 + h2, earth)
+    if d > horizon:
+        txt = 'Distance ' + "{0:.1f}".format(d / 1000.0) + ' km, beyond the radio horizon of the antennas ('
+        txt = txt + "{0:.1f}".format(horizon / 1000.0) + ' km with earth radius multiplier ' + str(earth) + ').\n'
+    elif elev is not None and n > 2 and z1 != MAX_ELEVATION and z2 != MAX_ELEVATION:
+        # coarse profile: terrain raised by the earth curvature against the line of sight
+        ztx = z1 + h1
+        zrx = z2 + h2
+        inner = slice(1, -1)
+        x = dist[inner]
+        los = ztx + (zrx - ztx) * x / dist[-1]
+        ground = elev[inner] + x * (dist[-1] - x) / (2.0 * earth * terrain.EARTH_RADIUS)
+        above = ground - los
+        # the samples without terrain are nan, ignored
+        above[above != above] = -math.inf
+        k = int(above.argmax())
+        if above[k] > ELEV_MARGIN:
+            txt = 'Terrain above the line of sight by ' + "{0:.0f}".format(float(above[k])) + ' m at '
+            txt = txt + "{0:.1f}".format(float(x[k]) / 1000.0) + ' km from ' + site1.name + '.\n'
+    if txt is None:
+        return None
+    return ('Quick check: the link ' + site1.name + ' - ' + site2.name + ' is not feasible.\n' + txt +
+            'To run the full analysis anyway, add -f to the command.\n')
@@ -0,0 +1,178 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# metrics.py
+# ==========
+# Metrics of the bot in the Prometheus text format, served by a small
+# HTTP server (GET /metrics), normally on localhost.
+#
+# The metrics are updated in the event loop thread, so no locks are used:
+# a counter increment is a dict update, a histogram observation a bisect
+# on the bucket bounds. The values computed from other objects (es. jobs
+# in queue) are read by a callback only when the metrics are requested.
+#
+import bisect
+import asyncio
+
+# latency buckets (s): from 1 ms (commands answered at once) to 5 minutes (rfprobe)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# -----------------------------------------------------
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(n + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for n, v in zip(names, values)) + '}'
+
+def _value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+# -----------------------------------------------------
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}               # label values -> value
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, v in sorted(self._values.items()):
+            yield self.name + _labels(self.labelnames, labels) + ' ' + _value(v)
+
+# -----------------------------------------------------
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+# gauge without labels read from func() when the metrics are requested
+class GaugeFunc(object):
+    kind = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self._func = func
+
+    def samples(self):
+        yield self.name + ' ' + _value(self._func())
+
+# -----------------------------------------------------
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._bounds = tuple(buckets)
+        self._values = {}           # label values -> [bucket counts (not cumulated), sum, count]
+
+    def observe(self, value, *labels):
+        h = self._values.get(labels)
+        if h is None:
+            h = self._values[labels] = [[0] * (len(self._bounds) + 1), 0.0, 0]
+        h[0][bisect.bisect_left(self._bounds, value)] += 1
+        h[1] += value
+        h[2] += 1
+
+    def samples(self):
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, n) in sorted(self._values.items()):
+            cum = 0
+            for bound, c in zip(self._bounds + (float('inf'),), counts):
+                cum = cum + c
+                yield self.name + '_bucket' + _labels(names, labels + (_value(bound),)) + ' ' + str(cum)
+            yield self.name + '_sum' + _labels(self.labelnames, labels) + ' ' + _value(total)
+            yield self.name + '_count' + _labels(self.labelnames, labels) + ' ' + str(n)
+
+# -----------------------------------------------------
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.add(Gauge(name, help, labelnames))
+
+    def gauge_func(self, name, help, func):
+        return self.add(GaugeFunc(name, help, func))
+
+    def histogram(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    # text of all the metrics (Prometheus text format 0.0.4)
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append('# HELP ' + m.name + ' ' + m.help)
+            lines.append('# TYPE ' + m.name + ' ' + m.kind)
+            lines.extend(m.samples())
+        return '\n'.join(lines) + '\n'
+
+    # ==========================================================
+    # HTTP server: GET /metrics returns render(), other paths 404
+    @asyncio.coroutine
+    def _serve(self, reader, writer):
+        try:
+            request = yield from reader.readline()
+            # skip the headers
+            while True:
+                line = yield from reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            fields = request.split()
+            if len(fields) >= 2 and fields[0] == b'GET' and fields[1].split(b'?')[0] == b'/metrics':
+                status = b'200 OK'
+                body = self.render().encode('utf-8')
+            else:
+                status = b'404 Not Found'
+                body = b'Not found\n'
+            writer.write(b'HTTP/1.0 ' + status + b'\r\n'
+                         b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+            yield from writer.drain()
+        finally:
+            writer.close()
+
+    # start the HTTP server, return the server
+    @asyncio.coroutine
+    def start_server(self, host, port):
+        return (yield from asyncio.start_server(self._serve, host, port))
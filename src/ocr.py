@@ -0,0 +1,175 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# ocr.py
+# ======
+# OCR of the photos of coordinate sheets and tables of sites (needs PIL,
+# pytesseract and the tesseract program).
+#
+# The OCR stack is imported only in the workers, at the first photo: the
+# start of the bot does not load PIL and pytesseract. Tesseract runs in a
+# pool of processes (OcrPool) with a bounded number of photos waiting, so a
+# burst of photos does not block the event loop nor fill the memory.
+#
+# Each row of the text read is a site:
+#   <name> <lat> <lon> [<antenna height>] [...]
+# lat and lon: decimal degrees (45.5 or 45,5) or d:m:s / d°m's" with the
+# direction (n, s, e, w); the antenna height can end with m, default 3 m
+# (as the site command). The columns can be separated by spaces, tabs,
+# | or ;. The rows that are not sites (titles, headers) are skipped.
+#
+import io
+import re
+import asyncio
+import contextlib
+import importlib.util
+import concurrent.futures
+import concurrent.futures.process
+
+import siteregistry
+
+DEFAULT_ANTENNA = '3'       # m, as the site command
+MAX_ANTENNA = 300.0         # m
+
+# -----------------------------------------------------
+# return True if the OCR can be used (without importing the modules)
+def available():
+    return (importlib.util.find_spec('pytesseract') is not None and
+            importlib.util.find_spec('PIL') is not None)
+
+# run in the workers: text of the image data (bytes of a jpeg or png)
+def image_to_text(data, lang='eng'):
+    from PIL import Image
+    import pytesseract
+    img = Image.open(io.BytesIO(data))
+    # gray levels: the same result and faster
+    return pytesseract.image_to_string(img.convert('L'), lang=lang)
+
+# -----------------------------------------------------
+_reName = re.compile(r'^[a-z][a-z0-9_\-]*$')
+_reDms = re.compile(r'^([+-]?\d+(?:\.\d+)?)[:°º*](\d+(?:\.\d+)?)[:\'’]?(?:(\d+(?:\.\d+)?)["”]?)?([nsew]?)$')
+_reDeg = re.compile(r'^([+-]?\d+(?:\.\d+)?)°?([nsew]?)$')
+_reHeight = re.compile(r'^(\d+(?:\.\d+)?)m?$')
+
+# degrees of a coordinate, None if the token is not a coordinate
+def _degrees(token):
+    m = _reDms.match(token)
+    if m:
+        value = float(m.group(1))
+        sign = -1.0 if value < 0 or m.group(1).startswith('-') else 1.0
+        value = abs(value) + float(m.group(2)) / 60.0 + float(m.group(3) or 0) / 3600.0
+        direction = m.group(4)
+    else:
+        m = _reDeg.match(token)
+        if not m:
+            return None
+        value = float(m.group(1))
+        sign = 1.0
+        direction = m.group(2)
+    if direction in ('s', 'w'):
+        sign = -sign
+    return sign * value
+
+# tokens of a row: the decimal comma is replaced by the point,
+# the other separators by spaces
+def _tokens(line):
+    line = re.sub(r'(\d),(\d)', r'\1.\2', line.strip().lower())
+    return re.sub(r'[|;,\t]', ' ', line).split()
+
+# return the Site of a row, None if the row is not a site
+def parse_row(line):
+    tokens = _tokens(line)
+    if len(tokens) < 3 or not _reName.match(tokens[0]):
+        return None
+    lat = _degrees(tokens[1])
+    lon = _degrees(tokens[2])
+    if lat is None or lon is None or abs(lat) > 90.0 or abs(lon) > 180.0:
+        return None
+    height = DEFAULT_ANTENNA
+    if len(tokens) > 3:
+        m = _reHeight.match(tokens[3])
+        if m and float(m.group(1)) <= MAX_ANTENNA:
+            height = m.group(1)
+    return siteregistry.Site(tokens[0], tokens[0], lat, lon, height + 'm')
+
+# return the sites of the text (list of Site; the last row of a name wins)
+def parse_sites(text):
+    found = {}
+    for line in text.splitlines():
+        site = parse_row(line)
+        if site is not None:
+            found[site.name] = site
+    return list(found.values())
+
+# -----------------------------------------------------
+class OcrBusy(Exception):
+    pass
+
+# pool of the OCR workers: the processes are started at the first photo.
+# At most maxqueue photos are in the pool (downloading, running or
+# waiting), the others are refused with OcrBusy
+class OcrPool(object):
+    def __init__(self, workers, maxqueue):
+        self._workers = workers
+        self._maxqueue = max(maxqueue, workers)
+        self._pool = None
+        self.pending = 0
+
+    # reserve a place for a photo, released at the end of the with block;
+    # OcrBusy if the pool is full. The place is taken before the download,
+    # so the photos refused are not downloaded
+    @contextlib.contextmanager
+    def reserve(self):
+        if self.pending >= self._maxqueue:
+            raise OcrBusy()
+        self.pending = self.pending + 1
+        try:
+            yield
+        finally:
+            self.pending = self.pending - 1
+
+    # coroutine: text of the image data, in a place taken with reserve().
+    # A worker killed (es. out of memory on a large photo) breaks the pool:
+    # the photo fails and the pool is created again at the next photo
+    @asyncio.coroutine
+    def run(self, data, lang):
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self._workers)
+        pool = self._pool
+        loop = asyncio.get_event_loop()
+        try:
+            return (yield from loop.run_in_executor(pool, image_to_text, data, lang))
+        except concurrent.futures.process.BrokenProcessPool:
+            # the photos running at the same time see the same broken pool
+            if self._pool is pool:
+                self._pool = None
+            pool.shutdown(wait=False)
+            raise
+
+    # coroutine: text of the image data
+    @asyncio.coroutine
+    def image_to_text(self, data, lang):
+        with self.reserve():
+            return (yield from self.run(data, lang))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,232 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+# rfcache.py
+# ==========
+# Content-addressed cache of the rfprobe outputs.
+#
+# The key of an analysis is the hash of the analysis kind, the contents
+# of the site (.qth) files and the parameters (earth, freq, perc ...).
+# The outputs are stored in the cache directory as <key><suffix>
+# (es. <key>.png, <key>_red.txt); the total size of the cache is limited,
+# the least recently used analyses are removed first.
+#
+import os
+import os.path
+import hashlib
+import contextlib
+import collections
+
+# -----------------------------------------------------
+# outputs generated by rfprobe for each kind of analysis
+suffix_dict = {
+    'probe': ['.png', '.txt', '_red.txt'],      # calc, rep
+    'pow':   ['.png'],                          # pow
+    }
+all_suffixes = sorted(set(s for lst in suffix_dict.values() for s in lst))
+
+# -----------------------------------------------------
+# return the cache key.
+# contents: list of input files contents (site qth files)
+# params:   list of parameter values
+def key(kind, contents, params):
+    h = hashlib.sha1()
+    h.update(kind.encode('utf-8'))
+    for text in contents:
+        data = text.encode('utf-8')
+        # separate the files, so the key depends on their order
+        h.update(str(len(data)).encode('utf-8') + b'\0')
+        h.update(data)
+    for value in params:
+        h.update(repr(float(value)).encode('utf-8') + b'\0')
+    return h.hexdigest()
+
+# -----------------------------------------------------
+class ResultCache(object):
+    def __init__(self, dir, maxbytes):
+        self._dir = dir
+        self._maxbytes = maxbytes
+        self._size = 0
+        self._index = collections.OrderedDict()     # key -> size, LRU first
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        self._load()
+
+    # rebuild the index from the files in the cache directory,
+    # ordered by last use (file modification time)
+    def _load(self):
+        entries = {}
+        for name in os.listdir(self._dir):
+            filename = os.path.join(self._dir, name)
+            if not os.path.isfile(filename):
+                continue
+            k = name[:40]                   # sha1 hex digest
+            st = os.stat(filename)
+            size, mtime = entries.get(k, (0, 0.0))
+            entries[k] = (size + st.st_size, max(mtime, st.st_mtime))
+        for k in sorted(entries, key=lambda k: entries[k][1]):
+            self._index[k] = entries[k][0]
+            self._size = self._size + entries[k][0]
+        self._evict()
+
+    def _path(self, key, suffix):
+        return os.path.join(self._dir, key + suffix)
+
+    def _remove(self, key):
+        size = self._index.pop(key)
+        self._size = self._size - size
+        for suffix in all_suffixes:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(key, suffix))
+
+    def _evict(self):
+        while self._size > self._maxbytes and self._index:
+            self._remove(next(iter(self._index)))
+
+    # ==========================================================
+    # return the outputs of the analysis ({suffix: bytes}),
+    # None if the analysis is not in cache
+    def get(self, key, kind):
+        if key not in self._index:
+            self.misses = self.misses + 1
+            return None
+        artifacts = {}
+        try:
+            for suffix in suffix_dict[kind]:
+                with open(self._path(key, suffix), 'rb') as f:
+                    artifacts[suffix] = f.read()
+                os.utime(self._path(key, suffix))
+        except OSError:
+            # cache file removed from outside: drop the entry
+            self._remove(key)
+            self.misses = self.misses + 1
+            return None
+        self._index.move_to_end(key)
+        self.hits = self.hits + 1
+        return artifacts
+
+    # store in cache the outputs of an analysis ({suffix: bytes})
+    def put(self, key, kind, artifacts):
+        if key in self._index:
+            self._remove(key)
+        if any(suffix not in artifacts for suffix in suffix_dict[kind]):
+            # incomplete analysis: not stored
+            return False
+        size = 0
+        for suffix in suffix_dict[kind]:
+            with open(self._path(key, suffix), 'wb') as f:
+                f.write(artifacts[suffix])
+            size = size + len(artifacts[suffix])
+        self._index[key] = size
+        self._size = self._size + size
+        self._evict()
+        return True
+
+    # ==========================================================
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._index),
+            'bytes': self._size,
+            'maxbytes': self._maxbytes,
+            }
+
+# -----------------------------------------------------
+# Cache of the Telegram file_id of the images already sent.
+#
+# The key is the hash of the image contents; a byte-identical image
+# is sent again through its file_id, without upload.
+# The mappings are appended to a log file (one "<hash> <file_id>" per line),
+# loaded at start-up; when the log is too long it is rewritten with
+# only the last maxentries mappings.
+class FileIdCache(object):
+    def __init__(self, filename, maxentries):
+        self._filename = filename
+        self._maxentries = maxentries
+        self._index = collections.OrderedDict()     # hash -> file_id, LRU first
+        self._nlines = 0                            # lines in log file
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self._filename):
+            return
+        with open(self._filename, 'rt') as f:
+            for line in f:
+                fields = line.split()
+                self._nlines = self._nlines + 1
+                if len(fields) != 2:
+                    continue
+                self._index.pop(fields[0], None)
+                if fields[1] != '-':                # '-': mapping removed
+                    self._index[fields[0]] = fields[1]
+        while len(self._index) > self._maxentries:
+            self._index.popitem(last=False)
+        if self._nlines > 2 * self._maxentries:
+            self._compact()
+
+    # rewrite the log file with the current mappings
+    def _compact(self):
+        tmpname = self._filename + '.tmp'
+        with open(tmpname, 'wt') as f:
+            for h, file_id in self._index.items():
+                print(h + ' ' + file_id, file=f)
+        os.replace(tmpname, self._filename)
+        self._nlines = len(self._index)
+
+    def _append(self, h, file_id):
+        with open(self._filename, 'at') as f:
+            print(h + ' ' + file_id, file=f)
+        self._nlines = self._nlines + 1
+        if self._nlines > 2 * self._maxentries:
+            self._compact()
+
+    # ==========================================================
+    # return the file_id of the image with hash h, None if unknown
+    def get(self, h):
+        file_id = self._index.get(h)
+        if file_id is None:
+            self.misses = self.misses + 1
+            return None
+        self._index.move_to_end(h)
+        self.hits = self.hits + 1
+        return file_id
+
+    def put(self, h, file_id):
+        self._index.pop(h, None)
+        self._index[h] = file_id
+        while len(self._index) > self._maxentries:
+            self._index.popitem(last=False)
+        self._append(h, file_id)
+
+    # remove a file_id refused by Telegram
+    def remove(self, h):
+        if self._index.pop(h, None) is not None:
+            self._append(h, '-')
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._index),
+            }
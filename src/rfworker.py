@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# rfworker.py
+# ===========
+# rfprobe worker daemon: takes the jobs of the bot from the job queue
+# (jobqueue.py), runs rfprobe and stores the outputs in the queue.
+#
+# Use:
+#   python3 rfworker.py <queue> <rfprobe dir> [n. of workers]
+# <queue>: queue of the bot (BOTRF_QUEUE), es. /srv/botrf/jobs.db
+# <rfprobe dir>: directory with rfprobe and the maps directory
+# Default n. of workers: n. of cpu cores.
+#
+# More daemons can serve the same queue, on this or on other hosts.
+# While rfprobe runs, the worker sends a heartbeat every HEARTBEAT s;
+# if the worker stops, its job goes back to the queue after LEASE s.
+#
+import sys
+import os
+import os.path
+import time
+import socket
+import shutil
+import sqlite3
+import threading
+import traceback
+import subprocess
+
+import jobqueue
+
+LEASE = 30.0            # s, lease of a job
+HEARTBEAT = 10.0        # s, between two heartbeats
+POLL = 0.2              # s, wait when the queue is empty
+
+# -----------------------------------------------------
+class Worker(object):
+    def __init__(self, spec, dirProbe, worker_id):
+        self._spec = spec
+        self._queue = None
+        self._dir = dirProbe
+        self._scratch = jobqueue.scratch_root()
+        self.worker_id = worker_id
+        self.jobs = 0
+
+    # run a job, return (retcode, artifacts).
+    # The inputs and the outputs are in a scratch directory of the job
+    # (BOTRF_SCRATCH, default /dev/shm), removed at the end
+    def execute(self, job_id, job):
+        dirJob = jobqueue.scratch_dir(self._scratch)
+        proc = None
+        retcode = None
+        try:
+            cmd = jobqueue.prepare(self._dir, dirJob, job)
+            proc = subprocess.Popen(cmd, cwd=self._dir, stdin=subprocess.DEVNULL)
+            while True:
+                try:
+                    retcode = proc.wait(timeout=HEARTBEAT)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                try:
+                    self._queue.heartbeat(self.worker_id, job_id, LEASE)
+                except sqlite3.Error:
+                    # es. database is locked: rfprobe goes on, the lease is
+                    # renewed by the next heartbeat (or it expires)
+                    traceback.print_exc()
+            return (retcode, jobqueue.collect(dirJob, job))
+        finally:
+            # rfprobe still running (error, thread stopped): it is stopped
+            # before its scratch directory is removed
+            if proc is not None and retcode is None:
+                proc.kill()
+                proc.wait()
+            shutil.rmtree(dirJob, ignore_errors=True)
+
+    # take and run the jobs until stop is set
+    def run(self, stop):
+        # the connection is used only by the thread that creates it
+        self._queue = jobqueue.open_queue(self._spec)
+        tbeat = 0.0
+        while not stop.is_set():
+            try:
+                lease = self._queue.lease(self.worker_id, LEASE)
+                if lease is None:
+                    if time.time() - tbeat > HEARTBEAT:
+                        self._queue.heartbeat(self.worker_id)
+                        tbeat = time.time()
+                    stop.wait(POLL)
+                    continue
+                job_id, job = lease
+                try:
+                    retcode, artifacts = self.execute(job_id, job)
+                except Exception:
+                    # malformed job, rfprobe not started ...: the job fails
+                    traceback.print_exc()
+                    retcode, artifacts = -1, {}
+                self._queue.complete(job_id, self.worker_id, retcode, artifacts)
+                self.jobs = self.jobs + 1
+                tbeat = time.time()
+            except Exception:
+                # error of the queue (es. sqlite3.OperationalError: database is
+                # locked): the worker goes on; a job not completed goes back
+                # to the queue when its lease expires
+                traceback.print_exc()
+                stop.wait(POLL)
+        self._queue.close()
+
+# -----------------------------------------------------
+# start n workers (threads, each with its own connection to the queue).
+# spec: queue (see jobqueue.open_queue).
+# return the list of (thread, worker)
+def start(spec, dirProbe, n, stop):
+    lst = []
+    for i in range(n):
+        worker_id = socket.gethostname() + '/' + str(os.getpid()) + '/' + str(i)
+        worker = Worker(spec, dirProbe, worker_id)
+        thread = threading.Thread(target=worker.run, args=(stop,), name=worker_id)
+        thread.daemon = True
+        thread.start()
+        lst.append((thread, worker))
+    return lst
+
+# ===========================================================
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print('Use: ' + sys.argv[0] + ' <queue> <rfprobe dir> [n. of workers]')
+        sys.exit(1)
+    n = int(sys.argv[3]) if len(sys.argv) == 4 else (os.cpu_count() or 1)
+    stop = threading.Event()
+    workers = start(sys.argv[1], os.path.abspath(sys.argv[2]), n, stop)
+    print(str(n) + ' workers on ' + sys.argv[1])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread, worker in workers:
+            thread.join()
@@ -0,0 +1,294 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# sendqueue.py
+# ============
+# Outbound queue of the messages sent to Telegram.
+#
+# Each chat has its own queue, served in order by a task of the event loop:
+#   - consecutive texts are merged in one message (separated by a new line)
+#     up to the Telegram limit of MAX_TEXT characters, so an echo, the
+#     result and the report pieces of a command cost one request
+#   - the sends are scheduled by token buckets: one global (all the chats)
+#     and one for each chat
+#   - an answer 429 (Too Many Requests) is retried after its retry_after,
+#     or with exponential backoff, instead of failing the handler; the files
+#     uploaded (es. (name, BytesIO) of sendPhoto) are rewound before the retry
+# The texts are sent in background: sendMessage returns as soon as the text
+# is queued. The other methods (sendPhoto, sendDocument ...) wait for the
+# Telegram answer, so the caller gets the result (es. the file_id) or the
+# error, and they keep their order with the texts.
+#
+import time
+import asyncio
+import traceback
+import collections
+
+import telepot.exception
+
+MAX_TEXT = 4096                 # characters of a Telegram message
+MAX_RETRIES = 5                 # sends of a request answered 429
+MAX_BACKOFF = 30.0              # s, wait when the answer has no retry_after
+
+# -----------------------------------------------------
+# split a text longer than maxlen in pieces, at the end of the lines
+# if possible
+def split_text(text, maxlen=MAX_TEXT):
+    pieces = []
+    while len(text) > maxlen:
+        cut = text.rfind('\n', 0, maxlen + 1)
+        if cut <= 0:
+            cut = maxlen
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        pieces.append(text)
+    return pieces
+
+# pack the lines (es. of a file, read one at a time) in texts of at
+# most maxlen characters, ended at the end of a line; a longer line is split.
+# The texts with only blank lines are not returned (refused by Telegram)
+def pack_lines(lines, maxlen=MAX_TEXT):
+    piece = []
+    size = 0
+    for line in lines:
+        line = line.rstrip('\n')
+        while len(line) > maxlen:
+            text = '\n'.join(piece)
+            if text.strip():
+                yield text
+            piece, size = [], 0
+            yield line[:maxlen]
+            line = line[maxlen:]
+        if piece and size + 1 + len(line) > maxlen:
+            text = '\n'.join(piece)
+            if text.strip():
+                yield text
+            piece, size = [], 0
+        size = size + (1 if piece else 0) + len(line)
+        piece.append(line)
+    text = '\n'.join(piece)
+    if text.strip():
+        yield text
+
+# -----------------------------------------------------
+# token bucket: rate tokens/s, at most burst tokens.
+# rate 0: no limit
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._t = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+        self._t = now
+
+    # reserve a token; return the wait (s) before it can be used
+    def take(self):
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        self._tokens = self._tokens - 1
+        return max(0.0, -self._tokens / self.rate)
+
+    # s, time to fill the bucket again
+    def idle_time(self):
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return (self.burst - self._tokens) / self.rate
+
+# -----------------------------------------------------
+# requests in the queue of a chat
+class _Text(object):
+    def __init__(self, text, kwargs):
+        self.text = text
+        self.kwargs = kwargs
+
+class _Call(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.Future()
+        # files of the arguments (file object or (name, file object)), with
+        # their start position: read to the end by each send
+        self.files = []
+        for arg in list(args) + list(kwargs.values()):
+            for f in (arg if isinstance(arg, tuple) else (arg,)):
+                if hasattr(f, 'seek') and hasattr(f, 'tell'):
+                    self.files.append((f, f.tell()))
+
+    # rewind the files, before the request is sent again
+    def rewind(self):
+        for f, pos in self.files:
+            f.seek(pos)
+
+# -----------------------------------------------------
+class Outbox(object):
+    def __init__(self, rate=30.0, burst=30, chat_rate=1.0, chat_burst=5, maxlen=MAX_TEXT):
+        self._bucket = TokenBucket(rate, burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._maxlen = maxlen
+        self._queues = {}               # chat_id -> deque of _Text, _Call
+        self._buckets = {}              # chat_id -> TokenBucket
+        self._tasks = {}                # chat_id -> task serving the queue
+        self.sent = 0                   # requests sent
+        self.merged = 0                 # texts merged in a previous message
+        self.retries = 0                # requests answered 429 and sent again
+        self.errors = 0                 # texts not sent
+
+    # sender of a chat, with the methods of telepot.helper.Sender
+    def sender(self, bot, chat_id):
+        return ChatSender(self, bot, chat_id)
+
+    # queue a text (not sent if empty: refused by Telegram)
+    def send_text(self, bot, chat_id, text, **kwargs):
+        queue = self._queue(bot, chat_id)
+        for piece in split_text(text, self._maxlen):
+            tail = queue[-1] if queue else None
+            if (not kwargs and isinstance(tail, _Text) and not tail.kwargs and
+                    len(tail.text) + 1 + len(piece) <= self._maxlen):
+                tail.text = tail.text + '\n' + piece
+                self.merged = self.merged + 1
+            else:
+                queue.append(_Text(piece, kwargs))
+
+    # queue a call of the bot method, after the texts already queued.
+    # return the Telegram answer
+    @asyncio.coroutine
+    def call(self, bot, method, chat_id, *args, **kwargs):
+        request = _Call(getattr(bot, method), (chat_id,) + args, kwargs)
+        self._queue(bot, chat_id).append(request)
+        return (yield from request.future)
+
+    def _queue(self, bot, chat_id):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = collections.deque()
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.ensure_future(self._serve(bot, chat_id, queue))
+        return queue
+
+    # ==========================================================
+    @asyncio.coroutine
+    def _serve(self, bot, chat_id, queue):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        try:
+            # the texts queued until the send are merged in the head of the queue
+            while queue:
+                wait = max(bucket.take(), self._bucket.take())
+                if wait > 0:
+                    yield from asyncio.sleep(wait)
+                else:
+                    # let the handler queue the texts of the same step
+                    yield from asyncio.sleep(0)
+                request = queue.popleft()
+                yield from self._send(bot, chat_id, request)
+        finally:
+            del self._tasks[chat_id]
+            del self._queues[chat_id]
+            # the bucket is kept until it is full again
+            asyncio.get_event_loop().call_later(bucket.idle_time(), self._forget, chat_id)
+
+    def _forget(self, chat_id):
+        if chat_id not in self._tasks:
+            self._buckets.pop(chat_id, None)
+
+    # send a request, retrying the answers 429
+    @asyncio.coroutine
+    def _send(self, bot, chat_id, request):
+        backoff = 1.0
+        for attempt in range(MAX_RETRIES):
+            try:
+                if isinstance(request, _Text):
+                    yield from bot.sendMessage(chat_id, request.text, **request.kwargs)
+                else:
+                    result = yield from request.func(*request.args, **request.kwargs)
+                    request.future.set_result(result)
+                self.sent = self.sent + 1
+                return
+            except telepot.exception.TelegramError as e:
+                if e.error_code != 429 or attempt == MAX_RETRIES - 1:
+                    error = e
+                    break
+                retry_after = (e.json or {}).get('parameters', {}).get('retry_after')
+                self.retries = self.retries + 1
+                yield from asyncio.sleep(retry_after if retry_after else backoff)
+                backoff = min(2 * backoff, MAX_BACKOFF)
+                if isinstance(request, _Call):
+                    request.rewind()
+            except Exception as e:
+                error = e
+                break
+        if isinstance(request, _Call):
+            request.future.set_exception(error)
+        else:
+            self.errors = self.errors + 1
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    # ==========================================================
+    # n. of requests waiting
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    # wait until all the queues are sent
+    @asyncio.coroutine
+    def join(self):
+        while self._tasks:
+            yield from asyncio.wait(list(self._tasks.values()))
+
+    def stats(self):
+        return {
+            'queued': self.queued(),
+            'chats': len(self._tasks),
+            'sent': self.sent,
+            'merged': self.merged,
+            'retries': self.retries,
+            'errors': self.errors,
+            }
+
+# -----------------------------------------------------
+# sender of a chat through the outbox: sendMessage is queued,
+# the other methods are called in order and return the Telegram answer
+class ChatSender(object):
+    def __init__(self, outbox, bot, chat_id):
+        self._outbox = outbox
+        self._bot = bot
+        self._chat_id = chat_id
+
+    @asyncio.coroutine
+    def sendMessage(self, text, **kwargs):
+        self._outbox.send_text(self._bot, self._chat_id, text, **kwargs)
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        @asyncio.coroutine
+        def call(*args, **kwargs):
+            return (yield from self._outbox.call(self._bot, method, self._chat_id, *args, **kwargs))
+        return call
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+# siteregistry.py
+# ===============
+# Registry of the sites created by the users, stored in a sqlite database
+# with key (chat_id, name).
+# The .qth files used by rfprobe are written by jobqueue.prepare in the
+# scratch directory of each job.
+#
+# Migration of the old user/<chat_id>/<name>.qth files:
+#   python3 siteregistry.py migrate <bot dir>
+#
+import sys
+import os
+import os.path
+import glob
+import sqlite3
+
+# -----------------------------------------------------
+# Site values.
+# lat: latitude, degrees north
+# lon: longitude, degrees east (the qth file uses degrees west, 0-360)
+# antenna: antenna height, with measurement units (es. '12m')
+class Site(object):
+    def __init__(self, name, info, lat, lon, antenna):
+        self.name = name
+        self.info = info
+        self.lat = lat
+        self.lon = lon
+        self.antenna = antenna
+
+    # antenna height in meters
+    def height(self):
+        return float(self.antenna.rstrip('m'))
+
+    # contents of the qth file
+    def qth(self):
+        if self.lon > 0.0:
+            lon = (360.0-self.lon)
+        else:
+            lon = -self.lon
+        return self.info + '\n' + str(self.lat) + '\n' + str(lon) + '\n' + self.antenna + '\n'
+
+    # row of the list command:
+    # the float values has 6 decimal places
+    def row(self):
+        txt = self.name.ljust(15)    + ' '
+        txt = txt + "{0:.6f}".format(self.lat).rjust(13) + ' '
+        txt = txt + "{0:.6f}".format(self.lon).rjust(13) + ' '
+        txt = txt + self.antenna.rjust(8)
+        return txt
+
+# -----------------------------------------------------
+# read a qth file, return the Site (None if the file is not valid)
+def parse_qth(filename):
+    try:
+        with open(filename, 'r') as f:
+            info = f.readline().rstrip('\n')
+            lat = float(f.readline())
+            lon = float(f.readline())
+            antenna = f.readline().rstrip()
+    except (OSError, ValueError):
+        return None
+    # qth longitude (degrees west, 0-360) to degrees east
+    if (lon >= 0) and (lon < 180):
+        lon = -lon
+    elif (lon >= 180) and (lon <= 360):
+        lon = (360.0-lon)
+    else:
+        lon = 0.0
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return Site(name, info, lat, lon, antenna)
+
+# -----------------------------------------------------
+class SiteRegistry(object):
+    def __init__(self, filename):
+        self.created = not os.path.isfile(filename)
+        self._db = sqlite3.connect(filename)
+        # WAL: the readers are not blocked by the writes,
+        # and a commit does not wait for the disk sync
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sites ('
+            ' chat_id INTEGER NOT NULL,'
+            ' name TEXT NOT NULL,'
+            ' info TEXT NOT NULL,'
+            ' lat REAL NOT NULL,'
+            ' lon REAL NOT NULL,'
+            ' antenna TEXT NOT NULL,'
+            ' PRIMARY KEY (chat_id, name))')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    # ==========================================================
+    # create or replace a site
+    def set(self, chat_id, site):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO sites (chat_id, name, info, lat, lon, antenna)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (chat_id, site.name, site.info, site.lat, site.lon, site.antenna))
+
+    # return the Site, None if not existing
+    def get(self, chat_id, name):
+        row = self._db.execute(
+            'SELECT name, info, lat, lon, antenna FROM sites WHERE chat_id=? AND name=?',
+            (chat_id, name)).fetchone()
+        if row is None:
+            return None
+        return Site(*row)
+
+    # change the antenna height. Return False if the site does not exist
+    def set_antenna(self, chat_id, name, antenna):
+        with self._db:
+            cur = self._db.execute(
+                'UPDATE sites SET antenna=? WHERE chat_id=? AND name=?',
+                (antenna, chat_id, name))
+        return cur.rowcount > 0
+
+    # remove a site. Return False if the site does not exist
+    def delete(self, chat_id, name):
+        with self._db:
+            cur = self._db.execute(
+                'DELETE FROM sites WHERE chat_id=? AND name=?', (chat_id, name))
+        return cur.rowcount > 0
+
+    # return the sites of a user, sorted by name
+    def list(self, chat_id):
+        rows = self._db.execute(
+            'SELECT name, info, lat, lon, antenna FROM sites WHERE chat_id=? ORDER BY name',
+            (chat_id,))
+        return [Site(*row) for row in rows]
+
+    def count(self, chat_id=None):
+        if chat_id is None:
+            return self._db.execute('SELECT COUNT(*) FROM sites').fetchone()[0]
+        return self._db.execute('SELECT COUNT(*) FROM sites WHERE chat_id=?', (chat_id,)).fetchone()[0]
+
+    # ==========================================================
+    # import the old qth files <dirUsers>/<chat_id>/<name>.qth.
+    # The sites already in the registry are replaced.
+    # Return the n. of sites imported
+    def migrate(self, dirUsers):
+        n = 0
+        with self._db:
+            for filename in glob.glob(dirUsers + '/*/*.qth'):
+                chat_id = os.path.basename(os.path.dirname(filename))
+                if not chat_id.lstrip('-').isdigit():
+                    continue
+                site = parse_qth(filename)
+                if site is None:
+                    continue
+                self._db.execute(
+                    'INSERT OR REPLACE INTO sites (chat_id, name, info, lat, lon, antenna)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    (int(chat_id), site.name, site.info, site.lat, site.lon, site.antenna))
+                n = n + 1
+        return n
+
+# -----------------------------------------------------
+# open the registry.
+# The first time (database not existing) the old qth files in dirUsers are imported
+def open_registry(filename, dirUsers):
+    registry = SiteRegistry(filename)
+    if registry.created:
+        n = registry.migrate(dirUsers)
+        print('sites: imported ' + str(n) + ' sites from ' + dirUsers + '/*/*.qth')
+    return registry
+
+# ===========================================================
+# migration tool
+# ===========================================================
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'migrate':
+        print('Use: ' + sys.argv[0] + ' migrate <bot dir>')
+        sys.exit(1)
+    dirBot = sys.argv[2]
+    registry = SiteRegistry(dirBot + '/sites.db')
+    n = registry.migrate(dirBot + '/user')
+    print(str(n) + ' sites imported, ' + str(registry.count()) + ' sites in registry')
+    registry.close()
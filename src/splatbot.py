@@ -33,12 +33,20 @@
 # pgrep splatbot.py
 #
 import sys
+import io
 import asyncio
 import json
+import time
 import math
 import random
-import glob
+import gzip
+import shutil
+import hashlib
+import itertools
+import concurrent.futures
+import concurrent.futures.process
 import telepot
+import telepot.exception
 from telepot.delegate import per_chat_id
 from telepot.async.delegate import create_open
 
@@ -46,39 +54,201 @@ import os
 import os.path
 import traceback
 import contextlib
+import signal
+from asyncio.subprocess import DEVNULL
+
+import jobsched
+import jobqueue
+import rfcache
+import usersettings
+import siteregistry
+import chatstate
+import cmdregistry
+import metrics
+import terrain
+import fresnel
+import linkcheck
+import tracing
+import sendqueue
+import pngopt
+import ocr
+import workspace
+import covmap
+
+# -----------------------------------------------------
+# conversation state of the chats: after a location, the position waits
+# for "<name> <antenna height>" for nStateTTL s.
+# BOTRF_STATE: not set, state in memory; sqlite:<file> or <file>, state
+# shared by more bot processes
+nStateTTL = 600.0
+chatstates = chatstate.open_store(os.environ.get('BOTRF_STATE'), nStateTTL)
+
+# -----------------------------------------------------
+# rfprobe worker pool
+# max n. of rfprobe processes running at the same time.
+# Default is the n. of cpu cores; it can be changed with
+# the environment variable BOTRF_WORKERS
+nRfProbeWorkers = int(os.environ.get('BOTRF_WORKERS', os.cpu_count() or 1))
+# fair-share scheduler of the rfprobe jobs: round-robin between chats,
+# calc jobs served before rep and pow jobs
+scheduler = jobsched.JobScheduler(nRfProbeWorkers)
+# max n. of sites of a mesh analysis (all the links between the sites)
+nMeshMaxSites = 30
+# queue of the jobs for the rfprobe worker daemons (rfworker.py), set by the
+# environment variable BOTRF_QUEUE (es. /srv/botrf/jobs.db).
+# If not set, rfprobe is run by the bot. With the queue, BOTRF_WORKERS
+# is the n. of jobs of the bot in the queue at the same time
+queueSpec = os.environ.get('BOTRF_QUEUE')
+# the queue is used only by the thread of queuepool, that opens its
+# connection: the sqlite calls (BEGIN IMMEDIATE, busy timeout of 30 s)
+# do not block the event loop
+queuepool = concurrent.futures.ThreadPoolExecutor(1) if queueSpec else None
+jobs = queuepool.submit(jobqueue.open_queue, queueSpec).result() if queueSpec else None
+# s, max wait of the result of a job in the queue
+nQueueTimeout = float(os.environ.get('BOTRF_QUEUE_TIMEOUT', 600))
+# each rfprobe job runs in its own scratch directory, created in BOTRF_SCRATCH
+# (default /dev/shm, tmpfs); the outputs are read in memory, then the
+# directory is removed
+dirScratch = jobqueue.scratch_root()
+
+# -----------------------------------------------------
+# cache of the rfprobe outputs
+# max size (MB) set by the environment variable BOTRF_CACHE_MB
+dirBot = os.path.dirname(os.path.abspath(__file__))
+nCacheMBytes = int(os.environ.get('BOTRF_CACHE_MB', 200))
+resultcache = rfcache.ResultCache(dirBot + '/cache', nCacheMBytes * 1024 * 1024)
+# file_id of the images already sent to Telegram, used to send them
+# again without upload
+fileidcache = rfcache.FileIdCache(dirBot + '/fileid.log', 20000)
+
+# -----------------------------------------------------
+# settings of the users (earth, freq, perc), kept in memory
+# and saved in settings.json.
+# At the first start the old user/<id>/*.cfg files are imported
+settings = usersettings.open_store(dirBot + '/settings.json', dirBot + '/user')
+
+# -----------------------------------------------------
+# sites of the users, stored in sites.db.
+# The qth files are written in the scratch directory of each rfprobe
+# job (jobqueue.prepare).
+# At the first start the old user/<id>/*.qth files are imported
+sites = siteregistry.open_registry(dirBot + '/sites.db', dirBot + '/user')
+
+# -----------------------------------------------------
+# engine used by calc, set by the environment variable BOTRF_ENGINE:
+#   rfprobe: (default) rfprobe subprocess
+#   native:  path profile computed in the bot process (needs numpy), on the
+#            memory-mapped terrain tiles of the maps directory.
+#            If the terrain of a path is not available rfprobe is used.
+RfEngine = os.environ.get('BOTRF_ENGINE', 'rfprobe')
+# terrain tiles, used by the native engine and by the quick check of calc and rep
+tiles = None
+if terrain.available():
+    tiles = terrain.TerrainTiles(dirBot + '/maps')
+elif RfEngine == 'native':
+    print('BOTRF_ENGINE=native needs numpy: rfprobe is used')
+
+# -----------------------------------------------------
+# coverage (cov command, see covmap.py): the radials are evaluated by a
+# pool of BOTRF_COV_WORKERS processes (default: n. of cpu cores) with the
+# native engine. Without numpy or terrain each point of the grid is an
+# rfprobe job, at most BOTRF_COV_MAX_JOBS points (default 400)
+nCovWorkers = int(os.environ.get('BOTRF_COV_WORKERS', os.cpu_count() or 1))
+covpool = covmap.make_pool(nCovWorkers)
+nCovMaxJobs = int(os.environ.get('BOTRF_COV_MAX_JOBS', 400))
+nCovMaxRadius = 100.0               # km
+
+# -----------------------------------------------------
+# reports (calc, rep) larger than BOTRF_REPORT_MAX_KB (default 16) are sent
+# as a gzip document instead of text messages
+nReportMaxBytes = int(float(os.environ.get('BOTRF_REPORT_MAX_KB', 16)) * 1024)
+
+# -----------------------------------------------------
+# optimization of the images before the upload (see pngopt.py), run by
+# BOTRF_PNG_WORKERS (default 2) workers of a pool, BOTRF_PNG_POOL:
+# thread (default), process or off. The images larger than BOTRF_PNG_MAX_KB
+# (default 0: no limit) are scaled down. If the optimization fails, the
+# image is sent as it is; a broken process pool is created again
+sPngPool = os.environ.get('BOTRF_PNG_POOL', 'thread')
+nPngWorkers = int(os.environ.get('BOTRF_PNG_WORKERS', 2))
+pngpool = pngopt.make_pool(sPngPool, nPngWorkers)
+nPngMaxBytes = int(float(os.environ.get('BOTRF_PNG_MAX_KB', 0)) * 1024) or None
+
+# new pool of the optimizations, if pool (broken) is still the current one
+def RenewPngPool(pool):
+    global pngpool
+    if pngpool is pool:
+        pngpool = pngopt.make_pool(sPngPool, nPngWorkers)
+        pool.shutdown(wait=False)
+
+# -----------------------------------------------------
+# outbound queue of the messages (see sendqueue.py): the consecutive texts
+# of a chat are merged, the sends are limited to BOTRF_SEND_RATE messages/s
+# (all the chats, default 30) and BOTRF_CHAT_SEND_RATE messages/s for each
+# chat (default 1, bursts of 5). Rate 0: no limit
+outbox = sendqueue.Outbox(float(os.environ.get('BOTRF_SEND_RATE', 30)), 30,
+                          float(os.environ.get('BOTRF_CHAT_SEND_RATE', 1)), 5)
+
+# -----------------------------------------------------
+# OCR of the photos (see ocr.py): BOTRF_OCR_WORKERS processes (default 1),
+# started at the first photo, at most BOTRF_OCR_QUEUE photos (default 4)
+# in progress. BOTRF_OCR=0: the photos are ignored
+ocrpool = None
+if os.environ.get('BOTRF_OCR', '1') != '0':
+    ocrpool = ocr.OcrPool(int(os.environ.get('BOTRF_OCR_WORKERS', 1)), int(os.environ.get('BOTRF_OCR_QUEUE', 4)))
+
+# -----------------------------------------------------
+# collector of the analysis outputs in user/<chat_id>/ (see workspace.py):
+# at most BOTRF_USER_QUOTA_MB for each user (default 50) and BOTRF_DISK_QUOTA_MB
+# for all the users (default 2000, 0: no limit), the least recently written
+# outputs are removed first. A sweep every BOTRF_GC_INTERVAL s (default 300)
+collector = workspace.WorkspaceCollector(dirBot + '/user',
+                                         int(float(os.environ.get('BOTRF_USER_QUOTA_MB', 50)) * 1024 * 1024),
+                                         int(float(os.environ.get('BOTRF_DISK_QUOTA_MB', 2000)) * 1024 * 1024),
+                                         interval=float(os.environ.get('BOTRF_GC_INTERVAL', 300)))
 
 # -----------------------------------------------------
-# global variables
-flag_SetPos = False
+# metrics (Prometheus text format), served on 127.0.0.1 at the port
+# BOTRF_METRICS_PORT (url /metrics) if the variable is set.
+# Messages per second: rate(botrf_messages_total[1m])
+botmetrics = metrics.Registry()
+mMessages = botmetrics.counter('botrf_messages_total', 'messages received', ['type'])
+mCommandTime = botmetrics.histogram('botrf_command_seconds', 'latency of the bot commands', ['command'])
+mCommandErrors = botmetrics.counter('botrf_command_errors_total', 'bot commands ended by an error', ['command'])
+mRfProbeTime = botmetrics.histogram('botrf_rfprobe_seconds', 'wall time of the rfprobe jobs', ['kind'])
+mRfProbeExit = botmetrics.counter('botrf_rfprobe_exit_total', 'rfprobe jobs by exit code', ['kind', 'code'])
+mPhotos = botmetrics.counter('botrf_sendphoto_total', 'images sent, uploaded or by file_id', ['mode'])
+mPhotoBytes = botmetrics.counter('botrf_sendphoto_bytes_total', 'bytes of the images uploaded with sendPhoto')
+mPngSaved = botmetrics.counter('botrf_png_saved_bytes_total', 'bytes saved by the optimization of the images')
+mPngTime = botmetrics.histogram('botrf_png_optimize_seconds', 'time of the optimization of an image')
+mPngErrors = botmetrics.counter('botrf_png_errors_total', 'optimizations failed, images sent as they are')
+mOcrTime = botmetrics.histogram('botrf_ocr_seconds', 'time of the OCR of a photo')
+mHandlers = botmetrics.gauge('botrf_handlers_active', 'SplatBot handler instances')
+botmetrics.gauge_func('botrf_jobs_queued', 'rfprobe jobs waiting in the scheduler', scheduler.queued)
+botmetrics.gauge_func('botrf_jobs_running', 'rfprobe jobs running', lambda: scheduler.running)
+botmetrics.gauge_func('botrf_sched_chats', 'chats with job statistics in the scheduler', lambda: scheduler.nchats)
+botmetrics.gauge_func('botrf_outbox_queued', 'messages waiting in the outbound queue', outbox.queued)
+botmetrics.gauge_func('botrf_workspace_bytes', 'bytes of the analysis outputs at the last sweep', lambda: collector.bytes)
+botmetrics.gauge_func('botrf_workspace_files', 'analysis outputs at the last sweep', lambda: collector.files)
+
+def command_metrics(name, elapsed, error):
+    mCommandTime.observe(elapsed, name)
+    if error:
+        mCommandErrors.inc(name)
+
+# -----------------------------------------------------
+# tracing of the updates (see tracing.py): the updates slower than
+# BOTRF_TRACE_SLOW s (default 5) are written to traces/ as folded stacks.
+# Enabled at start by BOTRF_TRACE=1, or at runtime by the trace command
+# of the admins (BOTRF_ADMINS: chat ids separated by commas)
+tracer = tracing.Tracer(dirBot + '/traces', float(os.environ.get('BOTRF_TRACE_SLOW', 5.0)),
+                        os.environ.get('BOTRF_TRACE', '0') != '0')
+admins = set(int(x) for x in os.environ.get('BOTRF_ADMINS', '').split(',') if x.strip())
 
 # -----------------------------------------------------
-# command list
-lst_cmd = {'keyboard': [[
-    (
-    'getlang'
-    ), 
-    (
-    'setlang it'
-    ),
-    (
-    'setlang eng'
-    ), 
-    (
-    'hidekbd'
-    ),
-    (
-    'site'
-    ),
-    (
-    'earth'
-    ),
-    (
-    'freq'
-    ),
-    (
-    'perc'
-    )
-    ]]}
+# bot commands: the handlers (SplatBot.cmd_<name>) are registered
+# with their aliases (name, abbreviation, /name, /abbreviation)
+registry = cmdregistry.CommandRegistry(on_call=command_metrics)
 
 # -----------------------------------------------------
 # help dictionary
@@ -126,6 +296,18 @@ cmd_dict = {
     "cnv": 
         (
         'dimensional conversion command'
+        ),
+    "queue": 
+        (
+        'state of the analysis queue'
+        ),
+    "mesh": 
+        (
+        'path profile of all the links between the sites of the user'
+        ),
+    "cov": 
+        (
+        'coverage map of a site'
         )
     }
 
@@ -143,6 +325,13 @@ hlp_dict = {
         '\nExample:\n'
         'calc marmolada site2\n'
         '      The output generated is marmolada_site2.png\n'
+        'With more than two sites, calc analyses all the links between them\n'
+        'and ends with a summary table (see the mesh command):\n'
+        'calc marmolada site2 remote2\n'
+        'Before the analysis a quick check rejects the links clearly not\n'
+        'feasible (beyond the radio horizon or blocked by terrain);\n'
+        'with the option -f the full analysis is always done:\n'
+        'calc marmolada site2 -f\n'
         'For calculations, the calc function uses this additional parameter:\n'
         '    - frequency (MHz) for calculations (default: 5800)\n'
         '    - earth radius multiplier (default: 1.3333)\n'
@@ -201,6 +390,8 @@ hlp_dict = {
         'Example:\n'
         'rep marmolada site2\n'
         '      the function generates marmolada_site2.png and the full report.\n'
+        'As calc, the links clearly not feasible are rejected by a quick check;\n'
+        'with the option -f the full analysis is always done.\n'
         ),
     "pow": 
         (
@@ -279,6 +470,41 @@ hlp_dict = {
         'cnv 30 dbm mw\n'
         'result:\n'
         '30 dbm = 1000.0 mw\n'
+        ),
+    "queue":
+        (
+        'queue (q): state of the analysis queue.\n'
+        'Use:\n'
+        'queue\n'
+        'The analyses (calc, rep, pow) are executed in turn between the users:\n'
+        'calc is executed before rep and pow.\n'
+        'The command displays the jobs in queue and running, '
+        'and the average wait and service time of your jobs.\n'
+        ),
+    "mesh":
+        (
+        'mesh (m): path profile of all the links between the sites of the user.\n'
+        'Use:\n'
+        'mesh\n'
+        'The links are analysed in parallel; the graph of each link is sent\n'
+        'as soon as it is ready. At the end a summary table shows for each link:\n'
+        '    - LOS:     pass if the line of sight is clear\n'
+        '    - Fresnel: pass if the Fresnel zone clearance percentage (perc) is clear\n'
+        'To analyse only some sites, use: calc Site1 Site2 Site3 ...\n'
+        ),
+    "cov":
+        (
+        'cov (o): coverage map of a site.\n'
+        'Use:\n'
+        'cov DataSite radius step [antenna]\n'
+        'The path loss from the site is computed on the points of a polar grid:\n'
+        'radials about step km apart, points every step km up to radius km\n'
+        '(max 100 km), receiver antenna height antenna m (default 3 m).\n'
+        'The result is a heatmap DataSite_cov.png; the progress is sent while\n'
+        'the radials are analysed. Without the terrain of the native engine,\n'
+        'each point is analysed by rfprobe and the map shows LOS and Fresnel.\n'
+        '\nExample:\n'
+        'cov marmolada 20 1\n'
         )
     }
 
@@ -303,38 +529,6 @@ def hlp(self, key):
         yield from self.sender.sendMessage(key + '\n')
         yield from self.sender.sendMessage(hlp_dict[key] + '\n')
 
-# -----------------------------------------------------
-# check the command
-def check_cmd(command, full, abbr):
-    full2='/'+full
-    abbr2='/'+abbr
-    if command == full or command == abbr:
-        return True
-    if command == full2 or command == abbr2:
-        return True
-    return False        
-        
-# -----------------------------------------------------
-# create a directory from filename path, if not exist
-def mkdir_p(filename):
-    try:
-        folder=os.path.dirname(filename)  
-        if not os.path.exists(folder):  
-            os.makedirs(folder)
-        return True
-    except:
-        return False        
-        
-# -----------------------------------------------------
-# check if file exist
-def ChkFileExist(filename):
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        # File exists and is readable
-        return True
-    else:
-        # Either file is missing or is not readable
-        return False
-
 # -----------------------------------------------------
 # remove file
 def silentremove(filename):
@@ -342,87 +536,22 @@ def silentremove(filename):
         os.remove(filename)
         
 # -----------------------------------------------------
-# list of files in directory with extension
-def ListOfFiles(dir, filter, flag_basename):
-    # get the full path with file filter
-    fullpath = dir + '/' + filter
-    if flag_basename == True:
-        # get only basename
-        names = [os.path.basename(x) for x in glob.glob(fullpath)]
-    else:
-        names = [x for x in glob.glob(fullpath)]
-    
-    return names
+# result of the obstruction report of rfprobe: (los, fresnel)
+# los:     True if there are no obstructions to the line of sight
+# fresnel: True if the Fresnel zone clearance percentage is clear
+def LinkVerdict(report):
+    los = 'No obstructions to LOS path' in report
+    fresnel = '% of the first Fresnel zone is clear' in report
+    return (los, fresnel)
 
 # -----------------------------------------------------
-def readTextFile(filename):
-    data = ""
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        with open(filename, 'rt') as myfile:
-            data=myfile.read()
-            # data=data.replace('\t', '    ')
-            print(data)
-    return data
-    
-# -----------------------------------------------------
-def getcfgvalue(filename, defval):
-    cfgvalue = defval
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        # cfg file exists and is readable
-        with open(filename, 'r') as f:
-            cfgvalue = f.readline()
-    return cfgvalue
-
-# -----------------------------------------------------
-def setQthFile(dir, id, outQth, info, lat, lon, hAntenna):
-    dirUser = dir + '/user/' + str(id) + '/'
-    lat = float(lat)
-    lon = float(lon)
-    outfile = dirUser + outQth + '.qth'
-    if lon > 0.0:
-        lon = (360.0-lon)
-    else:
-        lon = -lon
+# create the site outQth from the position sent by the user
+# create the site outQth at the last position sent (state: conversation state of the chat)
+def setPos2Qth(id, outQth, info, hAntenna, state):
     # add meter measurement units
     mt_antenna =  hAntenna + 'm'
-    # Write a file
-    out_file = open(outfile, 'wt')
-    print(info, file=out_file)
-    print(str(lat), file=out_file)
-    print(str(lon), file=out_file)
-    print(mt_antenna, file=out_file)
-    out_file.flush()
-    out_file.close()
-         
-# -----------------------------------------------------
-def setPos2Qth(dir, id, outQth, info, hAntenna):
-    # read data
-    dirUser = dir + '/user/' + str(id) + '/'
-    # read earth, earth radius multiplier (float)
-    filename = dirUser + 'location.txt'
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        # cfg file exists and is readable
-        with open(filename, 'r') as f:
-            lat = f.readline()
-            lon = f.readline()
-            f.close()
-        setQthFile(dir, id, outQth, info, lat, lon, hAntenna)
+    sites.set(id, siteregistry.Site(outQth, info, float(state['lat']), float(state['lon']), mt_antenna))
 
-# -----------------------------------------------------
-def setTxRwPowFile(dir, id, outPow, TxPw, TxCl, TxAg, RxAg, RxCl, RxSe):
-    dirUser = dir + '/user/' + str(id) + '/'
-    outfile = dirUser + outPow + '.txt'
-    # Write a file
-    out_file = open(outfile, 'wt')
-    print(str(TxPw), file=out_file)
-    print(str(TxCl), file=out_file)
-    print(str(TxAg), file=out_file) 
-    print(str(RxAg), file=out_file) 
-    print(str(RxCl), file=out_file) 
-    print(str(RxSe), file=out_file)
-    out_file.flush()
-    out_file.close()
-        
 # -----------------------------------------------------
 # return the file name removing path and extension
 def file_name(filename):
@@ -432,185 +561,1117 @@ def file_name(filename):
     return fname
 
 # -----------------------------------------------------
-# return the values stored in qth file
-def DecodeQth(filename):
-    qthpar = str()          # empty string
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        # cfg file exists and is readable
-        with open(filename, 'r') as f:
-            note = f.readline()
-            lat = f.readline()
-            lat = float(lat)
-            lon = f.readline()
-            lon = float(lon)
-            if (lon >= 0) and (lon < 180):
-                lon = -lon
-            elif (lon >= 180) and (lon <= 360):
-                lon = (360.0-lon)
-            else:
-                lon = 0.0
-            ant = f.readline().rstrip()
-            f.close()
-            # filename without path
-            base = os.path.basename(filename)
-            fname = os.path.splitext(base)[0]
-            # create string qthpar
-            # the float values has 6 decimal places
-            qthpar = fname.ljust(15)    + ' '
-            qthpar = qthpar + "{0:.6f}".format(lat).rjust(13) + ' ' 
-            qthpar = qthpar + "{0:.6f}".format(lon).rjust(13) + ' '
-            qthpar = qthpar + ant.rjust(8)
-    # print(qthpar)
-    return qthpar;
+# path profile site1 -> site2 computed by the native engine.
+# params: (earth, freq, perc) of the user settings.
+# return the graph and the reduced report as {'.png': bytes, '_red.txt': bytes},
+# None if the terrain of the path is not available
+def NativeProbe(site1, site2, params):
+    earth, freq, perc = params
+    if not (earth > 0.0 and freq > 0.0):
+        return None
+    try:
+        h1 = site1.height()
+        h2 = site2.height()
+        profile = terrain.path_profile(tiles, site1.lat, site1.lon, site2.lat, site2.lon)
+    except ValueError:
+        # antenna height not a number, terrain not available
+        return None
+    clr = fresnel.Clearance(profile.dist, profile.elev, h1, h2, earth, freq, perc)
+    buf = io.BytesIO()
+    terrain.render_profile(profile, clr, buf, site1.name + ' - ' + site2.name)
+    # reduced report, same shape of the rfprobe report
+    txt = fresnel.report(clr, site1.name, site2.name, profile.lat, profile.lon)
+    return {'.png': buf.getvalue(), '_red.txt': txt.encode('utf-8')}
 
 # -----------------------------------------------------
-# return the values stored in qth file
-def ModifyQthHeight(filename, hAntenna):
-    # add meter measurement units
-    mt_antenna =  hAntenna + 'm'
-    if os.path.isfile(filename) and os.access(filename, os.R_OK):
-        # cfg file exists and is readable
-        with open(filename, 'r') as f:
-            info = f.readline().rstrip()
-            lat = f.readline().rstrip()
-            lon = f.readline().rstrip()
-            f.close()
-            # Write a file
-            out_file = open(filename, 'wt')
-            print(info, file=out_file)
-            print(str(lat), file=out_file)
-            print(str(lon), file=out_file)
-            print(mt_antenna, file=out_file)
-            out_file.flush()
-            out_file.close()
-    
-# -----------------------------------------------------
-def cmdRfProbe(dir, id, txqth, rxqth, outimg):
-    dirUser = dir + '/user/' + str(id) + '/'
-    # read earth, earth radius multiplier (float)
-    filecfg = dirUser + 'earth.cfg'
-    mkdir_p(filecfg)                    # if not exist, create dir that contain file
-    earth = float( getcfgvalue(filecfg, 1.3333) )
-    # read freq, frequency (MHz) for zone calculations (float)
-    filecfg = dirUser + 'freq.cfg'
-    freq = float( getcfgvalue(filecfg, 5800.0) )
-    # read perc, Fresnel zone clearance percentage
-    filecfg = dirUser + 'perc.cfg'
-    perc = float( getcfgvalue(filecfg, 60.0) )
-
-    # path relative to the rfprobe path
-    rp_qthtr_qth='user/' + str(id) + '/' + txqth + '.qth'     # relative path qth transmitter
-    rp_qthrx_qth='user/' + str(id) + '/' + rxqth + '.qth'     # relative path qth receiver
-    rp_out_png='user/' + str(id) + '/' + outimg + '.png'      # relative path output png
-    
-    # set command:
-    # fullpath_rfprobe -t rp_qthtr_qth -r rp_qthrx_qth -m earth -d maps -metric -gpsav -p -e -f $8 -fz $9 -h $rp_out_png
-
-    # fullpath_rfprobe
-    cmd = dir + '/' + 'rfprobe '
-    # -t $rp_qthtr_qth
-    cmd = cmd + '-t ' + rp_qthtr_qth + ' '
-    # -r $rp_qthrx_qth
-    cmd = cmd + '-r ' + rp_qthrx_qth + ' '
-    # -m earth -d maps -metric -gpsav -p -e 
-    cmd = cmd + '-m ' + str(earth) + ' -d maps -metric -gpsav -p -e '
-    # -f freq
-    cmd = cmd + '-f ' + str(freq) + ' '
-    # -fz perc
-    cmd = cmd + '-fz ' + str(perc) + ' '
-    # -h $rp_out_png
-    cmd = cmd + '-H ' + rp_out_png
-    
-    return cmd
-    
-# -----------------------------------------------------
-def cmdRfPower(dir, id, txqth, rxqth, outimg):
-    dirUser = dir + '/user/' + str(id) + '/'
-    # read earth, earth radius multiplier (float)
-    filecfg = dirUser + 'earth.cfg'
-    mkdir_p(filecfg)                    # if not exist, create dir that contain file
-    earth = float( getcfgvalue(filecfg, 1.3333) )
-    # read freq, frequency (MHz) for zone calculations (float)
-    filecfg = dirUser + 'freq.cfg'
-    freq = float( getcfgvalue(filecfg, 5800.0) )
-    # read perc, Fresnel zone clearance percentage
-    filecfg = dirUser + 'perc.cfg'
-    perc = float( getcfgvalue(filecfg, 60.0) )
-
-    # path relative to the rfprobe path
-    rp_qthtr_qth='user/' + str(id) + '/' + txqth + '.qth'     # relative path qth transmitter
-    rp_qthrx_qth='user/' + str(id) + '/' + rxqth + '.qth'     # relative path qth receiver
-    # rp_out ='user/' + str(id) + '/' + outimg + '.png'           # relative path output
-    rp_out ='user/' + str(id) + '/' + outimg + '.txt'         # relative path output
-    
-    # set command:
-    # fullpath_rfprobe -t rp_qthtr_qth -r rp_qthrx_qth -m earth -d maps -metric -gpsav -p -e -f $8 -fz $9 -h $rp_out_png
-
-    # fullpath_rfprobe
-    cmd = dir + '/' + 'rfprobe '
-    # -t $rp_qthtr_qth
-    cmd = cmd + '-t ' + rp_qthtr_qth + ' '
-    # -r $rp_qthrx_qth
-    cmd = cmd + '-r ' + rp_qthrx_qth + ' '
-    # -m earth -d maps -metric -gpsav -p -e 
-    cmd = cmd + '-m ' + str(earth) + ' -d maps -metric -gpsav -p -e '
-    # -f freq
-    cmd = cmd + '-f ' + str(freq) + ' '
-    # -fz perc
-    cmd = cmd + '-fz ' + str(perc) + ' '
-    # -h $rp_out_png
-    cmd = cmd + '-pw ' + rp_out
-    
-    return cmd
-    
+# run rfprobe as asyncio subprocess, in a scratch directory of the job:
+# the inputs are written there (jobqueue.prepare), the outputs are read
+# in memory and the directory is removed.
+# The event loop is not blocked, so the other chats are served.
+# The function must be executed through the scheduler, that limits
+# the n. of rfprobe processes running at the same time to nRfProbeWorkers.
+# return (rfprobe exit code, artifacts {suffix: bytes})
+@asyncio.coroutine
+def runRfProbe(dir, job):
+    dirJob = jobqueue.scratch_dir(dirScratch)
+    try:
+        with tracer.span('file:prepare'):
+            cmd = jobqueue.prepare(dir, dirJob, job)
+        # maps is relative to the rfprobe path
+        with tracer.span('subprocess:rfprobe'):
+            proc = yield from asyncio.create_subprocess_exec(*cmd, cwd=dir, stdin=DEVNULL)
+            try:
+                retcode = yield from proc.wait()
+            except asyncio.CancelledError:
+                # handler closed (chat timeout, shutdown): rfprobe is stopped
+                # before its directory is removed and its worker is freed
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
+                yield from proc.wait()
+                raise
+        with tracer.span('file:collect'):
+            artifacts = jobqueue.collect(dirJob, job)
+    finally:
+        shutil.rmtree(dirJob, ignore_errors=True)
+    return retcode, artifacts
+
 # -----------------------------------------------------
+# run a job (jobqueue.make_job) through the job queue: it is executed by
+# a worker daemon. As runRfProbe, it must be executed through the scheduler.
+# return (rfprobe exit code, artifacts), (-1, {}) if there is no result within nQueueTimeout s
+@asyncio.coroutine
+def runRemote(dir, job):
+    loop = asyncio.get_event_loop()
+    job_id = yield from loop.run_in_executor(queuepool, jobs.put, job)
+    tend = time.time() + nQueueTimeout
+    poll = 0.05
+    try:
+        with tracer.span('queue:wait'):
+            while True:
+                result = yield from loop.run_in_executor(queuepool, jobs.result, job_id)
+                if result is not None:
+                    break
+                if time.time() > tend:
+                    return -1, {}
+                yield from asyncio.sleep(poll)
+                poll = min(2 * poll, 1.0)
+    finally:
+        # result received, timeout or handler closed: deleted in background
+        queuepool.submit(jobs.delete, job_id)
+    return result
 
-try:
-    import Image
-except ImportError:
-    from PIL import Image
-import pytesseract
+# -----------------------------------------------------
 
 class SplatBot(telepot.helper.ChatHandler):
     # ==========================================================
     def __init__(self, seed_tuple, timeout):
         super(SplatBot, self).__init__(seed_tuple, timeout)
         self._lang = 'eng'
+        self._outsender = outbox.sender(self.bot, self.chat_id)
+        mHandlers.inc()
+
+    # handler closed (timeout without messages or error)
+    def on_close(self, exception):
+        mHandlers.dec()
+        super(SplatBot, self).on_close(exception)
+
+    # sender of the chat, through the outbound queue;
+    # when tracing, each Telegram API call is a span
+    @property
+    def sender(self):
+        if tracer.enabled:
+            return tracing.TracedSender(self._outsender, tracer)
+        return self._outsender
 
     # ==========================================================
     # aux functions
     #
-    # private function to set config data
-    def set_cfg(self, dir, id, cfgvar, strvalue):
-        fileName = cfgvar
-        cfgFile = dir + '/user/' + str(id) + '/' + fileName + '.cfg'
-        mkdir_p(cfgFile)                    # if not exist, create dir that contain file
-        yield from self.sender.sendMessage(cfgFile)
-        # yield from self.sender.sendMessage('sono qui')
+    # run the rfprobe job (jobqueue.make_job) through the job scheduler,
+    # in the bot or, with BOTRF_QUEUE, by a worker daemon.
+    # If the job must wait, the user is informed of the position in queue.
+    # If the result of the analysis (cache key: cachekey) is in cache,
+    # the outputs are taken from the cache without running rfprobe.
+    # If quiet is True, the position in queue is not sent.
+    # return the outputs {suffix: bytes}, without the missing ones
+    @asyncio.coroutine
+    def run_job(self, dir, chat_id, job, cachekey, quiet=False):
+        kind = job['kind']
+        cachekind = 'pow' if kind == 'pow' else 'probe'
+        with tracer.span('file:cache_get'):
+            artifacts = resultcache.get(cachekey, cachekind)
+        if artifacts is not None:
+            return artifacts
+        corofunc = runRemote if jobs is not None else runRfProbe
+        @asyncio.coroutine
+        def notify(pos):
+            yield from self.sender.sendMessage('Analysis queued. Jobs before yours: ' + str(pos))
+        @asyncio.coroutine
+        def timed():
+            t = time.perf_counter()
+            result = yield from corofunc(dir, job)
+            mRfProbeTime.observe(time.perf_counter() - t, kind)
+            mRfProbeExit.inc(kind, result[0])
+            return result
+        retcode, artifacts = yield from scheduler.run(chat_id, kind, timed, notify=None if quiet else notify)
+        if retcode == 0:
+            with tracer.span('file:cache_put'):
+                resultcache.put(cachekey, cachekind, artifacts)
+        return artifacts
+
+    # path profile of the link site1 -> site2 (kind: calc, rep).
+    # return the outputs {suffix: bytes} ('.png', '_red.txt' ...)
+    @asyncio.coroutine
+    def probe_link(self, dir, chat_id, kind, site1, site2, quiet=False):
+        outfile = site1.name + '_' + site2.name
+        params = settings.params(chat_id)
+        if RfEngine == 'native' and tiles is not None and kind == 'calc':
+            # native engine, executed by a thread
+            loop = asyncio.get_event_loop()
+            with tracer.span('thread:native'):
+                artifacts = yield from loop.run_in_executor(None, NativeProbe, site1, site2, params)
+            if artifacts is not None:
+                return artifacts
+        # original cmdspl=cmdRfProbe(dirname, chat_id, commands[2], commands[1], outfile)
+        # mr 07: inverted graph in rfprobe tool
+        job = jobqueue.make_job(chat_id, kind, site1, site2, params, outfile)
+        # the key of the result cache depends on sites and parameters
+        cachekey = rfcache.key('probe', [site1.qth(), site2.qth()], params)
+        artifacts = yield from self.run_job(dir, chat_id, job, cachekey, quiet)
+        return artifacts
+
+    # quick line of sight check of the link site1 -> site2, before the full analysis.
+    # If the link is clearly not feasible the verdict is sent and True is returned
+    @asyncio.coroutine
+    def quick_check(self, chat_id, site1, site2):
+        earth = settings.get(chat_id, 'earth')
+        # the coarse terrain samples may need to load a tile: executed by a thread
+        loop = asyncio.get_event_loop()
+        with tracer.span('thread:precheck'):
+            verdict = yield from loop.run_in_executor(None, linkcheck.precheck, tiles, site1, site2, earth)
+        if verdict is None:
+            return False
+        yield from self.sender.sendMessage(verdict)
+        return True
+
+    # path profile of all the links between the sites in the list.
+    # The links are analysed in parallel by the rfprobe workers;
+    # the graph of each link is sent as soon as it is ready,
+    # at the end a summary table of the results is sent
+    @asyncio.coroutine
+    def mesh(self, dir, chat_id, lstSites):
+        links = list(itertools.combinations(lstSites, 2))
+        yield from self.sender.sendMessage('Analysis of ' + str(len(links)) + ' links between ' + str(len(lstSites)) + ' sites')
+
+        # artifacts None: the analysis of the link failed, the other
+        # links go on
+        @asyncio.coroutine
+        def link(site1, site2):
+            try:
+                artifacts = yield from self.probe_link(dir, chat_id, 'calc', site1, site2, quiet=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                artifacts = None
+            return (site1, site2, artifacts)
+
+        results = {}
+        tasks = [tracer.ensure_future(link(site1, site2)) for site1, site2 in links]
+        try:
+            for task in asyncio.as_completed(tasks):
+                site1, site2, artifacts = yield from task
+                caption = site1.name + ' - ' + site2.name + ': '
+                if artifacts is None:
+                    results[(site1.name, site2.name)] = (False, False)
+                    yield from self.sender.sendMessage(caption + '(no result)')
+                    continue
+                los, fresnel = LinkVerdict(artifacts.get('_red.txt', b'').decode('utf-8', 'replace'))
+                results[(site1.name, site2.name)] = (los, fresnel)
+                caption = caption + 'LOS ' + ('pass' if los else 'FAIL')
+                caption = caption + ', Fresnel ' + ('pass' if fresnel else 'FAIL')
+                if '.png' in artifacts:
+                    yield from self.send_photo(chat_id, site1.name + '_' + site2.name + '.png', artifacts['.png'], caption)
+                else:
+                    yield from self.sender.sendMessage(caption + ' (no graph)')
+        finally:
+            # mesh stopped (handler cancelled, send failed): the links
+            # still running are cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        # summary table, in the order of the links
+        perc = settings.get(chat_id, 'perc')
+        txt = 'Summary (Fresnel zone clearance ' + "{0:.0f}".format(perc) + '%):\n'
+        txt = txt + 'Site1'.ljust(15) + ' ' + 'Site2'.ljust(15) + '  LOS   Fresnel\n'
+        nPass = 0
+        for site1, site2 in links:
+            los, fresnel = results[(site1.name, site2.name)]
+            if los and fresnel:
+                nPass = nPass + 1
+            txt = txt + site1.name.ljust(15) + ' ' + site2.name.ljust(15) + '  '
+            txt = txt + ('pass' if los else 'FAIL') + '  ' + ('pass' if fresnel else 'FAIL') + '\n'
+            if (len(txt)>2048):
+                yield from self.sender.sendMessage(txt)
+                txt = ''
+        txt = txt + str(nPass) + '/' + str(len(links)) + ' links pass\n'
+        yield from self.sender.sendMessage(txt)
+
+    # send the progress of the coverage when done + n of total crosses
+    # a quarter; return the new done
+    @asyncio.coroutine
+    def coverage_progress(self, done, n, total, unit):
+        before = 4 * done // total
+        done = done + n
+        if done < total and 4 * done // total > before:
+            yield from self.sender.sendMessage('Coverage: ' + str(done) + '/' + str(total) + ' ' + unit)
+        return done
+
+    # coverage with the native engine: the radials are evaluated in chunks
+    # by the processes of covpool. return the losses (dB) of each radial
+    @asyncio.coroutine
+    def coverage_native(self, site, bearings, distances, hrx, params):
+        earth, freq, perc = params
+        loop = asyncio.get_event_loop()
+
+        @asyncio.coroutine
+        def chunk(idx):
+            rows = yield from loop.run_in_executor(covpool, covmap.evaluate, dirBot + '/maps',
+                site.lat, site.lon, site.height(), [bearings[i] for i in idx], distances, hrx, earth, freq)
+            return idx, rows
+
+        values = [None] * len(bearings)
+        done = 0
+        with tracer.span('pool:coverage'):
+            for task in asyncio.as_completed([chunk(idx) for idx in covmap.chunks(len(bearings), nCovWorkers)]):
+                idx, rows = yield from task
+                for i, row in zip(idx, rows):
+                    values[i] = row
+                done = yield from self.coverage_progress(done, len(idx), len(bearings), 'radials')
+        return values
+
+    # coverage with rfprobe: each point of the grid is a calc job, run in
+    # parallel by the rfprobe workers. return the verdict of each point
+    # (0 obstructed, 1 LOS, 2 LOS and Fresnel, None no result) for each radial
+    @asyncio.coroutine
+    def coverage_rfprobe(self, dir, chat_id, site, bearings, distances, hAntenna, params):
+        @asyncio.coroutine
+        def point(i, k):
+            lat, lon = covmap.destination(site.lat, site.lon, bearings[i], distances[k])
+            remote = siteregistry.Site('cov' + str(i) + '_' + str(k), 'coverage', lat, lon, hAntenna + 'm')
+            job = jobqueue.make_job(chat_id, 'calc', site, remote, params, site.name + '_' + remote.name)
+            cachekey = rfcache.key('probe', [site.qth(), remote.qth()], params)
+            artifacts = yield from self.run_job(dir, chat_id, job, cachekey, quiet=True)
+            if '_red.txt' not in artifacts:
+                return i, k, None
+            los, fresnel = LinkVerdict(artifacts['_red.txt'].decode('utf-8', 'replace'))
+            return i, k, (2 if los and fresnel else 1 if los else 0)
+
+        values = [[None] * len(distances) for b in bearings]
+        tasks = [tracer.ensure_future(point(i, k)) for i in range(len(bearings)) for k in range(len(distances))]
+        done = 0
+        for task in asyncio.as_completed(tasks):
+            i, k, x = yield from task
+            values[i][k] = x
+            done = yield from self.coverage_progress(done, 1, len(tasks), 'points')
+        return values
+
+    # send the image data (bytes), uploaded with the file name name.
+    # If the same image was already sent, it is sent again through
+    # its Telegram file_id, without upload
+    @asyncio.coroutine
+    def send_photo(self, chat_id, name, data, caption=None):
+        h = hashlib.sha1(data).hexdigest()
+        file_id = fileidcache.get(h)
+        if file_id is not None:
+            try:
+                yield from self.sender.sendPhoto(file_id, caption=caption)
+                mPhotos.inc('file_id')
+                return
+            except telepot.exception.TelegramError:
+                # file_id not valid any more: upload the image
+                fileidcache.remove(h)
+        if pngpool is not None:
+            # the cache key is the hash of the original image
+            loop = asyncio.get_event_loop()
+            pool = pngpool
+            t = time.perf_counter()
+            try:
+                with tracer.span('pool:pngopt'):
+                    optimized = yield from loop.run_in_executor(pool, pngopt.optimize, data, nPngMaxBytes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # image not readable by PIL, worker process killed ...:
+                # the image is sent as it is
+                traceback.print_exc()
+                mPngErrors.inc()
+                if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                    RenewPngPool(pool)
+                optimized = data
+            else:
+                mPngTime.observe(time.perf_counter() - t)
+                mPngSaved.inc(value=len(data) - len(optimized))
+            data = optimized
+        reply = yield from self.sender.sendPhoto((name, io.BytesIO(data)), caption=caption)
+        mPhotos.inc('upload')
+        mPhotoBytes.inc(value=len(data))
+        # the last photo size is the original image
+        fileidcache.put(h, reply['photo'][-1]['file_id'])
+
+    # send a report (data: bytes, None if missing): the lines are packed
+    # in messages of at most 4096 characters, ended at the end of a line.
+    # A report larger than nReportMaxBytes is sent as <name>.gz document
+    @asyncio.coroutine
+    def send_report(self, chat_id, name, data):
+        if data is None:
+            return
+        if len(data) > nReportMaxBytes:
+            loop = asyncio.get_event_loop()
+            with tracer.span('thread:gzip'):
+                gz = yield from loop.run_in_executor(None, gzip.compress, data)
+            caption = 'Report ' + "{0:.0f}".format(len(data) / 1024.0) + ' KB (gzip)'
+            yield from self.sender.sendDocument((name + '.gz', io.BytesIO(gz)), caption=caption)
+            return
+        for piece in sendqueue.pack_lines(io.StringIO(data.decode('utf-8', 'replace'))):
+            yield from self.sender.sendMessage(piece)
+
+    # ==========================================================
+    # commands
+    # ==========================================================
+    # hlp (h): list of the commands, with their help
+    @registry.command('hlp', 'h')
+    @asyncio.coroutine
+    def cmd_hlp(self, chat_id, commands, dirname):
+        yield from self.sender.sendMessage('This bot is an opensource tool for the electromagnetic spectrum analysis of Terrain, loss, and RF Signal Propagation.')
+        yield from self.sender.sendMessage('List of bot commands (sorted alphabetically):')
+        # help command
+        s = sorted(hlp_dict.keys())
+        # for key in iter(hlp_dict.keys()):
+        hlp = ''
+        for key in iter(s):
+            hlp = hlp + key + '\n'
+            hlp = hlp + hlp_dict[key] + '\n'
+            if (len(hlp)>2048):
+                yield from self.sender.sendMessage(hlp)
+                hlp = ''
+           # yield from self.sender.sendMessage(key + '\n')
+           # yield from self.sender.sendMessage(hlp_dict[key] + '\n')
+        # yield from self.sender.sendMessage('----------------\n')
+        hlp = hlp + '\n'
+        yield from self.sender.sendMessage(hlp + '\n')
+        # for key in hlp_dict:
+        #     print(key + '\n\n')
+        #     print(hlp_dict[key] + '\n\n')
+        #     yield from self.sender.sendMessage(key + '\n')
+        #     yield from self.sender.sendMessage(hlp_dict[key] + '\n')
+
+    # site (s): Site values
+    @registry.command('site', 's')
+    @asyncio.coroutine
+    def cmd_site(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # modify 27/07:
+        # if the user don't insert antenna height, use a default of 30m
+        # n. full parameters. 5
+        # site name lat lon height
+        # original if nCmdFields < 5:
+        # modify 27/07
+        if nCmdFields < 4:
+            yield from self.sender.sendMessage(hlp_dict['site'] + '\n')
+            return;
+
+        # generate site data
+
+        # latitude
+        lat = us_decimal_sep(commands[2]);
+        if is_number(lat) == False:
+            msg = 'Invalid latitude value: ' + str(lat) + '.\nLatitude must be within -90 and +90 degrees'
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+
+        lat = float(lat)
+        if (lat<-90.0) or (lat>90.0):
+            msg = 'Invalid latitude value: ' + str(lat) + '.\nLatitude must be within -90 and +90 degrees'
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+
+        # longitude
+        lon = us_decimal_sep(commands[3]);
+        if is_number(lon) == False:
+            msg = 'Invalid longitude value: ' + str(lon) + '.\nLongitude must be within -180 and +180 degrees'
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+
+        lon = float(lon)
+        if (lon<-180.0) or (lon>180.0):
+            msg = 'Invalid longitude value: ' + str(lon) + '.\nLongitude must be within -180 and +180 degrees'
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+
+        # antenna height
+        # modify 27/07
+        if nCmdFields >= 5:
+            # use user antenna value
+            hAntenna = us_decimal_sep(commands[4]);
+        else:
+            # use antenna default
+            hAntenna = '3'
+
+        if is_number(hAntenna) == False:
+            msg = 'the antenna height is not correct: ' + hAntenna
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+        value = float(hAntenna)
+        if (value<0.0) or (value>300.0):
+            msg = 'Invalid antenna height: ' + str(value) + '.\nHeight must be greater than 0 and  should be less than 300m'
+            print(msg)
+            yield from self.sender.sendMessage( msg )
+            return;
+
+        # add meter measurement units
+        hAntenna =  hAntenna + 'm'
+        # set site info (first row of qth file).
+        # If there are no other parameters, the info is the site name
+        # yield from self.sender.sendMessage(str(nCmdFields))
+
+        msg = ''
+        if nCmdFields >= 6:
+            msg = commands[5]
+            for num in range(6,nCmdFields):
+                msg = msg + ' ' + commands[num]
+        else:
+            msg = commands[1]
+
+        # save the site
+        sites.set(chat_id, siteregistry.Site(commands[1], msg, lat, lon, hAntenna))
+
+        yield from self.sender.sendMessage(cmd_dict['site'] + ' ' +commands[1] + ' created')
+
+    # list (l): displays the sites created by the user
+    @registry.command('list', 'l')
+    @asyncio.coroutine
+    def cmd_list(self, chat_id, commands, dirname):
+        # sites of the user, from the registry
+        strContents=''
+        for x in sites.list(chat_id):
+            strContents = strContents + x.row() + '\n'
+            if (len(strContents)>2048):
+                yield from self.sender.sendMessage(strContents)
+                strContents = ''
+        yield from self.sender.sendMessage(strContents)
+
+    # del (d): delete a site created by the user
+    @registry.command('del', 'd')
+    @asyncio.coroutine
+    def cmd_del(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        if nCmdFields < 2:
+            yield from self.sender.sendMessage(hlp_dict['del'] + '\n')
+            return;
+        sites.delete(chat_id, commands[1])
+        # remove the qth file written for rfprobe
+        filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
+        silentremove(filename)
+        yield from self.sender.sendMessage('Data file ' + commands[1] + ' removed')
+
+    # ant (a): Change antenna height of an existing site
+    @registry.command('ant', 'a')
+    @asyncio.coroutine
+    def cmd_ant(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        if nCmdFields < 3:
+            yield from self.sender.sendMessage(hlp_dict['ant'] + '\n')
+            return;
+        hAntenna = us_decimal_sep(commands[2])
+        if is_number(hAntenna) == False:
+            yield from self.sender.sendMessage('the antenna height is not correct: ' + hAntenna)
+            return;
+        value = float(hAntenna)
+        if not (0.0 <= value <= 300.0):
+            msg = 'Invalid antenna height: ' + str(value) + '.\nHeight must be greater than 0 and  should be less than 300m'
+            yield from self.sender.sendMessage(msg)
+            return;
+        if not sites.set_antenna(chat_id, commands[1], hAntenna + 'm'):
+            yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
+            return;
+        yield from self.sender.sendMessage('In file ' + commands[1] + ' antenna height is ' + hAntenna + 'm')
+
+    # earth (k): earth radius multiplier
+    @registry.command('earth', 'k')
+    @asyncio.coroutine
+    def cmd_earth(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # Ermanno request: 'e' to 'k'
+        # if commands[0] == '/earth' or commands[0] == 'earth':
+        if nCmdFields < 2:
+            yield from self.sender.sendMessage(hlp_dict['earth'] + '\n')
+            return;
+
+        # earth radius multiplier (float, greater than 0)
         # get value
-        value = (strvalue);
+        value = us_decimal_sep(commands[1])
+        if is_number(value) == False or not (0.0 < float(value) < math.inf):
+            yield from self.sender.sendMessage('Invalid ' + cmd_dict['earth'] + ': ' + value + '.\nThe value must be greater than 0')
+            return;
         value = float(value)
-        # Write the cfg file
-        out_file = open(cfgFile, 'wt')
-        print(str(value), file=out_file)
-        out_file.flush()
-        out_file.close()
-        
+        settings.set(chat_id, 'earth', value)
+
+        yield from self.sender.sendMessage('Value of ' + cmd_dict['earth'] + ' set to ' + str(value) )
+
+    # freq (f): frequency (MHz) for calculations
+    @registry.command('freq', 'f')
+    @asyncio.coroutine
+    def cmd_freq(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        if nCmdFields < 2:
+            yield from self.sender.sendMessage(hlp_dict['freq'] + '\n')
+            return;
+
+        # frequency (MHz) for zone calculations (float, greater than 0)
+        # get value
+        value = us_decimal_sep(commands[1])
+        if is_number(value) == False or not (0.0 < float(value) < math.inf):
+            yield from self.sender.sendMessage('Invalid ' + cmd_dict['freq'] + ': ' + value + '.\nThe value must be greater than 0')
+            return;
+        value = float(value)
+        settings.set(chat_id, 'freq', value)
+
+        yield from self.sender.sendMessage('Value of ' + cmd_dict['freq'] + ' set to ' + str(value) )
+
+    # perc (p): Fresnel zone clearance percentage
+    @registry.command('perc', 'p')
+    @asyncio.coroutine
+    def cmd_perc(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        if nCmdFields < 2:
+            yield from self.sender.sendMessage(hlp_dict['perc'] + '\n')
+            return;
+
+        # Fresnel zone clearance percentage
+        # get value
+        value = (commands[1]);
+        value = float(value)
+        settings.set(chat_id, 'perc', value)
+
+        yield from self.sender.sendMessage('Value of ' + cmd_dict['perc'] + ' set to ' + str(value) )
+
+    # calc (c): path profile between Site1 and Site2 with obstruction report
+    @registry.command('calc', 'c')
+    @asyncio.coroutine
+    def cmd_calc(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # -f: full analysis also if the quick check fails
+        force = '-f' in commands
+        if force:
+            commands.remove('-f')
+            nCmdFields = len(commands)
+        # check if the two files .spl was defined
+        if nCmdFields < 3:
+            yield from self.sender.sendMessage(hlp_dict['calc'] + '\n')
+            return;
+
+        if nCmdFields > 3:
+            # more than two sites: analysis of all the links
+            lstSites = []
+            for name in commands[1:]:
+                site = sites.get(chat_id, name)
+                if site is None:
+                    yield from self.sender.sendMessage('Parameter error: file ' + name + ' does not exist !!!')
+                    return;
+                if site.name not in [x.name for x in lstSites]:
+                    lstSites.append(site)
+            if len(lstSites) > nMeshMaxSites:
+                yield from self.sender.sendMessage('Error: max ' + str(nMeshMaxSites) + ' sites can be analysed together !!!')
+                return;
+            yield from self.mesh(dirname, chat_id, lstSites)
+            return;
+
+        site1 = sites.get(chat_id, commands[1])
+        if site1 is None:
+            yield from self.sender.sendMessage('Parameter error: file ' + commands[1] + ' does not exist !!!')
+            return;
+        site2 = sites.get(chat_id, commands[2])
+        if site2 is None:
+            yield from self.sender.sendMessage('Parameter error: file ' + commands[2] + ' does not exist !!!')
+            return;
+        if not force:
+            hopeless = yield from self.quick_check(chat_id, site1, site2)
+            if hopeless:
+                return;
+        #
+        outfile=commands[1] + '_' + commands[2]
+        artifacts = yield from self.probe_link(dirname, chat_id, 'calc', site1, site2)
+        if '.png' not in artifacts:
+            yield from self.sender.sendMessage('Error: the analysis of ' + outfile + ' failed')
+            return;
+
+        # show image
+        yield from self.send_photo(chat_id, outfile + '.png', artifacts['.png'])
+        yield from self.sender.sendMessage("Results")
+
+        # show the reduced report
+        yield from self.send_report(chat_id, outfile + '_red.txt', artifacts.get('_red.txt'))
+
+    # cnv (v): dimensional conversion command
+    @registry.command('cnv', 'v')
+    @asyncio.coroutine
+    def cmd_cnv(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # conversion command
+        if nCmdFields < 4:
+            yield from self.sender.sendMessage(hlp_dict['cnv'] + '\n')
+            return;
+        # check the units
+        listUnit=['deg', 'dms', 'mw', 'pwrr', 'db', 'dbd', 'dbi', 'dbm', 'khz', 'mhz', 'ghz', 'm' , 'mm', 'cm', 'uv']
+        srcUnit = (commands[2])
+        if (srcUnit in listUnit) == False:
+            msg = 'The unit ' + srcUnit + ' is not correct.\n'
+            msg = msg + hlp_dict['cnv'] + '\n'
+            yield from self.sender.sendMessage( msg )
+            return;
+        dstUnit = (commands[3])
+        if (dstUnit in listUnit) == False:
+            msg = 'The unit ' + dstUnit + ' is not correct.\n'
+            msg = msg + hlp_dict['cnv'] + '\n'
+            yield from self.sender.sendMessage( msg )
+            return;
+        cmd = srcUnit + dstUnit
+
+        nDigits = 2         # n. digits after comma
+        # check if the value is numeric
+        if cmd != 'dmsdeg':
+            # the conversion is different from degrees,first,seconds and degrees unit
+            # check input value
+            strVal = us_decimal_sep(commands[1]);
+            if is_number(strVal) == False:
+                msg = 'The value to convert is not correct: ' + strVal + '.\n'
+                msg = msg + hlp_dict['cnv'] + '\n'
+                yield from self.sender.sendMessage( msg )
+                return;
+            value = float(strVal)
+        else:
+            strVal = commands[1];
+
+        SpeedLight=299792458        # m/s
+        errType = -1
+        # degrees first seconds <-> degrees
+        if (cmd=='dmsdeg'):
+            # degrees first seconds --> degrees
+            nDigits = 5         # n. digits after comma result
+            # Separate on ':'.
+            strDfs = strVal.split(":")
+            result=0.0
+            numStr=0
+            # Loop for each element.
+            sign=1
+            for elementDfs in strDfs:
+                if (numStr==0):
+                    # degrees
+                    result=float(elementDfs)
+                    if (result<0.0):
+                        result = -result
+                        sign = -1
+                    numStr = numStr + 1
+                elif (numStr==1):
+                    # first
+                    value=float(elementDfs)
+                    value=value / 60.0
+                    result=result + value
+                    numStr = numStr + 1
+                elif (numStr==2):
+                    # seconds
+                    direction = elementDfs[-1].lower()      # get last char in lower case
+                    if (direction!='s') and (direction!='w') and (direction!='n') and (direction!='e'):
+                        seconds = elementDfs
+                        # msg = 'The direction of coordinate ' + strVal + ' is not correct.\n'
+                        # msg = msg + 'Correct directions are: N, S, E, W\n'
+                        # yield from self.sender.sendMessage( msg )
+                        # return;
+                    else:
+                        seconds = elementDfs[:-1]           # get string without last char
+                    value = float(seconds)
+                    value = value / 3600.0
+                    result = result + value
+                    result = sign * result
+                    if (direction=='s') or (direction=='w'):
+                        result = -result
+                    numStr = numStr + 1
+        elif (cmd=='degdms'):
+            # degrees --> degrees first seconds
+            if (value < 0.0):
+                sign = '-'
+                value = -value
+            else:
+                sign = '+'
+            # divide number in degrees and dec part
+            decimal, intVal = math.modf(value)
+            degrees = int(intVal)
+            value = decimal * 60.0
+            # divide number in first and dec part
+            decimal, intVal = math.modf(value)
+            first = int(intVal)
+            seconds = decimal * 60.0
+            strResult = sign + format(degrees, '02d') + ' ' + format(first, '02d') + '\' ' + str(seconds) + '"'
+        # milliwatt <-> dbm
+        elif (cmd=='mwdbm'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  10.0 * math.log10(value)
+        elif (cmd=='dbmmw'):
+            result =  math.pow(10.0, (value/10.0))
+        # wavelen <-> freq
+        elif (cmd=='mkhz') :
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight * 1.0e-3)/(value)
+        elif (cmd=='mmhz') :
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight * 1.0e-6)/(value)
+        elif (cmd=='mmkhz'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight * 1)/(value)
+        elif (cmd=='cmghz'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight * 1.0e-7)/(value)
+        elif (cmd=='mmmhz'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight * 1.0e-3)/(value)
+        elif (cmd=='khzm') :
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight)/(1.0e3 * value)
+        elif (cmd=='mhzm') :
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight)/(1.0e6 * value)
+        elif (cmd=='khzmm'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight)/(1 * value)
+        elif (cmd=='mhzmm'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight)/(1.0e-3 * value)
+        elif (cmd=='ghzcm') :
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  (SpeedLight)/(1.0e-7 * value)
+        # dbd <-> dbi
+        elif (cmd=='dbidbd'):
+            result = value - 2.15
+        elif (cmd=='dbddbi'):
+            result = value + 2.15
+        # pwrr <-> db
+        elif (cmd=='pwrrdb'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  10.0 * math.log10(value)
+        elif (cmd=='dbpwrr'):
+            result =  math.pow(10.0, (value/10.0))
+        # uv <-> dBm for 50Ohm impedance
+        elif (cmd=='uvdbm'):
+            if (value <= 0.0):
+                errType = 0         # value <= 0
+            else:
+                result =  10.0 * math.log10(value * value * 1.0e-9 / 50)
+        # microvolt <-> milliwatt for 50Ohm impedance
+        elif (cmd=='uvmw') :
+            result =  (value * value * 1.0e-9 / 50)
+        else:
+            errType = 1
+            result = 'the conversion between units can not be performed'
+
+        # print results
+        if (cmd=='degdms'):
+            # for deg -> dms conversion
+            msg = strVal + ' ' + srcUnit + ' = ' + strResult + ' ' + dstUnit
+
+        else:
+            # for all other conversions
+            if (errType<0):
+                # result = round(result, nDigits)
+                if(cmd=='dmsdeg'):
+                    result = round(result, 6)
+                    strResult = str(result)
+                else:
+                    chk = math.fabs(result)
+                    if (chk>0.1):
+                        result = round(result, 2)
+                        strResult = str(result)
+                    else:
+                        # use scientific notation
+                        strResult = "{0:.2e}".format(result)
+                msg = strVal + ' ' + srcUnit + ' = ' + strResult + ' ' + dstUnit
+            elif (errType==0):
+                msg = 'The value ' + str(value) + ' ' + 'is lower or below 0 and cannot be converted'
+            else:
+                msg = 'the conversion between ' + srcUnit + ' and ' + dstUnit + ' units can not be performed'
+
+        yield from self.sender.sendMessage(msg)
+
+    # mesh (m): path profile of all the links between the sites of the user
+    @registry.command('mesh', 'm')
+    @asyncio.coroutine
+    def cmd_mesh(self, chat_id, commands, dirname):
+        # analysis of all the links between the sites of the user
+        lstSites = sites.list(chat_id)
+        if len(lstSites) < 2:
+            yield from self.sender.sendMessage('Error: the mesh analysis needs at least two sites !!!')
+            return;
+        if len(lstSites) > nMeshMaxSites:
+            msg = 'Error: you have ' + str(len(lstSites)) + ' sites, max ' + str(nMeshMaxSites) + ' sites can be analysed together.\n'
+            msg = msg + 'Use: calc Site1 Site2 Site3 ...'
+            yield from self.sender.sendMessage(msg)
+            return;
+        yield from self.mesh(dirname, chat_id, lstSites)
+
+    # cov (o): coverage map of a site
+    @registry.command('cov', 'o')
+    @asyncio.coroutine
+    def cmd_cov(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        if nCmdFields < 4:
+            yield from self.sender.sendMessage(hlp_dict['cov'] + '\n')
+            return;
+        site = sites.get(chat_id, commands[1])
+        if site is None:
+            yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
+            return;
+        if is_number(site.antenna.rstrip('m')) == False:
+            yield from self.sender.sendMessage('the antenna height is not correct: ' + site.antenna + '. Change it with the ant command')
+            return;
+        radius = us_decimal_sep(commands[2])
+        step = us_decimal_sep(commands[3])
+        hAntenna = us_decimal_sep(commands[4]) if nCmdFields >= 5 else '3'
+        if not (is_number(radius) and is_number(step) and is_number(hAntenna)):
+            yield from self.sender.sendMessage(hlp_dict['cov'] + '\n')
+            return;
+        radius = float(radius)
+        step = float(step)
+        if radius <= 0.0 or radius > nCovMaxRadius or step <= 0.0 or step > radius:
+            msg = 'Invalid radius or step: the radius must be within 0 and ' + "{0:.0f}".format(nCovMaxRadius)
+            msg = msg + ' km, the step within 0 and the radius'
+            yield from self.sender.sendMessage(msg)
+            return;
+        hrx = float(hAntenna)
+        if (hrx<0.0) or (hrx>300.0):
+            yield from self.sender.sendMessage('Invalid antenna height: ' + str(hrx) + '.\nHeight must be greater than 0 and  should be less than 300m')
+            return;
+
+        bearings, distances = covmap.grid(radius * 1000.0, step * 1000.0)
+        params = settings.params(chat_id)
+        title = site.name + ': coverage ' + "{0:.1f}".format(radius) + ' km, receiver ' + hAntenna + ' m, '
+        title = title + "{0:.0f}".format(params[1]) + ' MHz'
+        loop = asyncio.get_event_loop()
+        values = None
+        bTerrain = False
+        if covpool is not None and tiles is not None:
+            # terrain at the site (the first time the tile is converted to npy)
+            with tracer.span('thread:terrain'):
+                elev = yield from loop.run_in_executor(None, tiles.elevation, site.lat, site.lon)
+            bTerrain = not math.isnan(float(elev))
+        if bTerrain:
+            yield from self.sender.sendMessage('Coverage of ' + site.name + ': ' + str(len(bearings)) + ' radials, '
+                                               + str(len(distances)) + ' points each')
+            values = yield from self.coverage_native(site, bearings, distances, hrx, params)
+            finite = sorted(x for row in values for x in row if x == x)
+            if not finite:
+                # terrain not available: rfprobe
+                values = None
+        if values is not None:
+            caption = 'Median path loss ' + "{0:.0f}".format(finite[len(finite) // 2]) + ' dB'
+            caption = caption + ', min ' + "{0:.0f}".format(finite[0]) + ' dB'
+            nMissing = len(bearings) * len(distances) - len(finite)
+            if nMissing:
+                caption = caption + ', ' + str(nMissing) + ' points without terrain'
+            with tracer.span('thread:render'):
+                png = yield from loop.run_in_executor(None, covmap.render, values, bearings, distances, title)
+        else:
+            nPoints = len(bearings) * len(distances)
+            if nPoints > nCovMaxJobs:
+                msg = 'Error: ' + str(nPoints) + ' points, max ' + str(nCovMaxJobs) + ' points can be analysed by rfprobe.\n'
+                msg = msg + 'Use a larger step or a smaller radius'
+                yield from self.sender.sendMessage(msg)
+                return;
+            yield from self.sender.sendMessage('Coverage of ' + site.name + ': ' + str(nPoints) + ' points analysed by rfprobe')
+            values = yield from self.coverage_rfprobe(dirname, chat_id, site, bearings, distances, hAntenna, params)
+            flat = [x for row in values for x in row if x is not None]
+            nLos = len([x for x in flat if x >= 1])
+            nFresnel = len([x for x in flat if x == 2])
+            caption = 'LOS to ' + str(nLos) + '/' + str(nPoints) + ' points, Fresnel zone clear to ' + str(nFresnel)
+            with tracer.span('thread:render'):
+                png = yield from loop.run_in_executor(None, covmap.render, values, bearings, distances, title, True)
+        yield from self.send_photo(chat_id, site.name + '_cov.png', png, caption)
+
+    # queue (q): state of the analysis queue
+    @registry.command('queue', 'q')
+    @asyncio.coroutine
+    def cmd_queue(self, chat_id, commands, dirname):
+        # state of the analysis queue
+        cs = resultcache.stats()
+        txt = scheduler.stats_text(chat_id)
+        txt = txt + 'Result cache: ' + str(cs['hits']) + ' hits, ' + str(cs['misses']) + ' misses, '
+        txt = txt + str(cs['entries']) + ' analyses, ' + str(cs['bytes'] // 1024) + ' kB\n'
+        fs = fileidcache.stats()
+        txt = txt + 'Images sent without upload: ' + str(fs['hits']) + ', uploaded: ' + str(fs['misses']) + '\n'
+        if jobs is not None:
+            qs = yield from asyncio.get_event_loop().run_in_executor(queuepool, jobs.stats)
+            txt = txt + 'Worker daemons alive: ' + str(qs['workers']) + ', jobs waiting: ' + str(qs['pending'])
+            txt = txt + ', running: ' + str(qs['leased']) + '\n'
+        yield from self.sender.sendMessage(txt)
+
+    # rep (r): path profile between Site1 and Site2 with full report
+    @registry.command('rep', 'r')
+    @asyncio.coroutine
+    def cmd_rep(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # analysis with full report
+        # -f: full analysis also if the quick check fails
+        force = '-f' in commands
+        if force:
+            commands.remove('-f')
+            nCmdFields = len(commands)
+        if nCmdFields < 3:
+            yield from self.sender.sendMessage(hlp_dict['rep'] + '\n')
+            return;
+        # check if the two files .spl was defined
+        site1 = sites.get(chat_id, commands[1])
+        if site1 is None:
+            yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
+            return;
+        site2 = sites.get(chat_id, commands[2])
+        if site2 is None:
+            yield from self.sender.sendMessage('Error: site file ' + commands[2] + ' not exist !!!')
+            return;
+        if not force:
+            hopeless = yield from self.quick_check(chat_id, site1, site2)
+            if hopeless:
+                return;
+        #
+        outfile=commands[1] + '_' + commands[2]
+        artifacts = yield from self.probe_link(dirname, chat_id, 'rep', site1, site2)
+        if '.png' not in artifacts:
+            yield from self.sender.sendMessage('Error: the analysis of ' + outfile + ' failed')
+            return;
+
+        # show image
+        yield from self.send_photo(chat_id, outfile + '.png', artifacts['.png'])
+        yield from self.sender.sendMessage("Results")
+
+        # show the full report
+        yield from self.send_report(chat_id, outfile + '.txt', artifacts.get('.txt'))
+
+    # pow (w): graph of power versus distance for wireless link
+    @registry.command('pow', 'w')
+    @asyncio.coroutine
+    def cmd_pow(self, chat_id, commands, dirname):
+        nCmdFields = len(commands)
+        # power graph
+        if nCmdFields < 9:
+            yield from self.sender.sendMessage(hlp_dict['pow'] + '\n')
+            return;
+        # check if the two files .spl was defined
+        site1 = sites.get(chat_id, commands[1])
+        if site1 is None:
+            yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
+            return;
+        site2 = sites.get(chat_id, commands[2])
+        if site2 is None:
+            yield from self.sender.sendMessage('Error: site file ' + commands[2] + ' not exist !!!')
+            return;
+        #
+        outfile=commands[1] + '_' + commands[2] + '_pow'
+        # ------------------------------
+        # get values
+        TxPw = (commands[3]);
+        TxPw = float(TxPw)
+        # yield from self.sender.sendMessage('TxPw ' + str(TxPw))
+        TxCl = (commands[4]);
+        TxCl = float(TxCl)
+        # modify TxCl 08/11: correct value is <= 0.0
+        if (TxCl > 0.0):
+            yield from self.sender.sendMessage('Error: TxCl (transmitter cable loss) value is ' + str(TxCl) + '. It must be <= 0 !!!')
+            return;
+        TxAg = (commands[5]);
+        TxAg = float(TxAg)
+        RxAg = (commands[6]);
+        RxAg = float(RxAg)
+        RxCl = (commands[7]);
+        RxCl = float(RxCl)
+        # modify RxCl 08/11: correct value is <= 0.0
+        if (RxCl > 0.0):
+            yield from self.sender.sendMessage('Error: RxCl (receiver cable loss) value is ' + str(RxCl) + '. It must be <= 0 !!!')
+            return;
+        RxSe = (commands[8]);
+        RxSe = float(RxSe)
+        # modify RxSe 08/11: correct value is < 0.0
+        if (RxSe >= 0.0):
+            yield from self.sender.sendMessage('Error: RxSe (receiver sensitivity) value is ' + str(RxSe) + '. It must be < 0 !!!')
+            return;
+        # ------------------------------
+        params = settings.params(chat_id)
+        power = [TxPw, TxCl, TxAg, RxAg, RxCl, RxSe]
+        job = jobqueue.make_job(chat_id, 'pow', site1, site2, params, outfile, power)
+        # the key of the result cache depends on sites, power values and parameters
+        cachekey = rfcache.key('pow', [site1.qth(), site2.qth()], list(params) + power)
+
+        artifacts = yield from self.run_job(dirname, chat_id, job, cachekey)
+        if '.png' not in artifacts:
+            yield from self.sender.sendMessage('Error: the analysis of ' + outfile + ' failed')
+            return;
+
+        # show image
+        yield from self.send_photo(chat_id, outfile + '.png', artifacts['.png'])
+
+    # trace (admins only): tracing of the updates
+    #   trace            state of the tracer
+    #   trace on|off     enable/disable the tracing
+    #   trace slow <s>   threshold (s) of the updates written to traces/
+    @registry.command('trace')
+    @asyncio.coroutine
+    def cmd_trace(self, chat_id, commands, dirname):
+        if chat_id not in admins:
+            yield from self.sender.sendMessage('Command error!!! Use hlp command to see command list')
+            return
+        nCmdFields = len(commands)
+        if nCmdFields == 2 and commands[1] in ('on', 'off'):
+            tracer.enabled = commands[1] == 'on'
+        elif nCmdFields == 3 and commands[1] == 'slow' and is_number(us_decimal_sep(commands[2])):
+            tracer.slow = float(us_decimal_sep(commands[2]))
+        elif nCmdFields != 1:
+            yield from self.sender.sendMessage('Use: trace [on|off|slow <s>]')
+            return
+        txt = 'tracing ' + ('on' if tracer.enabled else 'off') + ', slow updates > ' + str(tracer.slow) + ' s'
+        txt = txt + ', ' + str(tracer.dumps) + ' written to ' + tracer.dir
+        yield from self.sender.sendMessage(txt)
+
     # ==========================================================
     @asyncio.coroutine
     def on_message(self, msg):
         content_type, chat_type, chat_id = telepot.glance(msg)
+        mMessages.inc(content_type)
+        if not tracer.enabled:
+            yield from self.handle_message(msg, content_type, chat_id)
+            return
+        # name of the trace: update:<command> or update:<content type>
+        name = content_type
+        if content_type == 'text':
+            words = msg['text'].strip().lower().split()
+            cmd = registry.lookup(words[0]) if words else None
+            name = cmd.name if cmd is not None else 'text'
+        yield from tracer.update('update:' + name, chat_id, self.handle_message(msg, content_type, chat_id))
 
+    @asyncio.coroutine
+    def handle_message(self, msg, content_type, chat_id):
         #------------------------------------------------
         dirname = os.path.dirname(os.path.abspath(__file__))
         #------------------------------------------------
-        global flag_SetPos
+        state = chatstates.get(chat_id)
 
-        if flag_SetPos == True:
-            # original enabled.
-            # flag_SetPos = False
-            # modify 12/07
-            # the flag_SetPos has moved inside test
+        if state is not None and state.get('step') == 'setpos':
+            # location sent, waiting for "<name> <antenna height>"
             if content_type == 'text':
                 yield from self.sender.sendMessage(msg['text'].strip().lower())
                 commands = msg['text'].strip().lower().split()
@@ -633,15 +1694,15 @@ class SplatBot(telepot.helper.ChatHandler):
                     yield from self.sender.sendMessage( msg )
                     return;
                 
-                # modify 12/07 flag_SetPos moved here
-                flag_SetPos = False
+                # modify 12/07 state cleared here
+                chatstates.clear(chat_id)
                 yield from self.sender.sendMessage('Values inserted: [' + commands[0] + '][' + commands[1] + ']')
-                setPos2Qth(dirname, chat_id, commands[0] , commands[0], commands[1])
+                setPos2Qth(chat_id, commands[0] , commands[0], commands[1], state)
                 yield from self.sender.sendMessage('Site file ' + commands[0] + ' created')
             
             else:
                 # command different to text
-                flag_SetPos = False
+                chatstates.clear(chat_id)
             
             return;
         
@@ -668,47 +1729,55 @@ class SplatBot(telepot.helper.ChatHandler):
             jstring = json.dumps(msg['location'])
             # yield from self.sender.sendMessage('Position inserted: ' + msg['location'])
             yield from self.sender.sendMessage('Position inserted: ' + jstring)
-            outfile = dirname + '/user/' + str(chat_id) + '/' + 'location.txt'
-            out_file = open(outfile, 'wt')
-            # print(jstring, file=out_file)
-            loc_dict = json.loads(jstring)
-            global lon
-            global lat
-            # rint(len(loc_dict), file=out_file)
-            print(loc_dict['latitude'], file=out_file)
-            print(loc_dict['longitude'], file=out_file)
-            out_file.flush()
-            out_file.close()
-            
-            flag_SetPos = True
+            # the position waits in the conversation state of the chat
+            loc_dict = msg['location']
+            chatstates.set(chat_id, {'step': 'setpos', 'lat': loc_dict['latitude'], 'lon': loc_dict['longitude']})
             yield from self.sender.sendMessage('To create the site data file, enter:\n<name> <antenna height>')
             return
         
         elif content_type == 'photo':
             # ------------------------------------------------------
             # content_type photo
-            return;                 # command disabled
-            
-            # command photo:
-            yield from self.sender.sendMessage(msg['photo'])
-            photo_id = msg['photo'][-1:][0]['file_id']
-            width = msg['photo'][-1:][0]['width']
-            height = msg['photo'][-1:][0]['height']
-            to_save = './downloads/' + photo_id
-            yield from self.sender.sendMessage('Trying to download the file({}*{}) you sent...'.format(width, height))
-            yield from bot.download_file(photo_id, to_save)
-            yield from self.sender.sendMessage('Download complete. Start OCR...')
+            #
+            # photo of a coordinate sheet or a table of sites:
+            # each row <name> <lat> <lon> [<antenna height>] creates a site
+            if ocrpool is None:
+                return
+            if not ocr.available():
+                yield from self.sender.sendMessage('OCR of the photos is not available')
+                return
+            # the last photo size is the original image
+            photo = msg['photo'][-1]
             try:
-                text = pytesseract.image_to_string(Image.open(to_save), lang=self._lang)
-            except:
+                # place in the pool taken before the download, released
+                # also if the download fails
+                with ocrpool.reserve():
+                    buf = io.BytesIO()
+                    with tracer.span('telegram:download_file'):
+                        yield from self.bot.download_file(photo['file_id'], buf)
+                    yield from self.sender.sendMessage('Reading the sites in the photo ({}*{})...'.format(photo['width'], photo['height']))
+                    t = time.perf_counter()
+                    with tracer.span('pool:ocr'):
+                        text = yield from ocrpool.run(buf.getvalue(), self._lang)
+            except ocr.OcrBusy:
+                yield from self.sender.sendMessage('Too many photos in progress, send it again later')
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
                 yield from self.sender.sendMessage('Failed to process OCR')
                 traceback.print_exc()
-                os.remove(to_save)
-                return;
-
-            os.remove(to_save)
-            yield from self.sender.sendMessage('Done. Removed the temp file. Here is the result:')
-            yield from self.sender.sendMessage(text)
+                return
+            mOcrTime.observe(time.perf_counter() - t)
+            found = ocr.parse_sites(text)
+            if not found:
+                yield from self.sender.sendMessage('No site found in the photo. Each row must be:\n<name> <lat> <lon> [<antenna height>]')
+                return
+            strContents = ''
+            for site in found:
+                sites.set(chat_id, site)
+                strContents = strContents + site.row() + '\n'
+            yield from self.sender.sendMessage('Sites created from the photo:\n' + strContents)
             return
 
         elif content_type == 'text':
@@ -718,725 +1787,67 @@ class SplatBot(telepot.helper.ChatHandler):
             yield from self.sender.sendMessage(msg['text'].strip().lower())
             
             commands = msg['text'].strip().lower().split()
-            nCmdFields = len(commands)
-
-           #------------------------------------------------
-            # convert commands[0] to lower case
-            # str = commands[0].lower()
-            # commands[0] = str
-
-            if check_cmd(commands[0], 'hlp', 'h') == True:
-                yield from self.sender.sendMessage('This bot is an opensource tool for the electromagnetic spectrum analysis of Terrain, loss, and RF Signal Propagation.')
-                yield from self.sender.sendMessage('List of bot commands (sorted alphabetically):')
-                # help command
-                s = sorted(hlp_dict.keys())
-                # for key in iter(hlp_dict.keys()):
-                hlp = ''
-                for key in iter(s):
-                    hlp = hlp + key + '\n'
-                    hlp = hlp + hlp_dict[key] + '\n'
-                    if (len(hlp)>2048):
-                        yield from self.sender.sendMessage(hlp)
-                        hlp = ''
-                   # yield from self.sender.sendMessage(key + '\n')
-                   # yield from self.sender.sendMessage(hlp_dict[key] + '\n')
-                # yield from self.sender.sendMessage('----------------\n')
-                hlp = hlp + '\n'
-                yield from self.sender.sendMessage(hlp + '\n')
-                # for key in hlp_dict:
-                #     print(key + '\n\n')
-                #     print(hlp_dict[key] + '\n\n')
-                #     yield from self.sender.sendMessage(key + '\n')
-                #     yield from self.sender.sendMessage(hlp_dict[key] + '\n')
-                return;
-                
-            elif check_cmd(commands[0], 'site', 's') == True:
-                # modify 27/07:
-                # if the user don't insert antenna height, use a default of 30m
-                # n. full parameters. 5
-                # site name lat lon height
-                # original if nCmdFields < 5:
-                # modify 27/07
-                if nCmdFields < 4:
-                    yield from self.sender.sendMessage(hlp_dict['site'] + '\n')
-                    return;
-                    
-                # generate qth file
-                # filename
-                outQth = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                mkdir_p(outQth)                 # if not exist, create dir that contain file
-                # convert lan, lon
-                
-                # latitude
-                lat = us_decimal_sep(commands[2]);
-                if is_number(lat) == False:
-                    msg = 'Invalid latitude value: ' + str(lat) + '.\nLatitude must be within -90 and +90 degrees'
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                    
-                lat = float(lat)
-                if (lat<-90.0) or (lat>90.0):
-                    msg = 'Invalid latitude value: ' + str(lat) + '.\nLatitude must be within -90 and +90 degrees'
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                
-                # longitude
-                lon = us_decimal_sep(commands[3]);
-                if is_number(lon) == False:
-                    msg = 'Invalid longitude value: ' + str(lon) + '.\nLongitude must be within -180 and +180 degrees'
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                    
-                lon = float(lon)
-                if (lon<-180.0) or (lon>180.0):
-                    msg = 'Invalid longitude value: ' + str(lon) + '.\nLongitude must be within -180 and +180 degrees'
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                
-                # save data in qth
-                if lon > 0.0:
-                    lon = (360.0-lon)
-                else:
-                    lon = -lon
-                
-                # antenna height
-                # modify 27/07
-                if nCmdFields >= 5:
-                    # use user antenna value
-                    hAntenna = us_decimal_sep(commands[4]);
-                else:
-                    # use antenna default
-                    hAntenna = '3'
-                    
-                if is_number(hAntenna) == False:
-                    msg = 'the antenna height is not correct: ' + hAntenna
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                value = float(hAntenna)
-                if (value<0.0) or (value>300.0):
-                    msg = 'Invalid antenna height: ' + str(value) + '.\nHeight must be greater than 0 and  should be less than 300m'
-                    print(msg)
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                
-                # add meter measurement units
-                hAntenna =  hAntenna + 'm'
-                # set first row of qth file.
-                # If there are no other parameters, the first row is the qth file name
-                # yield from self.sender.sendMessage(str(nCmdFields))
-                
-                msg = ''
-                if nCmdFields >= 6:
-                    msg = commands[5]
-                    for num in range(6,nCmdFields):
-                        msg = msg + ' ' + commands[num]
-                else:
-                    msg = commands[1]
-                
-                cmd = str(chat_id) + ' ' + msg  + ' ' + str(lat) + ' ' + str(lon)
-                # include full path of outimg
-
-                # Write a file
-                out_file = open(outQth, 'wt')
-                print(msg, file=out_file)
-                print(str(lat), file=out_file)
-                print(str(lon), file=out_file)
-                print(str(hAntenna), file=out_file)
-                out_file.flush()
-                out_file.close()
-                
-                yield from self.sender.sendMessage(cmd_dict['site'] + ' ' +commands[1] + ' created')
-                return; 
-            
-            elif check_cmd(commands[0], 'list', 'l') == True:
-                dirUser = dirname + '/user/' + str(chat_id)
-                names = ListOfFiles(dirUser, '*.qth', False)
-                # from list get the string of names
-                # strNames = "\n".join(str(x) for x in names)
-                # strNames = "\n".join(file_name(str(x)) for x in names)
-                # yield from self.sender.sendMessage(strNames)
-                #-------------------
-                # original:
-                # strContents = "\n".join(DecodeQth(str(x)) for x in names)
-                # yield from self.sender.sendMessage(strContents)
-                # new 09/08
-                strContents=''
-                for x in names:
-                    strContents = strContents + DecodeQth(str(x)) + '\n'
-                    if (len(strContents)>2048):
-                        yield from self.sender.sendMessage(strContents)
-                        strContents = ''
-                yield from self.sender.sendMessage(strContents)
-                return;
-                
-            elif check_cmd(commands[0], 'del', 'd') == True:
-                if nCmdFields < 2:
-                    yield from self.sender.sendMessage(hlp_dict['del'] + '\n')
-                    return;
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                silentremove(filename)
-                yield from self.sender.sendMessage('Data file ' + commands[1] + ' removed')
-                return;
-                
-            elif check_cmd(commands[0], 'ant', 'a') == True:
-                if nCmdFields < 2:
-                    yield from self.sender.sendMessage(hlp_dict['ant'] + '\n')
-                    return;
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                ModifyQthHeight(filename, commands[2])
-                yield from self.sender.sendMessage('In file ' + commands[1] + ' antenna height is ' + commands[2] + 'm')
-                return;
-                
-            elif check_cmd(commands[0], 'earth', 'k') == True:
-            # Ermanno request: 'e' to 'k'
-            # if commands[0] == '/earth' or commands[0] == 'earth':
-                if nCmdFields < 2:
-                    yield from self.sender.sendMessage(hlp_dict['earth'] + '\n')
-                    return;
-                    
-                # earth radius multiplier (float)
-                ## dont work!!!!!
-                ## self.set_cfg(dirname, chat_id, 'earth', commands[1])
-                # filename
-                fileName = 'earth'
-                cfgFile = dirname + '/user/' + str(chat_id) + '/' + fileName + '.cfg'
-                mkdir_p(cfgFile)                    # if not exist, create dir that contain file
-                # yield from self.sender.sendMessage(cfgFile)
-                # get value
-                value = (commands[1]);
-                value = float(value)
-                # Write the cfg file
-                out_file = open(cfgFile, 'wt')
-                print(str(value), file=out_file)
-                out_file.flush()
-                out_file.close()
-                
-                yield from self.sender.sendMessage('Value of ' + cmd_dict['earth'] + ' set to ' + str(value) )
-                return;
-
-            elif check_cmd(commands[0], 'freq', 'f') == True:
-                if nCmdFields < 2:
-                    yield from self.sender.sendMessage(hlp_dict['freq'] + '\n')
-                    return;
-                    
-                # frequency (MHz) for zone calculations (float)
-                # filename
-                fileName = 'freq'
-                cfgFile = dirname + '/user/' + str(chat_id) + '/' + fileName + '.cfg'
-                mkdir_p(cfgFile)                    # if not exist, create dir that contain file
-                # yield from self.sender.sendMessage(cfgFile)
-                # get value
-                value = (commands[1]);
-                value = float(value)
-                # Write the cfg file
-                out_file = open(cfgFile, 'wt')
-                print(str(value), file=out_file)
-                out_file.flush()
-                out_file.close()
-                
-                yield from self.sender.sendMessage('Value of ' + cmd_dict['freq'] + ' set to ' + str(value) )
-                return;
-
-            elif check_cmd(commands[0], 'perc', 'p') == True:
-                if nCmdFields < 2:
-                    yield from self.sender.sendMessage(hlp_dict['perc'] + '\n')
-                    return;
-                    
-                # Fresnel zone clearance percentage
-                # filename
-                fileName = 'perc'
-                cfgFile = dirname + '/user/' + str(chat_id) + '/' + fileName + '.cfg'
-                mkdir_p(cfgFile)                    # if not exist, create dir that contain file
-                # get value
-                value = (commands[1]);
-                value = float(value)
-                # Write the cfg file
-                out_file = open(cfgFile, 'wt')
-                print(str(value), file=out_file)
-                out_file.flush()
-                out_file.close()
-                
-                yield from self.sender.sendMessage('Value of ' + cmd_dict['perc'] + ' set to ' + str(value) )
-                return;
-                
-            elif check_cmd(commands[0], 'calc', 'c') == True: 
-                # check if the two files .spl was defined
-                if nCmdFields < 3:
-                    yield from self.sender.sendMessage(hlp_dict['calc'] + '\n')
-                    return;
-                
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Parameter error: file ' + commands[1] + ' does not exist !!!')
-                    return;
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[2] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Parameter error: file ' + commands[2] + ' does not exist !!!')
-                    return;
-                #
-                outfile=commands[1] + '_' + commands[2]
-                # original cmdspl=cmdRfProbe(dirname, chat_id, commands[2], commands[1], outfile)
-                # mr 07: inverted graph in rfprobe tool
-                cmdspl=cmdRfProbe(dirname, chat_id, commands[1], commands[2], outfile)
-                
-                os.system(cmdspl)
-                
-                # show image
-                outImg= dirname + '/user/' + str(chat_id) + '/' + outfile + '.png'
-                mkdir_p(outImg)                 # if not exist, create dir that contain file
-                # Send a file that is stored locally.
-                # check for debug: insert full path
-                # outImg='/home/marco/Documenti/rfprobe/' + commands[10] + '.png'
-                f = open(outImg, 'rb')  # image file on local disk
-                yield from bot.sendPhoto(chat_id, f)
-                yield from self.sender.sendMessage("Results")
-                
-                # show the reduced report
-                ReportRed = dirname + '/user/' + str(chat_id) + '/' + outfile + '_red.txt'
-                data = readTextFile(ReportRed)
-                # divide report in tokens 
-                reprt = data.split("\nObstructions:\n")
-                for curr_piece in reprt:
-                    if len(curr_piece) > 0:
-                        yield from self.sender.sendMessage(curr_piece)
-                
-                return;
-
-            elif check_cmd(commands[0], 'cnv', 'v') == True:
-            # conversion command
-                if nCmdFields < 4:
-                    yield from self.sender.sendMessage(hlp_dict['cnv'] + '\n')
-                    return;
-                # check the units
-                listUnit=['deg', 'dms', 'mw', 'pwrr', 'db', 'dbd', 'dbi', 'dbm', 'khz', 'mhz', 'ghz', 'm' , 'mm', 'cm', 'uv']              
-                srcUnit = (commands[2])
-                if (srcUnit in listUnit) == False:
-                    msg = 'The unit ' + srcUnit + ' is not correct.\n'
-                    msg = msg + hlp_dict['cnv'] + '\n'
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                dstUnit = (commands[3])
-                if (dstUnit in listUnit) == False:
-                    msg = 'The unit ' + dstUnit + ' is not correct.\n'
-                    msg = msg + hlp_dict['cnv'] + '\n'
-                    yield from self.sender.sendMessage( msg )
-                    return;
-                cmd = srcUnit + dstUnit
-            
-                nDigits = 2         # n. digits after comma
-                # check if the value is numeric
-                if cmd != 'dmsdeg':
-                    # the conversion is different from degrees,first,seconds and degrees unit
-                    # check input value
-                    strVal = us_decimal_sep(commands[1]);
-                    if is_number(strVal) == False:
-                        msg = 'The value to convert is not correct: ' + strVal + '.\n'
-                        msg = msg + hlp_dict['cnv'] + '\n'
-                        yield from self.sender.sendMessage( msg )
-                        return;
-                    value = float(strVal)
-                else:
-                    strVal = commands[1];
-                    
-                SpeedLight=299792458        # m/s
-                errType = -1
-                # degrees first seconds <-> degrees
-                if (cmd=='dmsdeg'):
-                    # degrees first seconds --> degrees
-                    nDigits = 5         # n. digits after comma result
-                    # Separate on ':'.
-                    strDfs = strVal.split(":")
-                    result=0.0
-                    numStr=0
-                    # Loop for each element.
-                    sign=1
-                    for elementDfs in strDfs:
-                        if (numStr==0):
-                            # degrees
-                            result=float(elementDfs)
-                            if (result<0.0):
-                                result = -result
-                                sign = -1
-                            numStr = numStr + 1
-                        elif (numStr==1):
-                            # first
-                            value=float(elementDfs)
-                            value=value / 60.0
-                            result=result + value
-                            numStr = numStr + 1
-                        elif (numStr==2):
-                            # seconds
-                            direction = elementDfs[-1].lower()      # get last char in lower case
-                            if (direction!='s') and (direction!='w') and (direction!='n') and (direction!='e'):
-                                seconds = elementDfs
-                                # msg = 'The direction of coordinate ' + strVal + ' is not correct.\n'
-                                # msg = msg + 'Correct directions are: N, S, E, W\n'
-                                # yield from self.sender.sendMessage( msg )
-                                # return;
-                            else:
-                                seconds = elementDfs[:-1]           # get string without last char
-                            value = float(seconds)
-                            value = value / 3600.0
-                            result = result + value
-                            result = sign * result
-                            if (direction=='s') or (direction=='w'):
-                                result = -result
-                            numStr = numStr + 1
-                elif (cmd=='degdms'):
-                    # degrees --> degrees first seconds
-                    if (value < 0.0):
-                        sign = '-'
-                        value = -value
-                    else:
-                        sign = '+'
-                    # divide number in degrees and dec part
-                    decimal, intVal = math.modf(value)
-                    degrees = int(intVal)
-                    value = decimal * 60.0
-                    # divide number in first and dec part
-                    decimal, intVal = math.modf(value)
-                    first = int(intVal)
-                    seconds = decimal * 60.0
-                    strResult = sign + format(degrees, '02d') + ' ' + format(first, '02d') + '\' ' + str(seconds) + '"'
-                # milliwatt <-> dbm
-                elif (cmd=='mwdbm'):
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  10.0 * math.log10(value)
-                elif (cmd=='dbmmw'): 
-                    result =  math.pow(10.0, (value/10.0))
-                # wavelen <-> freq
-                elif (cmd=='mkhz') : 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight * 1.0e-3)/(value)
-                elif (cmd=='mmhz') : 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight * 1.0e-6)/(value)
-                elif (cmd=='mmkhz'): 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight * 1)/(value)
-                elif (cmd=='cmghz'): 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight * 1.0e-7)/(value)
-                elif (cmd=='mmmhz'): 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight * 1.0e-3)/(value)
-                elif (cmd=='khzm') : 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight)/(1.0e3 * value)
-                elif (cmd=='mhzm') : 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight)/(1.0e6 * value)
-                elif (cmd=='khzmm'): 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight)/(1 * value)
-                elif (cmd=='mhzmm'): 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight)/(1.0e-3 * value)
-                elif (cmd=='ghzcm') : 
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  (SpeedLight)/(1.0e-7 * value)
-                # dbd <-> dbi
-                elif (cmd=='dbidbd'): 
-                    result = value - 2.15
-                elif (cmd=='dbddbi'): 
-                    result = value + 2.15
-                # pwrr <-> db
-                elif (cmd=='pwrrdb'):
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  10.0 * math.log10(value)
-                elif (cmd=='dbpwrr'): 
-                    result =  math.pow(10.0, (value/10.0))
-                # uv <-> dBm for 50Ohm impedance
-                elif (cmd=='uvdbm'):
-                    if (value <= 0.0):
-                        errType = 0         # value <= 0
-                    else:
-                        result =  10.0 * math.log10(value * value * 1.0e-9 / 50)
-                # microvolt <-> milliwatt for 50Ohm impedance
-                elif (cmd=='uvmw') : 
-                    result =  (value * value * 1.0e-9 / 50)
-                else:
-                    errType = 1
-                    result = 'the conversion between units can not be performed'
-
-                # print results
-                if (cmd=='degdms'):
-                    # for deg -> dms conversion
-                    msg = strVal + ' ' + srcUnit + ' = ' + strResult + ' ' + dstUnit
-                    
-                else:
-                    # for all other conversions
-                    if (errType<0):
-                        # result = round(result, nDigits)
-                        if(cmd=='dmsdeg'):
-                            result = round(result, 6)
-                            strResult = str(result)
-                        else:
-                            chk = math.fabs(result)
-                            if (chk>0.1):
-                                result = round(result, 2)
-                                strResult = str(result)
-                            else:   
-                                # use scientific notation
-                                strResult = "{0:.2e}".format(result)
-                        msg = strVal + ' ' + srcUnit + ' = ' + strResult + ' ' + dstUnit
-                    elif (errType==0):
-                        msg = 'The value ' + str(value) + ' ' + 'is lower or below 0 and cannot be converted'
-                    else:
-                        msg = 'the conversion between ' + srcUnit + ' and ' + dstUnit + ' units can not be performed'
-
-                yield from self.sender.sendMessage(msg)
+            if len(commands) == 0:
                 return;
+            # command handlers (cmd_<name>), registered in registry
+            found = yield from registry.dispatch(commands[0], self, chat_id, commands, dirname)
+            if not found:
+                yield from self.sender.sendMessage('Command error!!! Use hlp command to see command list')
+            return;
 
-            elif check_cmd(commands[0], 'rep', 'r') == True:
-                # analysis with full report
-                if nCmdFields < 3:
-                    yield from self.sender.sendMessage(hlp_dict['rep'] + '\n')
-                    return;
-                # check if the two files .spl was defined
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
-                    return;
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[2] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Error: site file ' + commands[2] + ' not exist !!!')
-                    return;
-                #
-                outfile=commands[1] + '_' + commands[2]
-                # original cmdspl=cmdRfProbe(dirname, chat_id, commands[2], commands[1], outfile)
-                # mr 07: inverted graph in rfprobe tool
-                cmdspl=cmdRfProbe(dirname, chat_id, commands[1], commands[2], outfile)
-                
-                os.system(cmdspl)
-                
-                # show image
-                outImg= dirname + '/user/' + str(chat_id) + '/' + outfile + '.png'
-                mkdir_p(outImg)                 # if not exist, create dir that contain file
-                # Send a file that is stored locally.
-                f = open(outImg, 'rb')  # image file on local disk
-                yield from bot.sendPhoto(chat_id, f)
-                yield from self.sender.sendMessage("Results")
-                
-                # show the full report
-                ReportFull = dirname + '/user/' + str(chat_id) + '/' + outfile + '.txt'
-                data = readTextFile(ReportFull)
-                # divide report in tokens 
-                reprt = data.split("\nObstructions:\n")
-                for curr_piece in reprt:
-                    if len(curr_piece) > 0:
-                        yield from self.sender.sendMessage(curr_piece)
-                
-                return;
-                
-            elif check_cmd(commands[0], 'pow', 'w') == True:
-                # power graph
-                if nCmdFields < 9:
-                    yield from self.sender.sendMessage(hlp_dict['pow'] + '\n')
-                    return;
-                # check if the two files .spl was defined
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Error: site file ' + commands[1] + ' not exist !!!')
-                    return;
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[2] + '.qth'
-                if not ChkFileExist(filename):
-                    yield from self.sender.sendMessage('Error: site file ' + commands[2] + ' not exist !!!')
-                    return;
-                #
-                outfile=commands[1] + '_' + commands[2] + '_pow'
-                # ------------------------------
-                # get values
-                TxPw = (commands[3]);
-                TxPw = float(TxPw)
-                # yield from self.sender.sendMessage('TxPw ' + str(TxPw))
-                TxCl = (commands[4]);
-                TxCl = float(TxCl)
-                # modify TxCl 08/11: correct value is <= 0.0
-                if (TxCl > 0.0):
-                    yield from self.sender.sendMessage('Error: TxCl (transmitter cable loss) value is ' + str(TxCl) + '. It must be <= 0 !!!')
-                    return;
-                TxAg = (commands[5]);
-                TxAg = float(TxAg)
-                RxAg = (commands[6]);
-                RxAg = float(RxAg)
-                RxCl = (commands[7]);
-                RxCl = float(RxCl)
-                # modify RxCl 08/11: correct value is <= 0.0
-                if (RxCl > 0.0):
-                    yield from self.sender.sendMessage('Error: RxCl (receiver cable loss) value is ' + str(RxCl) + '. It must be <= 0 !!!')
-                    return;
-                RxSe = (commands[8]);
-                RxSe = float(RxSe)
-                # modify RxSe 08/11: correct value is < 0.0
-                if (RxSe >= 0.0):
-                    yield from self.sender.sendMessage('Error: RxSe (receiver sensitivity) value is ' + str(RxSe) + '. It must be < 0 !!!')
-                    return;
-                setTxRwPowFile(dirname, chat_id, outfile, TxPw, TxCl, TxAg, RxAg, RxCl, RxSe)
-                # ------------------------------    
-                cmdspl=cmdRfPower(dirname, chat_id, commands[1], commands[2], outfile)
-                # yield from self.sender.sendMessage(cmdspl)
-                
-                os.system(cmdspl)
-                
-                # show image
-                outImg= dirname + '/user/' + str(chat_id) + '/' + outfile + '.png'
-                mkdir_p(outImg)                 # if not exist, create dir that contain file
-                # Send a file that is stored locally.
-                f = open(outImg, 'rb')  # image file on local disk
-                yield from bot.sendPhoto(chat_id, f)
-                
-                return;
-
-
-            # ------------------------------------------------------
-            # commands disabled: used to test new code
-            # ------------------------------------------------------
-            #
-            elif commands[0] == '/helpchk' or commands[0] == 'helpchk':
-                return;         # cmd disabled
-                yield from self.sender.sendMessage('command rfprobe (or /rfprobe)') 
-                yield from self.sender.sendMessage('  rfprobe $1 $2 $3 $4 $5 $6 $7 $8 $9 $10') 
-                yield from self.sender.sendMessage('  where:') 
-                yield from self.sender.sendMessage('    $1:  latitude transmitter') 
-                yield from self.sender.sendMessage('    $2:  longitude transmitter') 
-                yield from self.sender.sendMessage('    $3:  transmitter antenna height (m)') 
-                yield from self.sender.sendMessage('    $4:  latitude receiver') 
-                yield from self.sender.sendMessage('    $5:  longitude receiver') 
-                yield from self.sender.sendMessage('    $6:  receiver antenna height (m)') 
-                yield from self.sender.sendMessage('    $7:  earth radius multiplier (float)') 
-                yield from self.sender.sendMessage('    $8:  frequency (MHz) for zone calculations (float)') 
-                yield from self.sender.sendMessage('    $9:  Fresnel zone clearance percentage') 
-                yield from self.sender.sendMessage('    $10: name of png output file') 
-                yield from self.sender.sendMessage('  example:') 
-                yield from self.sender.sendMessage('  rfprobe 42.888006 11.62498 12 40.8531 9.1749 8 1.333333 5800.000 75 outimg') 
-                return;
-                
-            elif commands[0] == '/chkrfprobe' or commands[0] == 'chkrfprobe':
-                return;         # cmd disabled
-                yield from self.sender.sendMessage('chat_id=[' + str(chat_id) + ']')
-                #
-                outImg= dirname + '/user/' + str(chat_id) + '/' + commands[10] + '.png'
-                mkdir_p(outImg)                 # if not exist, create dir that contain file
-                # outImg= commands[10] + '.png'
-                cmd = dirname + '/' + 'spn.sh '
-                for num in range(1,nCmdFields):
-                    cmd = cmd + ' ' + commands[num]
-                # include user id
-                cmd = cmd + ' ' + str(chat_id)
-                # include full path of outimg
-                # cmd = cmd + ' ' + outImg
-                yield from self.sender.sendMessage(cmd) 
-                os.system(cmd)
-                yield from self.sender.sendMessage('...rfprobe analysis executed')
-                yield from self.sender.sendMessage('Send image ' + outImg)
-                # Send a file that is stored locally.
-                # for debug: full path
-                f = open(outImg, 'rb')  # image file on local disk
-                yield from bot.sendPhoto(chat_id, f)
-                yield from self.sender.sendMessage("Results")
-                return;
-
-            elif commands[0] == '/get' or commands[0] == 'get':
-                return;         # cmd disabled
-                f = open(dirname + '/giuseppe.png', 'rb')  # image file on local disk
-                yield from bot.sendPhoto(chat_id, f)
-                # response = self.sender.sendPhoto(f)
-                yield from self.sender.sendMessage("foto inviata")
-                return;
-                
-            elif commands[0] == '/check' or commands[0] == 'check':
-                return;         # cmd disabled
-                filename = dirname + '/user/' + str(chat_id) + '/' + commands[1]
-                mkdir_p(filename)                   # if not exist, create dir that contain file
-                yield from self.sender.sendMessage(filename)
-                if ChkFileExist(filename):
-                    yield from self.sender.sendMessage('file exist')
-                else:
-                    yield from self.sender.sendMessage('FILE NOT EXIST !!!')
-                return;
-                
-            elif commands[0] == '/pos' or commands[0] == 'pos':
-                return;         # cmd disabled
-                bot.telegram-location(chat_id, latitude, longitude)
-                yield from self.sender.sendMessage(str(latitude) + str(longitude))
-                return;
-            
-            elif commands[0] == '/getlang' or commands[0] == 'getlang':
-                return;         # cmd disabled
-                yield from self.sender.sendMessage('chat_id=[' + str(chat_id) + ']')
-                yield from self.sender.sendMessage(self._lang)
-                return;
-                
-            elif commands[0] == '/setlang' or commands[0] == 'setlang':
-                return;         # cmd disabled
-                self._lang = commands[1]
-                yield from self.sender.sendMessage('current lang setting: %s' % self._lang )
-                
-            elif commands[0] == '/?' or commands[0] == '?':
-                return;         # cmd disabled
-                show_keyboard = lst_cmd
-                yield from self.sender.sendMessage('Get help!', reply_markup=show_keyboard)
-                return;
-                
-            elif commands[0] == '/hidekbd' or commands[0] == 'hidekbd':
-                return;         # cmd disabled
-                hide_keyboard = {'hide_keyboard': True}
-                yield from self.sender.sendMessage('Hide helps', reply_markup=hide_keyboard)
-                return;
-
-            else :
-                if flag_SetPos == False:
-                    yield from self.sender.sendMessage('Command error!!! Use hlp command to see command list')
-                    return;
-
-                
-            # ------------------------------------------------------
-            # end of commands disabled: used to test new code
-            # ------------------------------------------------------
-                
 # ===========================================================               
 # main
 # ===========================================================               
+# (guarded: the module can be imported by the benchmarks, see bench/bench_bot.py)
+if __name__ == '__main__':
+    # BotRf bot token, BOTRF_TOKEN to use another bot (es. a dummy token
+    # with the stand-in of the load test)
+    TOKEN = os.environ.get('BOTRF_TOKEN', '208996750:AAGtHWAMCL-n3JyF6AKLXFYSdQlm7wRXVdk')
 
-# BotRf bot token
-TOKEN = '208996750:AAGtHWAMCL-n3JyF6AKLXFYSdQlm7wRXVdk'
+    # s, a chat handler is closed after this time without messages
+    nChatTimeout = float(os.environ.get('BOTRF_CHAT_TIMEOUT', 60))
 
-bot = telepot.async.DelegatorBot(TOKEN, [
-    (per_chat_id(), create_open(SplatBot, timeout=60)),
-])
-loop = asyncio.get_event_loop()
+    bot = telepot.async.DelegatorBot(TOKEN, [
+        (per_chat_id(), create_open(SplatBot, timeout=nChatTimeout)),
+    ])
+    # Bot API server: BOTRF_API_URL (default https://api.telegram.org), es. the
+    # local stand-in of the load test (bench/bench_load.py)
+    apiUrl = os.environ.get('BOTRF_API_URL', '').rstrip('/')
+    if apiUrl:
+        bot._methodurl = lambda method: apiUrl + '/bot' + TOKEN + '/' + method
+        bot._fileurl = lambda path: apiUrl + '/file/bot' + TOKEN + '/' + path
+    loop = asyncio.get_event_loop()
 
-loop.create_task(bot.message_loop())
-print('Listening ...')
+    # -----------------------------------------------------
+    # updates: long polling of getUpdates (default), or webhook server
+    # if BOTRF_WEBHOOK_PORT is set (see webhook.py)
+    nWebhookPort = int(os.environ.get('BOTRF_WEBHOOK_PORT', 0))
+    if nWebhookPort:
+        import webhook
+        secret = os.environ.get('BOTRF_WEBHOOK_SECRET', '')
+        if not secret:
+            print('BOTRF_WEBHOOK_SECRET not set')
+            sys.exit(1)
+        loop.run_until_complete(webhook.start(bot, loop,
+            os.environ.get('BOTRF_WEBHOOK_HOST', '127.0.0.1'), nWebhookPort,
+            os.environ.get('BOTRF_WEBHOOK_PATH', '/botrf'), secret,
+            url=os.environ.get('BOTRF_WEBHOOK_URL'),
+            ordered=os.environ.get('BOTRF_WEBHOOK_ORDERED', '1') != '0'))
+    else:
+        loop.create_task(bot.message_loop())
+    loop.create_task(collector.run())
+    nMetricsPort = int(os.environ.get('BOTRF_METRICS_PORT', 0))
+    if nMetricsPort:
+        loop.run_until_complete(botmetrics.start_server('127.0.0.1', nMetricsPort))
+        print('Metrics on http://127.0.0.1:' + str(nMetricsPort) + '/metrics')
+    print('Listening ...')
 
-loop.run_forever()
+    # SIGTERM (service stop) and SIGINT stop the loop; the settings
+    # changed in the last second (write-behind) are saved before exit
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        settings.flush()
+        print('Stopped')
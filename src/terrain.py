@@ -0,0 +1,232 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+# terrain.py
+# ==========
+# Native path profile engine (optional, needs numpy).
+#
+# The terrain tiles are the SPLAT! .sdf files used by rfprobe (-d maps).
+# Each tile is converted once to a numpy .npy file (maps/npy/), then it is
+# memory-mapped: the elevations are read from disk only when needed and
+# the tiles are shared by all the analyses.
+#
+# Tile format (SPLAT!): file <min_north>:<max_north>:<min_west>:<max_west>.sdf
+# (also .sdf.bz2), the longitudes are degrees west (0-360).
+# The first four lines are max_west, min_north, min_west, max_north, then
+# ippd*ippd elevations (m): data[x][y], x = latitude index (north),
+# y = longitude index (y = ippd-1 at max_west).
+#
+# Agreement with rfprobe: rfprobe takes the nearest terrain sample, this
+# engine interpolates the samples (bilinear), so the elevations of the
+# profile differ by less than the terrain variation between two samples;
+# on the 3 arc-second tiles the obstructions agree within one sample
+# (about 90 m along the path) and a few meters in height.
+#
+import os
+import os.path
+import bz2
+import glob
+import math
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371000.0            # m
+
+# -----------------------------------------------------
+# return True if the native engine can be used
+def available():
+    return np is not None
+
+# -----------------------------------------------------
+# great-circle distance (m) between two points (degrees, east positive)
+def distance(lat1, lon1, lat2, lon2):
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2.0 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+# -----------------------------------------------------
+# n points on the great circle between two points.
+# return the arrays (lat, lon, dist): degrees east positive, m from the first point
+def great_circle(lat1, lon1, lat2, lon2, n):
+    p1 = np.radians([lat1, lat2])
+    l1 = np.radians([lon1, lon2])
+    # unit vectors of the two points
+    v = np.stack([np.cos(p1) * np.cos(l1), np.cos(p1) * np.sin(l1), np.sin(p1)], axis=1)
+    omega = math.acos(max(-1.0, min(1.0, float(np.dot(v[0], v[1])))))
+    t = np.linspace(0.0, 1.0, n)
+    if omega < 1e-12:
+        pts = np.repeat(v[:1], n, axis=0)
+    else:
+        a = np.sin((1.0 - t) * omega) / math.sin(omega)
+        b = np.sin(t * omega) / math.sin(omega)
+        pts = a[:, None] * v[0] + b[:, None] * v[1]
+    lat = np.degrees(np.arcsin(np.clip(pts[:, 2], -1.0, 1.0)))
+    lon = np.degrees(np.arctan2(pts[:, 1], pts[:, 0]))
+    return lat, lon, t * omega * EARTH_RADIUS
+
+# -----------------------------------------------------
+class TerrainTiles(object):
+    def __init__(self, mapdir, cachedir=None):
+        self._mapdir = mapdir
+        self._cachedir = cachedir or os.path.join(mapdir, 'npy')
+        self._files = {}            # (min_north, min_west) -> sdf file
+        self._tiles = {}            # (min_north, min_west) -> memory-mapped array
+        self._lock = threading.Lock()
+        for filename in glob.glob(mapdir + '/*.sdf') + glob.glob(mapdir + '/*.sdf.bz2'):
+            fields = os.path.basename(filename).split('.')[0].split(':')
+            try:
+                min_north, max_north, min_west, max_west = [int(x) for x in fields]
+            except ValueError:
+                continue
+            self._files[(min_north, min_west)] = filename
+
+    # return the tile with south-east corner (min_north, min_west), None if missing
+    def tile(self, min_north, min_west):
+        key = (min_north, min_west)
+        if key in self._tiles:
+            return self._tiles[key]
+        if key not in self._files:
+            return None
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = self._load(key)
+        return self._tiles[key]
+
+    # convert the sdf file to npy (only the first time), then memory-map it
+    def _load(self, key):
+        sdf = self._files[key]
+        npy = os.path.join(self._cachedir, '%d_%d.npy' % key)
+        if not os.path.isfile(npy) or os.path.getmtime(npy) < os.path.getmtime(sdf):
+            opener = bz2.open if sdf.endswith('.bz2') else open
+            with opener(sdf, 'rb') as f:
+                values = np.array(f.read().split(), dtype=np.int32)
+            # skip the header (4 lines)
+            data = values[4:]
+            ippd = int(round(math.sqrt(len(data))))
+            data = data[:ippd * ippd].reshape(ippd, ippd).astype(np.int16)
+            if not os.path.exists(self._cachedir):
+                os.makedirs(self._cachedir)
+            tmpname = npy + '.%d.tmp' % os.getpid()
+            with open(tmpname, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmpname, npy)
+        return np.load(npy, mmap_mode='r')
+
+    # ==========================================================
+    # elevations (m) of the points lat, lon (arrays, degrees east positive).
+    # The points without terrain tile are nan.
+    # interp: 'bilinear' or 'nearest' (as rfprobe)
+    def elevation(self, lat, lon, interp='bilinear'):
+        lat = np.asarray(lat, dtype=np.float64)
+        west = np.mod(-np.asarray(lon, dtype=np.float64), 360.0)
+        north = np.floor(lat).astype(np.int64)
+        # as SPLAT!, a tile has the samples of max_west, not of min_west:
+        # west in (min_west, min_west + 1]
+        wtile = np.mod(np.ceil(west) - 1, 360).astype(np.int64)
+        elev = np.full(lat.shape, np.nan)
+        # the points are grouped by tile
+        code = north * 1000 + wtile
+        for c in np.unique(code):
+            mask = code == c
+            min_north = int(north[mask][0])
+            min_west = int(wtile[mask][0])
+            data = self.tile(min_north, min_west)
+            if data is None:
+                continue
+            ippd = data.shape[0]
+            mpi = ippd - 1
+            x = (lat[mask] - min_north) * ippd
+            y = mpi - np.mod((min_west + 1) - west[mask], 360.0) * ippd
+            if interp == 'nearest':
+                xi = np.clip(np.rint(x).astype(np.int64), 0, mpi)
+                yi = np.clip(np.rint(y).astype(np.int64), 0, mpi)
+                elev[mask] = data[xi, yi]
+                continue
+            x0 = np.clip(np.floor(x).astype(np.int64), 0, mpi - 1)
+            y0 = np.clip(np.floor(y).astype(np.int64), 0, mpi - 1)
+            fx = np.clip(x - x0, 0.0, 1.0)
+            fy = np.clip(y - y0, 0.0, 1.0)
+            elev[mask] = (data[x0, y0] * (1.0 - fx) * (1.0 - fy) +
+                          data[x0 + 1, y0] * fx * (1.0 - fy) +
+                          data[x0, y0 + 1] * (1.0 - fx) * fy +
+                          data[x0 + 1, y0 + 1] * fx * fy)
+        return elev
+
+# -----------------------------------------------------
+# elevation profile between two sites
+class Profile(object):
+    def __init__(self, lat, lon, dist, elev):
+        self.lat = lat              # degrees north
+        self.lon = lon              # degrees east
+        self.dist = dist            # m from the transmitter
+        self.elev = elev            # m
+
+# return the profile between the points (lat1, lon1) and (lat2, lon2).
+# spacing: distance (m) between the samples, default the tile resolution (3 arc-seconds).
+# Raise ValueError if the terrain of the path is not available
+def path_profile(tiles, lat1, lon1, lat2, lon2, spacing=None, interp='bilinear'):
+    if spacing is None:
+        spacing = EARTH_RADIUS * math.radians(1.0 / 1200)
+    d = distance(lat1, lon1, lat2, lon2)
+    n = max(2, int(math.ceil(d / spacing)) + 1)
+    lat, lon, dist = great_circle(lat1, lon1, lat2, lon2, n)
+    elev = tiles.elevation(lat, lon, interp)
+    if np.isnan(elev).any():
+        raise ValueError('terrain not available')
+    return Profile(lat, lon, dist, elev)
+
+# -----------------------------------------------------
+# draw the profile graph in a png file (needs PIL).
+# filename: file name or file object; clr: fresnel.Clearance of the profile
+def render_profile(profile, clr, filename, title):
+    from PIL import Image, ImageDraw
+    width, height = 800, 400
+    left, right, top, bottom = 60, 20, 30, 40
+    d = profile.dist
+    zmin = float(np.min(clr.terrain))
+    zmax = float(max(np.max(clr.los + clr.fresnel), np.max(clr.terrain)))
+    zmin = zmin - 0.05 * (zmax - zmin + 1.0)
+    zmax = zmax + 0.05 * (zmax - zmin + 1.0)
+
+    def xy(dist, z):
+        x = left + (width - left - right) * dist / max(d[-1], 1e-9)
+        y = top + (height - top - bottom) * (zmax - z) / (zmax - zmin)
+        return list(zip(x.tolist(), y.tolist()))
+
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    ground = xy(d, clr.terrain)
+    draw.polygon(ground + [(ground[-1][0], height - bottom), (ground[0][0], height - bottom)], fill=(120, 170, 90))
+    draw.line(xy(d, clr.los), fill=(0, 0, 200), width=2)
+    draw.line(xy(d, clr.los - clr.fresnel), fill=(200, 0, 0), width=1)
+    draw.line(xy(d, clr.los - clr.fresnel * clr.perc / 100.0), fill=(230, 140, 0), width=1)
+    draw.rectangle([left, top, width - right, height - bottom], outline='black')
+    draw.text((left, 8), title, fill='black')
+    draw.text((left, height - bottom + 8), '0 km', fill='black')
+    draw.text((width - right - 60, height - bottom + 8), '{0:.2f} km'.format(d[-1] / 1000.0), fill='black')
+    draw.text((4, top), '{0:.0f} m'.format(zmax), fill='black')
+    draw.text((4, height - bottom - 12), '{0:.0f} m'.format(zmin), fill='black')
+    img.save(filename, format='PNG', optimize=True)
@@ -0,0 +1,188 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# tracing.py
+# ==========
+# Opt-in tracing of the updates handled by the bot.
+#
+# When the tracer is enabled, each update is a trace, and the code marks
+# spans inside it (file I/O, subprocess, Telegram API calls):
+#     with tracer.span('file:read'):
+#         ...
+# The spans are recorded for the asyncio task of the update, so the
+# updates of different chats handled at the same time do not mix.
+# An update slower than tracer.slow seconds is written to the trace
+# directory as a folded stacks file (one line per stack, time in us),
+# the input format of flamegraph.pl and speedscope:
+#     update:calc;subprocess:rfprobe 38211000
+# The tasks started by an update (Tracer.ensure_future) add their spans
+# to the same trace; their times overlap, so the self time of the
+# parent span can be less than the sum shown by the flame graph.
+# When the tracer is disabled, span() returns a shared no-op object.
+#
+import os
+import os.path
+import time
+import asyncio
+import collections
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:
+    _current_task = asyncio.Task.current_task
+
+# -----------------------------------------------------
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_nospan = _NoSpan()
+
+# -----------------------------------------------------
+# trace of an update
+class Trace(object):
+    def __init__(self, name):
+        self.name = name
+        self.tstart = time.perf_counter()
+        self.stack = [name]             # names of the open spans
+        self.spans = []                 # (path, duration)
+
+    # trace of a task started by the update: same spans, own stack
+    def branch(self):
+        trace = Trace(self.name)
+        trace.tstart = self.tstart
+        trace.stack = list(self.stack)
+        trace.spans = self.spans
+        return trace
+
+    # folded stacks: self time (us) of each path
+    def folded(self, duration):
+        total = collections.OrderedDict()
+        children = collections.defaultdict(float)
+        for path, elapsed in self.spans:
+            total[path] = total.get(path, 0.0) + elapsed
+            children[path[:-1]] = children[path[:-1]] + elapsed
+        root = (self.name,)
+        total[root] = duration
+        lines = []
+        for path, elapsed in total.items():
+            us = int((elapsed - children.get(path, 0.0)) * 1e6)
+            if us > 0:
+                lines.append(';'.join(path) + ' ' + str(us))
+        return '\n'.join(lines) + '\n'
+
+class _Span(object):
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._trace.stack.append(self._name)
+        self._tstart = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._tstart
+        self._trace.spans.append((tuple(self._trace.stack), elapsed))
+        self._trace.stack.pop()
+        return False
+
+# -----------------------------------------------------
+class Tracer(object):
+    def __init__(self, dir, slow=5.0, enabled=False):
+        self.dir = dir
+        self.slow = slow                # s, updates slower than this are written
+        self.enabled = enabled
+        self.dumps = 0
+        self._traces = {}               # asyncio task -> Trace
+
+    def _current(self):
+        try:
+            task = _current_task()
+        except RuntimeError:
+            # not in the event loop thread
+            return None
+        return self._traces.get(task)
+
+    # span of the current update
+    def span(self, name):
+        if not self._traces:
+            return _nospan
+        trace = self._current()
+        if trace is None:
+            return _nospan
+        return _Span(trace, name)
+
+    # ==========================================================
+    # trace the coroutine of an update (name: es. update:calc).
+    # tag: added to the name of the file (es. chat_id)
+    @asyncio.coroutine
+    def update(self, name, tag, coro):
+        task = _current_task()
+        trace = Trace(name)
+        self._traces[task] = trace
+        try:
+            result = yield from coro
+        finally:
+            del self._traces[task]
+            duration = time.perf_counter() - trace.tstart
+            if duration >= self.slow:
+                self.dump(trace, duration, tag)
+        return result
+
+    # start a task of the update (es. the links of mesh):
+    # its spans are added to the trace of the current update
+    def ensure_future(self, coro):
+        task = asyncio.ensure_future(coro)
+        trace = self._current() if self._traces else None
+        if trace is not None:
+            self._traces[task] = trace.branch()
+            task.add_done_callback(lambda t: self._traces.pop(t, None))
+        return task
+
+    # write the folded stacks of a slow update
+    def dump(self, trace, duration, tag):
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        filename = os.path.join(self.dir, time.strftime('%Y%m%d-%H%M%S') + '_' + str(tag) + '_' +
+                                trace.name.replace(':', '_').replace('/', '_') + '.folded')
+        with open(filename, 'wt') as f:
+            f.write(trace.folded(duration))
+        self.dumps = self.dumps + 1
+        print('slow update ' + trace.name + ' (' + str(tag) + '): ' + "{0:.2f}".format(duration) + ' s, ' + filename)
+
+# -----------------------------------------------------
+# sender of a chat handler with a span around each Telegram API call
+class TracedSender(object):
+    def __init__(self, sender, tracer):
+        self._sender = sender
+        self._tracer = tracer
+
+    def __getattr__(self, method):
+        func = getattr(self._sender, method)
+
+        @asyncio.coroutine
+        def call(*args, **kwargs):
+            with self._tracer.span('telegram:' + method):
+                return (yield from func(*args, **kwargs))
+        return call
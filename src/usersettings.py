@@ -0,0 +1,137 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+# usersettings.py
+# ===============
+# Settings of the users (earth, freq, perc).
+#
+# All the settings are kept in memory and saved in a single json file:
+#   { "<chat_id>": {"earth": 1.3333, "freq": 5800.0, "perc": 60.0}, ... }
+# The file is written by a thread of the executor, a short time after
+# the last change (write-behind), so the event loop is never blocked.
+#
+import os
+import os.path
+import json
+import glob
+import asyncio
+import threading
+
+# -----------------------------------------------------
+# default values of the settings
+defaults = {
+    'earth': 1.3333,        # earth radius multiplier
+    'freq':  5800.0,        # frequency (MHz) for calculations
+    'perc':  60.0,          # Fresnel zone clearance percentage
+    }
+
+# -----------------------------------------------------
+class SettingsStore(object):
+    def __init__(self, filename, delay=1.0):
+        self._filename = filename
+        self._delay = delay             # s, from change to write
+        self._data = {}                 # chat_id (str) -> {name: value}
+        self._handle = None             # scheduled write
+        self._lock = threading.Lock()   # only one write at a time
+        if os.path.isfile(filename):
+            with open(filename, 'rt') as f:
+                self._data = json.load(f)
+
+    # return the value of a setting
+    def get(self, chat_id, name):
+        values = self._data.get(str(chat_id))
+        if values is None or name not in values:
+            return defaults[name]
+        return values[name]
+
+    # return the analysis parameters: (earth, freq, perc)
+    def params(self, chat_id):
+        return (self.get(chat_id, 'earth'), self.get(chat_id, 'freq'), self.get(chat_id, 'perc'))
+
+    # change a setting; the file is written later
+    def set(self, chat_id, name, value):
+        if name not in defaults:
+            raise KeyError(name)
+        self._data.setdefault(str(chat_id), {})[name] = float(value)
+        self._schedule()
+
+    # ==========================================================
+    def _schedule(self):
+        if self._handle is not None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not loop.is_running():
+            # no event loop (es. migration tool): write now
+            self.flush()
+            return
+        self._handle = loop.call_later(self._delay, self._write_behind, loop)
+
+    def _write_behind(self, loop):
+        self._handle = None
+        # snapshot taken in the loop thread, written by the executor
+        text = json.dumps(self._data, sort_keys=True)
+        loop.run_in_executor(None, self._write, text)
+
+    def _write(self, text):
+        with self._lock:
+            tmpname = self._filename + '.tmp'
+            with open(tmpname, 'wt') as f:
+                f.write(text)
+            os.replace(tmpname, self._filename)
+
+    # write the file now
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._write(json.dumps(self._data, sort_keys=True))
+
+    # ==========================================================
+    # one-shot migration from the old layout, one file for each setting:
+    #   <dirUsers>/<chat_id>/earth.cfg, freq.cfg, perc.cfg
+    # return the n. of values imported
+    def migrate(self, dirUsers):
+        n = 0
+        for name in sorted(defaults):
+            for cfgFile in glob.glob(dirUsers + '/*/' + name + '.cfg'):
+                chat_id = os.path.basename(os.path.dirname(cfgFile))
+                try:
+                    with open(cfgFile, 'r') as f:
+                        value = float(f.readline())
+                except (OSError, ValueError):
+                    continue
+                self._data.setdefault(chat_id, {})[name] = value
+                n = n + 1
+        self.flush()
+        return n
+
+# -----------------------------------------------------
+# open the settings store.
+# The first time (file not existing) the settings of the
+# old .cfg files in dirUsers are imported
+def open_store(filename, dirUsers):
+    migrate = not os.path.isfile(filename)
+    store = SettingsStore(filename)
+    if migrate:
+        n = store.migrate(dirUsers)
+        print('settings: imported ' + str(n) + ' values from ' + dirUsers + '/*/*.cfg')
+    return store
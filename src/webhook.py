@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# webhook.py
+# ==========
+# Webhook mode: Telegram sends the updates with HTTP POST requests to the
+# bot, instead of the long polling of getUpdates.
+#
+# The HTTP server (aiohttp) checks the secret token of each request
+# (header X-Telegram-Bot-Api-Secret-Token), puts the update in a queue and
+# answers at once; the updates of the queue are dispatched by
+# bot.message_loop(source=queue) to the same DelegatorBot/SplatBot handlers.
+# The server has no state, so more bot instances can run behind a load balancer.
+#
+# Test without Telegram: POST recorded updates (json) to the local server
+#   python3 webhook.py post http://127.0.0.1:8443/botrf <secret> update1.json [update2.json ...]
+# A file can contain one update, a list of updates, or one update per line.
+#
+import sys
+import json
+import hmac
+import asyncio
+import urllib.request
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_UPDATE_BYTES = 1024 * 1024          # larger requests are refused
+READ_CHUNK = 64 * 1024
+
+# -----------------------------------------------------
+# read the body of a request in chunks (stream: request.content).
+# return None as soon as it is larger than maxbytes: the limit holds also
+# for the requests without Content-Length (chunked) or with a wrong one
+@asyncio.coroutine
+def read_body(stream, maxbytes=MAX_UPDATE_BYTES):
+    chunks = []
+    size = 0
+    while True:
+        chunk = yield from stream.read(READ_CHUNK)
+        if not chunk:
+            return b''.join(chunks)
+        size = size + len(chunk)
+        if size > maxbytes:
+            return None
+        chunks.append(chunk)
+
+# -----------------------------------------------------
+# return the aiohttp request handler: validate, enqueue, answer
+def make_handler(queue, secret):
+    from aiohttp import web
+
+    @asyncio.coroutine
+    def webhook(request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), secret.encode('utf-8')):
+            return web.Response(status=403, body=b'Forbidden')
+        if request.content_length is not None and request.content_length > MAX_UPDATE_BYTES:
+            return web.Response(status=413, body=b'Too large')
+        data = yield from read_body(request.content)
+        if data is None:
+            return web.Response(status=413, body=b'Too large')
+        try:
+            update = json.loads(data.decode('utf-8'))
+        except ValueError:
+            update = None
+        if not isinstance(update, dict) or 'update_id' not in update:
+            return web.Response(status=400, body=b'Bad update')
+        # processed later by message_loop
+        queue.put_nowait(update)
+        return web.Response(body=b'OK')
+
+    return webhook
+
+# -----------------------------------------------------
+# start the webhook server and the dispatch of the updates.
+# url: public url of the webhook; if set, it is registered with setWebhook,
+# with the secret token.
+# ordered: the updates are dispatched in update_id order; with more bot
+# instances behind a load balancer each instance receives only a part of
+# the updates, so ordered must be False.
+# return the server
+@asyncio.coroutine
+def start(bot, loop, host, port, path, secret, url=None, ordered=True):
+    from aiohttp import web
+    import telepot.async
+
+    queue = asyncio.Queue()         # channel between web app and bot
+    app = web.Application(loop=loop)
+    app.router.add_route('POST', path, make_handler(queue, secret))
+    srv = yield from loop.create_server(app.make_handler(), host, port)
+    print('Webhook server on ' + host + ':' + str(port) + path)
+    if url:
+        # Bot.setWebhook does not pass the secret token
+        yield from telepot.async._post(bot._methodurl('setWebhook'), bot._http_timeout,
+                                       data={'url': url, 'secret_token': secret})
+        print('Webhook registered: ' + url)
+    loop.create_task(bot.message_loop(source=queue, ordered=ordered))
+    return srv
+
+# -----------------------------------------------------
+# read the updates of a recorded file
+def read_updates(filename):
+    with open(filename, 'rt') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # one update per line
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return data
+    return [data]
+
+# POST an update to the webhook, return the HTTP status
+def post_update(url, secret, update):
+    req = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+# ===========================================================
+# test tool
+# ===========================================================
+if __name__ == '__main__':
+    if len(sys.argv) < 5 or sys.argv[1] != 'post':
+        print('Use: ' + sys.argv[0] + ' post <webhook url> <secret> <update.json> ...')
+        sys.exit(1)
+    url = sys.argv[2]
+    secret = sys.argv[3]
+    for filename in sys.argv[4:]:
+        for update in read_updates(filename):
+            print(filename + ' update ' + str(update.get('update_id')) + ': ' + str(post_update(url, secret, update)))
@@ -0,0 +1,166 @@
+# ---------------------------------------------------
+# Copyright 2016 Marco Rainone, for ICTP Wireless Laboratory.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+# ---------------------------------------------------
+#
+#
+# workspace.py
+# ============
+# Garbage collector of the analysis outputs in the user directories.
+#
+# The older versions of the bot left the outputs of each calc, rep and pow
+# in user/<chat_id>/ (<a>_<b>.png, .txt, _red.txt, _pow.png, _pow.txt;
+# now the jobs run in scratch directories, see jobqueue.py): the collector keeps
+# the bytes of each user below userbytes and the bytes of all the users
+# below totalbytes, removing the least recently written outputs first.
+# Only the outputs (ARTIFACT_SUFFIXES) are removed: the site files (.qth)
+# and the old settings (.cfg) are never touched, and the files younger
+# than minage seconds are kept (an analysis may be sending them).
+#
+# The collector runs on the event loop: a sweep reads and removes the
+# entries for at most budget seconds at a time, then gives the loop back
+# to the other tasks, so a large tree does not delay the messages.
+#
+import os
+import os.path
+import stat
+import time
+import heapq
+import asyncio
+import traceback
+
+ARTIFACT_SUFFIXES = ('.png', '.txt', '.gz')
+
+# -----------------------------------------------------
+class WorkspaceCollector(object):
+    # userbytes, totalbytes: quotas (0: no limit)
+    def __init__(self, dir, userbytes, totalbytes, minage=600.0, budget=0.005, interval=300.0):
+        self._dir = dir
+        self._userbytes = userbytes
+        self._totalbytes = totalbytes
+        self._minage = minage
+        self._budget = budget
+        self._interval = interval
+        self._tstep = 0.0
+        # results of the last sweep
+        self.bytes = 0
+        self.files = 0
+        self.removed = 0
+        self.removed_bytes = 0
+        self.sweeps = 0
+
+    # give the loop back after budget seconds of work
+    @asyncio.coroutine
+    def _step(self):
+        if time.perf_counter() - self._tstep > self._budget:
+            yield from asyncio.sleep(0)
+            self._tstep = time.perf_counter()
+
+    # remove the output if it was not written again after the scan
+    def _remove(self, path, mtime):
+        try:
+            st = os.stat(path)
+            if st.st_mtime > mtime:
+                return 0
+            os.remove(path)
+        except OSError:
+            return 0
+        self.removed = self.removed + 1
+        self.removed_bytes = self.removed_bytes + st.st_size
+        return st.st_size
+
+    # names in a directory, [] if it can not be read
+    def _listdir(self, dir):
+        try:
+            return os.listdir(dir)
+        except OSError:
+            return []
+
+    # outputs of a user directory: [(mtime, size, path)], oldest first
+    @asyncio.coroutine
+    def _scan(self, dirUser):
+        files = []
+        for name in self._listdir(dirUser):
+            if not name.endswith(ARTIFACT_SUFFIXES):
+                continue
+            yield from self._step()
+            path = os.path.join(dirUser, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        return files
+
+    # ==========================================================
+    # one pass on the tree: per-user quota while scanning each user,
+    # then the global quota on the outputs left
+    @asyncio.coroutine
+    def sweep(self):
+        cutoff = time.time() - self._minage
+        self._tstep = time.perf_counter()
+        users = []
+        total = 0
+        nfiles = 0
+        for name in self._listdir(self._dir):
+            dirUser = os.path.join(self._dir, name)
+            if not os.path.isdir(dirUser):
+                continue
+            files = yield from self._scan(dirUser)
+            size = sum(f[1] for f in files)
+            i = 0
+            while self._userbytes and size > self._userbytes and i < len(files) and files[i][0] < cutoff:
+                yield from self._step()
+                size = size - self._remove(files[i][2], files[i][0])
+                i = i + 1
+            users.append(files[i:])
+            total = total + size
+            nfiles = nfiles + len(files) - i
+        # global quota: the oldest outputs of all the users
+        if self._totalbytes and total > self._totalbytes:
+            for mtime, size, path in heapq.merge(*users):
+                if total <= self._totalbytes or mtime >= cutoff:
+                    break
+                yield from self._step()
+                removed = self._remove(path, mtime)
+                if removed:
+                    total = total - removed
+                    nfiles = nfiles - 1
+        self.bytes = total
+        self.files = nfiles
+        self.sweeps = self.sweeps + 1
+
+    # task of the collector: a sweep every interval seconds
+    @asyncio.coroutine
+    def run(self):
+        while True:
+            try:
+                yield from self.sweep()
+            except Exception:
+                traceback.print_exc()
+            yield from asyncio.sleep(self._interval)
+
+    def stats(self):
+        return {
+            'bytes': self.bytes,
+            'files': self.files,
+            'removed': self.removed,
+            'removed_bytes': self.removed_bytes,
+            'sweeps': self.sweeps,
+            }
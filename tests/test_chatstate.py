@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_chatstate.py
+# =================
+# Tests of the stores of the conversation state (chatstate.py): choice of
+# the store from BOTRF_STATE, state shared by two bot processes, expiry.
+#
+# Use:
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import chatstate
+
+# -----------------------------------------------------
+class OpenStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_chatstate_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_memory(self):
+        for spec in (None, ''):
+            self.assertIsInstance(chatstate.open_store(spec), chatstate.MemoryStore)
+
+    # sqlite:<file> and a plain file name: the state is in the database,
+    # seen by another process (store)
+    def test_sqlite(self):
+        for spec in ('sqlite:' + os.path.join(self.dir, 'a.db'), os.path.join(self.dir, 'b.db')):
+            store = chatstate.open_store(spec)
+            self.assertIsInstance(store, chatstate.SqliteStore)
+            store.set(1, {'lat': 45.5, 'lon': 11.2})
+            self.assertEqual(chatstate.open_store(spec).get(1), {'lat': 45.5, 'lon': 11.2})
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, 'b.db')))
+
+    def test_expiry(self):
+        for store in (chatstate.MemoryStore(0.05, 10), chatstate.SqliteStore(os.path.join(self.dir, 'c.db'), 0.05)):
+            store.set(1, {'a': 1})
+            self.assertEqual(store.get(1), {'a': 1})
+            time.sleep(0.1)
+            self.assertIsNone(store.get(1))
+            self.assertEqual(len(store), 0)
+
+if __name__ == '__main__':
+    unittest.main()
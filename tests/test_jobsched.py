@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_jobsched.py
+# ================
+# Tests of the fair-share scheduler of the rfprobe jobs (jobsched.py):
+# round-robin between the chats, statistics bounded to max_chats chats
+# without dropping the chats with jobs waiting or running.
+#
+# Use:
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import jobsched
+
+# -----------------------------------------------------
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    # the jobs of two chats alternate: a1 starts at once, then chat 1
+    # (a2, a3 waiting) is first in the ring, before chat 2
+    def test_round_robin(self):
+        scheduler = jobsched.JobScheduler(1)
+        order = []
+
+        @asyncio.coroutine
+        def job(name):
+            order.append(name)
+            yield from asyncio.sleep(0)
+
+        # tasks created one at a time: gather schedules bare coroutines
+        # in no given order
+        jobs = []
+        for chat_id, name in [(1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1')]:
+            jobs.append(self.loop.create_task(scheduler.run(chat_id, 'calc', job, name)))
+        self.loop.run_until_complete(asyncio.gather(*jobs))
+        self.assertEqual(order, ['a1', 'a2', 'b1', 'a3'])
+        self.assertEqual(scheduler.chat_stats(1).jobs, 3)
+
+    # the statistics of the idle chats used least recently are dropped
+    def test_stats_bounded(self):
+        scheduler = jobsched.JobScheduler(1, max_chats=10)
+
+        @asyncio.coroutine
+        def job():
+            yield from asyncio.sleep(0)
+
+        for chat_id in range(100):
+            self.loop.run_until_complete(scheduler.run(chat_id, 'calc', job))
+        self.assertEqual(scheduler.nchats, 10)
+        self.assertEqual(scheduler.chat_stats(99).jobs, 1)
+        self.assertEqual(scheduler.chat_stats(0).jobs, 0)
+        # the report of an unknown chat does not add it
+        scheduler.stats_text(12345)
+        self.assertEqual(scheduler.nchats, 10)
+
+    # the chats with jobs waiting or running are kept over the limit
+    def test_busy_chats_kept(self):
+        scheduler = jobsched.JobScheduler(2, max_chats=3)
+        release = asyncio.Event()
+
+        @asyncio.coroutine
+        def job():
+            yield from release.wait()
+
+        @asyncio.coroutine
+        def run():
+            busy = [asyncio.ensure_future(scheduler.run(chat_id, 'calc', job)) for chat_id in range(5)]
+            yield from asyncio.sleep(0)
+            self.assertEqual(scheduler.running, 2)
+            self.assertEqual(scheduler.queued(), 3)
+            self.assertEqual(scheduler.nchats, 5)
+            release.set()
+            yield from asyncio.gather(*busy)
+        self.loop.run_until_complete(run())
+        self.assertEqual(sum(scheduler.chat_stats(i).jobs for i in range(5)), 5)
+        # the next new chat drops the idle ones down to the limit
+        self.loop.run_until_complete(scheduler.run(9, 'calc', asyncio.sleep, 0))
+        self.assertEqual(scheduler.nchats, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_linkcheck.py
+# =================
+# Tests of the quick line of sight check (linkcheck.py) without terrain:
+# radio horizon verdict, no verdict on inputs that are not valid.
+#
+# Use:
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import linkcheck
+import siteregistry
+
+# -----------------------------------------------------
+class PrecheckTest(unittest.TestCase):
+    def setUp(self):
+        self.tx = siteregistry.Site('tx', 'tx', 45.50, 11.20, '20m')
+        self.near = siteregistry.Site('near', 'near', 45.52, 11.24, '15m')
+        # about 1100 km: beyond the horizon also from the highest ground
+        self.far = siteregistry.Site('far', 'far', 55.50, 11.20, '15m')
+
+    def test_horizon(self):
+        self.assertIsNone(linkcheck.precheck(None, self.tx, self.near, 1.3333))
+        verdict = linkcheck.precheck(None, self.tx, self.far, 1.3333)
+        self.assertIn('beyond the radio horizon', verdict)
+
+    # earth radius multiplier not valid: no verdict, no exception
+    def test_earth_not_valid(self):
+        for earth in (0.0, -1.0, float('nan'), float('inf')):
+            self.assertIsNone(linkcheck.precheck(None, self.tx, self.far, earth), earth)
+
+    # antenna height not a number (stored by an old version of ant)
+    def test_antenna_not_valid(self):
+        bad = siteregistry.Site('bad', 'bad', 55.50, 11.20, 'abcm')
+        self.assertIsNone(linkcheck.precheck(None, self.tx, bad, 1.3333))
+        self.assertIsNone(linkcheck.precheck(None, bad, self.tx, 1.3333))
+
+if __name__ == '__main__':
+    unittest.main()
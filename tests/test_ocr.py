@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_ocr.py
+# ===========
+# Tests of the pool of the OCR workers (ocr.py), with a fake OCR function
+# in place of tesseract: places of the photos, new pool after a worker
+# killed.
+#
+# Use:
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import asyncio
+import unittest
+import concurrent.futures.process
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import ocr
+
+# fake OCR, run in the workers: the text is the data; the data b'crash'
+# kills the worker, as the out of memory killer
+def fake_image_to_text(data, lang='eng'):
+    if data == b'crash':
+        os._exit(1)
+    return data.decode('utf-8')
+
+# -----------------------------------------------------
+class OcrPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.image_to_text = ocr.image_to_text
+        ocr.image_to_text = fake_image_to_text
+        self.pool = ocr.OcrPool(1, 2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        ocr.image_to_text = self.image_to_text
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_reserve(self):
+        with self.pool.reserve():
+            with self.pool.reserve():
+                with self.assertRaises(ocr.OcrBusy):
+                    with self.pool.reserve():
+                        pass
+        self.assertEqual(self.pool.pending, 0)
+
+    # after a worker killed the next photos are read by a new pool
+    def test_broken_pool(self):
+        run = self.pool.image_to_text
+        self.assertEqual(self.loop.run_until_complete(run(b'site1 45.5 11.2', 'eng')), 'site1 45.5 11.2')
+        with self.assertRaises(concurrent.futures.process.BrokenProcessPool):
+            self.loop.run_until_complete(run(b'crash', 'eng'))
+        self.assertEqual(self.loop.run_until_complete(run(b'site2 45.6 11.3', 'eng')), 'site2 45.6 11.3')
+        self.assertEqual(self.pool.pending, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_rfworker.py
+# ================
+# Tests of the rfprobe worker daemon (rfworker.py) on a sqlite queue in a
+# temporary directory, with a fake rfprobe: a job that cannot be executed
+# fails (exit code -1), the worker goes on with the next jobs; an error
+# of the queue does not stop the worker nor the rfprobe running.
+#
+# Use:
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import contextlib
+import io
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import jobqueue
+import rfworker
+
+# fake rfprobe: writes the outputs of -H <out>.png
+FAKE_RFPROBE = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in -H|-pw) out="$2"; shift;; esac
+    shift
+done
+base="${out%.*}"
+echo "png" > "$base.png"
+printf 'No obstructions to LOS path\\n' > "${base}_red.txt"
+'''
+
+QTH = 'site\n45.500000\n-11.200000\n10.0m\n'
+
+def good_job(n):
+    return {'chat_id': 1, 'kind': 'calc', 'tx': {'name': 'tx', 'qth': QTH}, 'rx': {'name': 'rx', 'qth': QTH},
+            'params': [1.3333, 5800.0, 60.0], 'out': 'tx_rx%d' % n}
+
+# -----------------------------------------------------
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_rfworker_')
+        with open(os.path.join(self.dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE)
+        os.chmod(os.path.join(self.dir, 'rfprobe'), 0o755)
+        self.spec = os.path.join(self.dir, 'jobs.db')
+        self.queue = jobqueue.open_queue(self.spec)
+        self.stop = threading.Event()
+
+    def tearDown(self):
+        self.stop.set()
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def wait_result(self, job_id, timeout=10.0):
+        tend = time.time() + timeout
+        while time.time() < tend:
+            result = self.queue.result(job_id)
+            if result is not None:
+                return result
+            time.sleep(0.05)
+        self.fail('no result of job %d' % job_id)
+
+    def test_malformed_job(self):
+        bad = self.queue.put({'chat_id': 1, 'kind': 'calc', 'params': [1.3333, 5800.0, 60.0], 'out': 'x'})
+        good = self.queue.put(good_job(1))
+        # the traceback of the failed job is printed
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            workers = rfworker.start(self.spec, self.dir, 1, self.stop)
+            self.assertEqual(self.wait_result(bad), (-1, {}))
+            retcode, artifacts = self.wait_result(good)
+        self.assertIn("KeyError: 'tx'", err.getvalue())
+        self.assertEqual(retcode, 0)
+        self.assertEqual(sorted(artifacts), ['.png', '_red.txt'])
+        thread, worker = workers[0]
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(worker.jobs, 2)
+        self.stop.set()
+        thread.join(5.0)
+        self.assertFalse(thread.is_alive())
+
+    # an error of the queue does not stop the worker
+    def test_queue_error(self):
+        worker = rfworker.Worker(self.spec, self.dir, 'w1')
+        calls = []
+        lease = jobqueue.SqliteQueue.lease
+
+        def failing_lease(queue, worker_id, seconds):
+            calls.append(worker_id)
+            if len(calls) == 1:
+                raise jobqueue.sqlite3.OperationalError('database is locked')
+            return lease(queue, worker_id, seconds)
+        job_id = self.queue.put(good_job(2))
+        jobqueue.SqliteQueue.lease = failing_lease
+        try:
+            with contextlib.redirect_stderr(io.StringIO()) as err:
+                thread = threading.Thread(target=worker.run, args=(self.stop,))
+                thread.start()
+                retcode, artifacts = self.wait_result(job_id)
+        finally:
+            self.stop.set()
+            thread.join(5.0)
+            jobqueue.SqliteQueue.lease = lease
+        self.assertIn('database is locked', err.getvalue())
+        self.assertEqual(retcode, 0)
+        self.assertGreaterEqual(len(calls), 2)
+
+    # an error of the heartbeat while rfprobe runs: the job goes on and
+    # completes with the outputs of rfprobe
+    def test_heartbeat_error(self):
+        with open(os.path.join(self.dir, 'rfprobe'), 'wt') as f:
+            f.write(FAKE_RFPROBE.replace('base=', 'sleep 0.5\nbase=', 1))
+        worker = rfworker.Worker(self.spec, self.dir, 'w1')
+        calls = []
+
+        def failing_heartbeat(queue, worker_id, job_id=None, seconds=None):
+            calls.append(job_id)
+            raise jobqueue.sqlite3.OperationalError('database is locked')
+        job_id = self.queue.put(good_job(3))
+        heartbeat, interval = jobqueue.SqliteQueue.heartbeat, rfworker.HEARTBEAT
+        jobqueue.SqliteQueue.heartbeat = failing_heartbeat
+        rfworker.HEARTBEAT = 0.05
+        try:
+            with contextlib.redirect_stderr(io.StringIO()) as err:
+                thread = threading.Thread(target=worker.run, args=(self.stop,))
+                thread.start()
+                retcode, artifacts = self.wait_result(job_id)
+        finally:
+            self.stop.set()
+            thread.join(5.0)
+            jobqueue.SqliteQueue.heartbeat, rfworker.HEARTBEAT = heartbeat, interval
+        self.assertIn('database is locked', err.getvalue())
+        self.assertIn(job_id, calls)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(sorted(artifacts), ['.png', '_red.txt'])
+
+if __name__ == '__main__':
+    unittest.main()
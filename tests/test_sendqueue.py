@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_sendqueue.py
+# =================
+# Tests of the outbound queue (sendqueue.py) with a fake bot: retry of the
+# answers 429 with the files uploaded, merge of the texts.
+#
+# Use (needs telepot):
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import io
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import sendqueue
+
+import telepot.exception
+
+# bot answering 429 to the first `busy` requests; records the bytes of the
+# files read by each upload
+class FakeBot(object):
+    def __init__(self, busy=1, error_code=429):
+        self.busy = busy
+        self.error_code = error_code
+        self.uploads = []
+        self.texts = []
+
+    def _answer(self):
+        if self.busy > 0:
+            self.busy = self.busy - 1
+            raise telepot.exception.TelegramError('Too Many Requests', self.error_code,
+                                                  {'parameters': {'retry_after': 0.01}})
+
+    @asyncio.coroutine
+    def sendMessage(self, chat_id, text, **kwargs):
+        self._answer()
+        self.texts.append(text)
+        return {'chat': {'id': chat_id}, 'text': text}
+
+    @asyncio.coroutine
+    def sendPhoto(self, chat_id, photo, **kwargs):
+        # read as the FormData of telepot: to the end of the file
+        self.uploads.append(len(photo[1].read()))
+        self._answer()
+        return {'chat': {'id': chat_id}, 'photo': [{'file_id': 'photo1'}]}
+
+    @asyncio.coroutine
+    def sendDocument(self, chat_id, document=None, **kwargs):
+        self.uploads.append(len(document.read()))
+        self._answer()
+        return {'chat': {'id': chat_id}, 'document': {'file_id': 'doc1'}}
+
+# -----------------------------------------------------
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.outbox = sendqueue.Outbox(rate=0, chat_rate=0)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    # the file of a retried upload is sent again from the start
+    def test_retry_rewinds_upload(self):
+        bot = FakeBot(busy=1)
+        sender = self.outbox.sender(bot, 1)
+        reply = self.run_coro(sender.sendPhoto(('a.png', io.BytesIO(b'x' * 1000)), caption='a'))
+        self.assertEqual(reply['photo'][0]['file_id'], 'photo1')
+        self.assertEqual(bot.uploads, [1000, 1000])
+        self.assertEqual(self.outbox.retries, 1)
+
+    # file passed as keyword, not at the start: rewound to its position
+    def test_retry_rewinds_keyword_file(self):
+        bot = FakeBot(busy=2)
+        f = io.BytesIO(b'header' + b'y' * 500)
+        f.seek(6)
+        self.run_coro(self.outbox.sender(bot, 1).sendDocument(document=f))
+        self.assertEqual(bot.uploads, [500, 500, 500])
+
+    # the other errors are not retried
+    def test_error_not_retried(self):
+        bot = FakeBot(busy=1, error_code=400)
+        with self.assertRaises(telepot.exception.TelegramError):
+            self.run_coro(self.outbox.sender(bot, 1).sendPhoto(('a.png', io.BytesIO(b'x' * 10))))
+        self.assertEqual(bot.uploads, [10])
+        self.assertEqual(self.outbox.retries, 0)
+
+    # the texts queued together are sent in one message, in order with the calls
+    def test_texts_merged(self):
+        bot = FakeBot(busy=0)
+        sender = self.outbox.sender(bot, 1)
+
+        @asyncio.coroutine
+        def send():
+            yield from sender.sendMessage('a')
+            yield from sender.sendMessage('b')
+            yield from sender.sendPhoto(('a.png', io.BytesIO(b'x')))
+            yield from sender.sendMessage('c')
+            yield from self.outbox.join()
+        self.run_coro(send())
+        self.assertEqual(bot.texts, ['a\nb', 'c'])
+        self.assertEqual(self.outbox.merged, 1)
+
+if __name__ == '__main__':
+    unittest.main()
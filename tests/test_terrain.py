@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_terrain.py
+# ===============
+# Tests of the native path profile engine (terrain.py) on synthetic SPLAT!
+# tiles. The tile 45:46:348:349 (45-46 N, 11-12 E) is a plane rising
+# NORTH_STEP m for each sample to the north and EAST_STEP m for each
+# sample to the east: it is not symmetric, so a tile read upside down or
+# mirrored gives other elevations, and it is linear, so the bilinear
+# interpolation must return it exactly.
+#
+# Agreement with rfprobe: rfprobe is not part of the repository, so the
+# tests compare the bilinear profile with the nearest sample profile
+# (interp='nearest', the sampling of rfprobe): they must agree within
+# half the terrain variation between two samples (NEAREST_TOL).
+# bench/bench_engine.py --rfprobe <dir> compares with rfprobe itself.
+#
+# Use (needs numpy):
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import bz2
+import math
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import terrain
+import fresnel
+
+IPPD = 120                  # samples per degree of the synthetic tiles
+BASE = 100                  # m, elevation of the south-west corner
+NORTH_STEP = 3              # m for each sample to the north
+EAST_STEP = 7               # m for each sample to the east
+NEAREST_TOL = (NORTH_STEP + EAST_STEP) / 2.0
+
+# elevation (m) of the plane at lat, lon (degrees east)
+def plane(lat, lon):
+    return BASE + NORTH_STEP * (lat - 45.0) * IPPD + EAST_STEP * (lon - 11.0) * IPPD
+
+# write the tile 45:46:<min_west>:<max_west> with data[x][y] = elev(x, y),
+# x latitude index (north), y longitude index (y = IPPD-1 at max_west)
+def write_sdf(mapdir, elev, compress=False, min_west=348):
+    max_west = (min_west + 1) % 360
+    filename = os.path.join(mapdir, '45:46:%d:%d.sdf' % (min_west, max_west))
+    lines = [str(max_west), '45', str(min_west), '46']
+    for x in range(IPPD):
+        for y in range(IPPD):
+            lines.append(str(elev(x, y)))
+    text = ('\n'.join(lines) + '\n').encode('ascii')
+    if compress:
+        filename = filename + '.bz2'
+        text = bz2.compress(text)
+    with open(filename, 'wb') as f:
+        f.write(text)
+    return filename
+
+def plane_sample(x, y):
+    return BASE + NORTH_STEP * x + EAST_STEP * (IPPD - 1 - y)
+
+# -----------------------------------------------------
+@unittest.skipUnless(terrain.available(), 'needs numpy')
+class TerrainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_terrain_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # tiles of a new map directory with the synthetic tile
+    def tiles(self, elev=plane_sample, compress=False):
+        self.mapdir = tempfile.mkdtemp(prefix='maps_', dir=self.dir)
+        write_sdf(self.mapdir, elev, compress)
+        return terrain.TerrainTiles(self.mapdir)
+
+    # the samples are at their own latitude and longitude: the corners of
+    # the tile and the directions north and east
+    def test_orientation(self):
+        tiles = self.tiles()
+        corners = [(45.0, 11.0), (45.0, 12.0 - 1.0 / IPPD), (46.0 - 1.0 / IPPD, 11.0),
+                   (46.0 - 1.0 / IPPD, 12.0 - 1.0 / IPPD)]
+        for lat, lon in corners:
+            elev = float(tiles.elevation(lat, lon, 'nearest'))
+            self.assertAlmostEqual(elev, plane(lat, lon), places=6, msg='%f %f' % (lat, lon))
+        sw, se, nw, ne = [float(tiles.elevation(lat, lon)) for lat, lon in corners]
+        self.assertEqual(se - sw, EAST_STEP * (IPPD - 1))
+        self.assertEqual(nw - sw, NORTH_STEP * (IPPD - 1))
+        self.assertEqual(ne, BASE + (NORTH_STEP + EAST_STEP) * (IPPD - 1))
+
+    def test_bilinear(self):
+        import numpy as np
+        tiles = self.tiles()
+        rng = np.random.RandomState(1)
+        lat = 45.0 + rng.uniform(0.0, 1.0 - 1.0 / IPPD, 500)
+        lon = 11.0 + rng.uniform(0.0, 1.0 - 1.0 / IPPD, 500)
+        elev = tiles.elevation(lat, lon)
+        self.assertTrue(np.allclose(elev, plane(lat, lon), atol=1e-6))
+        # midpoint of four samples: their mean
+        lat, lon = 45.0 + 10.5 / IPPD, 11.0 + 20.5 / IPPD
+        self.assertAlmostEqual(float(tiles.elevation(lat, lon)), plane(lat, lon), places=6)
+
+    def test_nearest(self):
+        tiles = self.tiles()
+        # 0.4 samples north and 0.3 east of the sample (10, IPPD-1-20)
+        lat, lon = 45.0 + 10.4 / IPPD, 11.0 + 20.3 / IPPD
+        self.assertEqual(float(tiles.elevation(lat, lon, 'nearest')), plane_sample(10, IPPD - 1 - 20))
+
+    # the samples of max_west are in the tile, the points east of min_west
+    # are in the next tile (missing); the longitudes near 0 are in the
+    # tile 359:0 (west 359-360)
+    def test_tile_edges(self):
+        import numpy as np
+        tiles = self.tiles()
+        self.assertEqual(float(tiles.elevation(45.5, 11.0)), plane(45.5, 11.0))
+        self.assertTrue(np.isnan(tiles.elevation(45.5, 12.0)))
+        mapdir = os.path.join(self.dir, 'maps0')
+        os.makedirs(mapdir)
+        write_sdf(mapdir, plane_sample, min_west=359)
+        tiles = terrain.TerrainTiles(mapdir)
+        self.assertEqual(float(tiles.elevation(45.5, 0.0)), plane(45.5, 11.0))
+        self.assertAlmostEqual(float(tiles.elevation(45.5, 0.5)), plane(45.5, 11.5), places=6)
+
+    def test_missing_tile(self):
+        import numpy as np
+        tiles = self.tiles()
+        elev = tiles.elevation([45.5, 44.5, 45.5], [11.5, 11.5, 12.5])
+        self.assertFalse(np.isnan(elev[0]))
+        self.assertTrue(np.isnan(elev[1]))
+        self.assertTrue(np.isnan(elev[2]))
+        with self.assertRaises(ValueError):
+            terrain.path_profile(tiles, 45.5, 11.5, 45.5, 12.5)
+
+    # the tile is converted once to npy, then it is memory-mapped
+    def test_npy_cache(self):
+        import numpy as np
+        self.tiles(compress=True).tile(45, 348)
+        npy = os.path.join(self.mapdir, 'npy', '45_348.npy')
+        self.assertTrue(os.path.isfile(npy))
+        data = terrain.TerrainTiles(self.mapdir).tile(45, 348)
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data.shape, (IPPD, IPPD))
+        self.assertEqual(int(data[0, IPPD - 1]), BASE)
+
+    def test_path_profile(self):
+        import numpy as np
+        tiles = self.tiles()
+        for lat1, lon1, lat2, lon2 in [(45.1, 11.5, 45.9, 11.5), (45.5, 11.1, 45.5, 11.9),
+                                       (45.2, 11.8, 45.7, 11.3)]:
+            profile = terrain.path_profile(tiles, lat1, lon1, lat2, lon2)
+            self.assertAlmostEqual(profile.dist[-1], terrain.distance(lat1, lon1, lat2, lon2), delta=1e-3)
+            self.assertAlmostEqual(profile.lat[0], lat1, places=9)
+            self.assertAlmostEqual(profile.lon[-1], lon2, places=9)
+            self.assertTrue(np.allclose(profile.elev, plane(profile.lat, profile.lon), atol=1e-6))
+            self.assertAlmostEqual(profile.elev[0], plane(lat1, lon1), places=6)
+            self.assertAlmostEqual(profile.elev[-1], plane(lat2, lon2), places=6)
+            # rfprobe samples the nearest terrain point
+            nearest = terrain.path_profile(tiles, lat1, lon1, lat2, lon2, interp='nearest')
+            self.assertLessEqual(float(np.abs(nearest.elev - profile.elev).max()), NEAREST_TOL + 1e-9)
+
+    # a wall along the meridian 11.3 E between two sites at 11.2 and 11.8
+    # (antennas of 60 m, above the earth bulge): the obstruction is 0.1
+    # degrees from the transmitter (a tile mirrored east-west would put it
+    # at 11.7, near the receiver)
+    def test_obstruction(self):
+        wall = IPPD - 1 - int(round(0.3 * IPPD))
+        tiles = self.tiles(lambda x, y: 200 + (500 if y == wall else 0))
+        profile = terrain.path_profile(tiles, 45.5, 11.2, 45.5, 11.8)
+        clr = fresnel.Clearance(profile.dist, profile.elev, 60.0, 60.0, 1.3333, 5800.0, 60.0)
+        self.assertFalse(clr.los_clear)
+        i = int(clr.clear.argmin())
+        self.assertAlmostEqual(profile.lon[i], 11.3, delta=1.0 / IPPD)
+        spacing = terrain.EARTH_RADIUS * math.radians(1.0 / IPPD)
+        self.assertAlmostEqual(profile.dist[i], terrain.distance(45.5, 11.2, 45.5, 11.3), delta=spacing)
+        # without the wall the link is clear
+        tiles = self.tiles(lambda x, y: 200)
+        profile = terrain.path_profile(tiles, 45.5, 11.2, 45.5, 11.8)
+        clr = fresnel.Clearance(profile.dist, profile.elev, 60.0, 60.0, 1.3333, 5800.0, 60.0)
+        self.assertTrue(clr.los_clear)
+
+if __name__ == '__main__':
+    unittest.main()
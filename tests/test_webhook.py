@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# ---------------------------------------------------
+# test_webhook.py
+# ===============
+# Tests of the request handler of the webhook server (webhook.py) with
+# fake requests: secret token, size limit of the body also without
+# Content-Length (chunked) or with a wrong one, update enqueued.
+#
+# Use (needs aiohttp):
+#   python3 -m unittest discover tests
+#
+import sys
+import os
+import os.path
+import json
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import webhook
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+SECRET = 'secret1'
+
+# request of aiohttp: headers, declared Content-Length, body stream;
+# records the bytes read from the stream
+class FakeRequest(object):
+    def __init__(self, body, content_length=None, secret=SECRET):
+        self.headers = {webhook.SECRET_HEADER: secret}
+        self.content_length = content_length
+        self.content = asyncio.StreamReader()
+        self.content.feed_data(body)
+        self.content.feed_eof()
+        self.size = len(body)
+
+    def unread(self):
+        return len(self.content._buffer)
+
+# -----------------------------------------------------
+@unittest.skipUnless(aiohttp, 'needs aiohttp')
+class HandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.handler = webhook.make_handler(self.queue, SECRET)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    # return the response and the request
+    def post(self, body, **kwargs):
+        @asyncio.coroutine
+        def run():
+            request = FakeRequest(body, **kwargs)
+            response = yield from self.handler(request)
+            return response, request
+        return self.loop.run_until_complete(run())
+
+    def test_update(self):
+        update = {'update_id': 5, 'message': {'text': 'list'}}
+        response, request = self.post(json.dumps(update).encode('utf-8'))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.queue.get_nowait(), update)
+
+    def test_secret(self):
+        response, request = self.post(b'{"update_id": 1}', secret='other')
+        self.assertEqual(response.status, 403)
+        self.assertTrue(self.queue.empty())
+
+    def test_bad_update(self):
+        for body in (b'not json', b'[1, 2]', b'{"message": {}}'):
+            response, request = self.post(body)
+            self.assertEqual(response.status, 400, body)
+        self.assertTrue(self.queue.empty())
+
+    # a body larger than the limit is refused with or without Content-Length,
+    # and it is not read to the end
+    def test_too_large(self):
+        body = b'{"update_id": 1, "x": "' + b'a' * (4 * webhook.MAX_UPDATE_BYTES) + b'"}'
+        for content_length in (len(body), None, 100):
+            response, request = self.post(body, content_length=content_length)
+            self.assertEqual(response.status, 413, content_length)
+            if content_length is None or content_length < len(body):
+                self.assertGreater(request.unread(), 2 * webhook.MAX_UPDATE_BYTES)
+        self.assertTrue(self.queue.empty())
+
+    # the body at the limit is read whole
+    def test_at_limit(self):
+        head = b'{"update_id": 7, "x": "'
+        body = head + b'a' * (webhook.MAX_UPDATE_BYTES - len(head) - 2) + b'"}'
+        self.assertEqual(len(body), webhook.MAX_UPDATE_BYTES)
+        response, request = self.post(body)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.queue.get_nowait()['update_id'], 7)
+
+if __name__ == '__main__':
+    unittest.main()